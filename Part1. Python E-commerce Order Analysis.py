@@ -10,6 +10,8 @@ import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from order_analysis.cube import OrderCube
+from order_analysis.schema import apply_schema
         
 pd.set_option('display.float_format', '{:.2f}'.format)
 
@@ -93,13 +95,17 @@ print(f'Net profit margin {(orders["profit"].sum() / orders["revenue"].sum() * 1
 print(f'Discount rate {(orders["discount"].sum() / orders["revenue"].sum() * 100).round(2)}%') 
 print(f'Net profit Margin (Positive/Negative) Ratio {(orders["profit"] > 0).value_counts(normalize = True).round(2) * 100}') 
 
+#store the low-cardinality columns as categoricals and the ids/counters as compact integers
+orders = apply_schema(orders)
+print(f'Memory usage {(orders.memory_usage(deep = True).sum() / 1024 ** 2).round(2)} MB')
+
 
 ########################################## Function Development ##########################################
 
 
 '''  Description 2-1 A simple fail-safe check to ensure that all columns in the raw data exist. ''' 
 
-def check_columns():
+def check_columns(table):
         
     columns_check_object = ['order_id', 'ship_mode', 'segment', 'country', 'city', 
                             'state', 'postal_code', 'region', 'category', 'sub_category', 
@@ -123,12 +129,10 @@ def check_columns():
             
 '''  Description 2-2 A simple fail-safe check to ensure that all variables have been declared.  '''
 
-def check_variables():
+def check_variables(table, index_cols, cols):
         
-    for i in ['table', 'index_cols', 'cols']:
-        try:
-            eval(i)
-        except NameError:
+    for i, j in {'table' : table, 'index_cols' : index_cols, 'cols' : cols}.items():
+        if j is None or len(j) == 0:
             print(f'{i} column does not exist; please declare the variable')
             exit()
     print('The variable has been defined; please execute the report template')
@@ -136,7 +140,7 @@ def check_variables():
 
 '''  Description 2-3 Create a report template that presents indicators using MoM, YoY, and difference methods  '''
 
-def sales_report(table, index_cols, cols, aggfunc_pick):
+def sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2):
         
     #pivot Table
     aggfunc = {'revenue' : ['sum'], 
@@ -148,7 +152,7 @@ def sales_report(table, index_cols, cols, aggfunc_pick):
                'cost_price' : ['mean'],
                'sell_price' : ['mean']}
 
-    table = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc)
+    table = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc, observed = True)
     
     #define the column names for subsequent processing
     table_columns_percentage = list(set([(f'{i}_{j}').replace('_sum', "")
@@ -221,12 +225,12 @@ Set KPI conditions and generate Star/Review lists to identify the strengths and
  3.YoY, MoM net profit rate decrease by more than 20%.
 ''' 
 
-def kpi_list(table):
+def kpi_list(table, cols):
    
     i = ['yoy', 'mom']
     if cols == 'year':
         star_list_kpis_1 = f'revenue_{i[0]} >= 0.1 and profit_rate_{i[0]} >= 0.1'
-        star_list_kpis_2 = f'revenue_{i[0]} >= -0.2'
+        star_list_kpis_2 = f'revenue_{i[0]} >= 0.2'
 
         review_list_kpis_1 = f'revenue_{i[0]} <= -0.1 and profit_rate_{i[0]} <= -0.1'
         review_list_kpis_2 = f'revenue_{i[0]} <= -0.2'
@@ -234,21 +238,21 @@ def kpi_list(table):
 
     elif cols == 'month':
         star_list_kpis_1 = f'revenue_{i[1]} >= 0.1 and profit_rate_{i[1]} >= 0.1'
-        star_list_kpis_2 = f'revenue_{i[1]} >= -0.2'
+        star_list_kpis_2 = f'revenue_{i[1]} >= 0.2'
 
         review_list_kpis_1 = f'revenue_{i[1]} <= -0.1 and profit_rate_{i[1]} <= -0.1'
         review_list_kpis_2 = f'revenue_{i[1]} <= -0.2'
         review_list_kpis_3 = f'profit_rate_{i[1]} <= -0.2'
     
-    star_list = table.query(star_list_kpis_1 or star_list_kpis_2)
-    review_list = table.query(review_list_kpis_1 or review_list_kpis_2 or review_list_kpis_3)
+    star_list = table.query(f'({star_list_kpis_1}) or ({star_list_kpis_2})')
+    review_list = table.query(f'({review_list_kpis_1}) or ({review_list_kpis_2}) or ({review_list_kpis_3})')
 
     return star_list, review_list
 
 
 '''  Description 2-5 Enhance the readability of the report by setting columns as integers or as floats.  '''
 
-def data_types_transform(table): 
+def data_types_transform(table, time_1, time_2): 
 
     table_columns_name = []
     for i in ['revenue', 'profit', 'cost', 'discount', 'avg_list_price',  'avg_cost_price', 'avg_sell_price']:
@@ -313,17 +317,17 @@ by simplifying the chart and report generation syntax through the use of index_c
    Select the indicators to observe from the aggfunc in step 2-3, with a maximum of 6 indicators
 '''
 
-def draw_and_report(index_cols, aggfunc_pick):       
+def draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2):       
         
     if index_cols == ['month']:
-        sales_review = sales_report(table, index_cols, cols, aggfunc_pick).sort_values(by = 'month')
+        sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2).sort_values(by = 'month')
     else:
-        sales_review = sales_report(table, index_cols, cols, aggfunc_pick)
+        sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
         
     pictures = []
     if len(index_cols) == 2:
-        sales_review[f'{index_cols[0]}_{index_cols[1]}'] = (sales_review[index_cols[0]] + '_' + 
-                                                            sales_review[index_cols[1]])
+        sales_review[f'{index_cols[0]}_{index_cols[1]}'] = (sales_review[index_cols[0]].astype(str) + '_' + 
+                                                            sales_review[index_cols[1]].astype(str))
         if sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() > 12:
             sales_review = sales_review.sort_values(by = 'revenue_diff', ascending = True).head(10)   
         elif sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() <= 12:   
@@ -348,9 +352,9 @@ def draw_and_report(index_cols, aggfunc_pick):
     draw_double_bar(pictures, 0, 1, 2, '')
     
     if len(index_cols) == 2:
-        print(f'{index_cols[0]}_{index_cols[1]} sales {sales_review.pipe(data_types_transform)}')
+        print(f'{index_cols[0]}_{index_cols[1]} sales {data_types_transform(sales_review, time_1, time_2)}')
     elif len(index_cols) == 1:
-        print(f'{index_cols} sales {sales_review.pipe(data_types_transform)}')
+        print(f'{index_cols} sales {data_types_transform(sales_review, time_1, time_2)}')
 
 
 ########################################## Sales data analysis ##########################################
@@ -364,12 +368,12 @@ time_1 = table[cols].max()
 time_2 = table[cols].min()
 
 #fail-safe check
-check_columns()
-check_variables()
+check_columns(table)
+check_variables(table, index_cols, cols)
 
 #generate the report
 aggfunc_pick = ['revenue', 'revenue_share', 'profit', 'profit_rate', 'discount', 'discount_rate', 'avg_quantity', 'avg_sell_price']
-sales_review = sales_report(table, index_cols, cols, aggfunc_pick)
+sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  Description 3-1-1  Sales performance in 2023 - overall
@@ -405,10 +409,10 @@ print(f'Net profit rate_{time_1} {(perfomance.iloc[3]/perfomance.iloc[1]*100).ro
 print(f'Net profit rate_{time_2} {(perfomance.iloc[2]/perfomance.iloc[0]*100).round(1)}%')  
 print(f'discount rate_{time_1} {(perfomance.iloc[5]/perfomance.iloc[1]*100).round(1)}%')  
 print(f'discount_rate_{time_2} {(perfomance.iloc[4]/perfomance.iloc[0]*100).round(1)}%')  
-print(f'average price_{time_1} {sta_1.iloc[7].round(1)}')  
-print(f'average peice_{time_2} {sta_2.iloc[7].round(1)}')  
-print(f'average items per order_{time_1} {sta_1.iloc[2].round(2)}')  
-print(f'average items per order_{time_2} {sta_2.iloc[2].round(2)}')  
+print(f'average price_{time_1} {sta_1["sell_price"].round(1)}')  
+print(f'average peice_{time_2} {sta_2["sell_price"].round(1)}')  
+print(f'average items per order_{time_1} {sta_1["quantity"].round(2)}')  
+print(f'average items per order_{time_2} {sta_2["quantity"].round(2)}')  
 
     
 '''  Description 3-1-2  Sales performance in 2023 - overall x dimensions
@@ -430,17 +434,21 @@ print(f'average items per order_{time_2} {sta_2.iloc[2].round(2)}')
               likely adopts a tiered shipping fee structure.
 '''
 
+#build the aggregate cube once; the reports below roll it up instead of re-pivoting orders
+cube = OrderCube.from_orders(orders)
+table = cube
+
 #overall x dimensions
 for i in ['region', 'category', 'ship_mode', 'segment']:
     index_cols = [i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #segment x dimensions
 for i in ['region', 'category', 'ship_mode']:
     index_cols = ['segment', i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  Description 3-1-3 Sales performance in 2023 - overall x month
@@ -456,7 +464,7 @@ This highlights a key challenge for the platform’s strategy in 2023.
 
 index_cols = ['month']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
     
 '''  Description 3-2-1 sales performance in 2023 - category_Furniture x sub_category 
@@ -470,11 +478,11 @@ In the Furniture category,
 It is clear that the category_Furniture issues are mainly driven by the Tables and Furnishings subcategories.
 '''
 
-table = orders.copy().query('category == "Furniture"')
+table = cube.query('category == "Furniture"')
 
 index_cols = ['sub_category']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  Description 3-2-2 sales performance in 2023 - category_Furniture x dimensions
@@ -490,26 +498,26 @@ This suggests that the performance issues in these two subcategories are related
 '''
 
 #Tables, Furnishings x dimensions
-table = orders.copy().query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
+table = cube.query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
 
 for i in ['region', 'ship_mode', 'segment']:
     index_cols = ['sub_category', i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #Overall x region_ship_mode
-table = orders
+table = cube
 
 index_cols = ['region', 'ship_mode']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #Tables, Furnishings_region x ship_mode
-table = orders.copy().query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
+table = cube.query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
 
 index_cols = ['region', 'ship_mode']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  Description 3-2-3 sales performance in 2023 - category_Furniture - conclusion
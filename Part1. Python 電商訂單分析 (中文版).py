@@ -10,6 +10,8 @@ import os
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from order_analysis.cube import OrderCube
+from order_analysis.schema import apply_schema
         
 pd.set_option('display.float_format', '{:.2f}'.format)
 
@@ -91,6 +93,10 @@ print(f'淨利率 {(orders["profit"].sum() / orders["revenue"].sum() * 100).roun
 print(f'折扣率 {(orders["discount"].sum() / orders["revenue"].sum() * 100).round(2)}%') 
 print(f'正負毛比率 {(orders["profit"] > 0).value_counts(normalize = True).round(2) * 100}') 
 
+#低基數欄位設為類別型態，編號與計數欄位設為精簡的整數型態，以節省記憶體
+orders = apply_schema(orders)
+print(f'記憶體用量 {(orders.memory_usage(deep = True).sum() / 1024 ** 2).round(2)} MB')
+
 #orders.to_csv(r'C:/Users/lafk0/Desktop/orders.csv', index=False, encoding='utf-8-sig')
 
 
@@ -99,7 +105,7 @@ print(f'正負毛比率 {(orders["profit"] > 0).value_counts(normalize = True).r
 
 '''  設計說明2-1 確定Raw data各欄位都存在的簡易防呆機制  ''' 
 
-def check_columns():
+def check_columns(table):
         
     columns_check_object = ['order_id', 'ship_mode', 'segment', 'country', 'city', 
                             'state', 'postal_code', 'region', 'category', 'sub_category', 
@@ -123,12 +129,10 @@ def check_columns():
             
 '''  說明2-2 確定各項變數都已宣告的簡易防呆機制  '''
 
-def check_variables():
+def check_variables(table, index_cols, cols):
         
-    for i in ['table', 'index_cols', 'cols']:
-        try:
-            eval(i)
-        except NameError:
+    for i, j in {'table' : table, 'index_cols' : index_cols, 'cols' : cols}.items():
+        if j is None or len(j) == 0:
             print(f'{i}不存在，請設定變數')
             exit()
     print('變數已定義，請執行報表底稿')
@@ -136,7 +140,7 @@ def check_variables():
 
 '''  說明2-3 建立以總和, 平均, 比率, mom, yoy, diff方式呈現績效指標的報表底稿，以供例行性追蹤  '''
 
-def sales_report(table, index_cols, cols, aggfunc_pick):
+def sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2):
         
     #樞紐
     aggfunc = {'revenue' : ['sum'], 
@@ -148,7 +152,7 @@ def sales_report(table, index_cols, cols, aggfunc_pick):
                'cost_price' : ['mean'],
                'sell_price' : ['mean']}
 
-    table = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc)
+    table = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc, observed = True)
     
     #定義後續處理用的欄位名稱
     table_columns_percentage = list(set([(f'{i}_{j}').replace('_sum', "")
@@ -220,12 +224,12 @@ def sales_report(table, index_cols, cols, aggfunc_pick):
  3.淨利率的同比, 環比下降大於20%
 ''' 
 
-def kpi_list(table):
+def kpi_list(table, cols):
    
     i = ['yoy', 'mom']
     if cols == 'year':
         star_list_kpis_1 = f'revenue_{i[0]} >= 0.1 and profit_rate_{i[0]} >= 0.1'
-        star_list_kpis_2 = f'revenue_{i[0]} >= -0.2'
+        star_list_kpis_2 = f'revenue_{i[0]} >= 0.2'
 
         review_list_kpis_1 = f'revenue_{i[0]} <= -0.1 and profit_rate_{i[0]} <= -0.1'
         review_list_kpis_2 = f'revenue_{i[0]} <= -0.2'
@@ -233,21 +237,21 @@ def kpi_list(table):
 
     elif cols == 'month':
         star_list_kpis_1 = f'revenue_{i[1]} >= 0.1 and profit_rate_{i[1]} >= 0.1'
-        star_list_kpis_2 = f'revenue_{i[1]} >= -0.2'
+        star_list_kpis_2 = f'revenue_{i[1]} >= 0.2'
 
         review_list_kpis_1 = f'revenue_{i[1]} <= -0.1 and profit_rate_{i[1]} <= -0.1'
         review_list_kpis_2 = f'revenue_{i[1]} <= -0.2'
         review_list_kpis_3 = f'profit_rate_{i[1]} <= -0.2'
     
-    star_list = table.query(star_list_kpis_1 or star_list_kpis_2)
-    review_list = table.query(review_list_kpis_1 or review_list_kpis_2 or review_list_kpis_3)
+    star_list = table.query(f'({star_list_kpis_1}) or ({star_list_kpis_2})')
+    review_list = table.query(f'({review_list_kpis_1}) or ({review_list_kpis_2}) or ({review_list_kpis_3})')
 
     return star_list, review_list
 
 
 '''  說明2-5 透過設定特定欄位int跟其他欄位float + round(2) + %來提高報表的可讀性  '''
 
-def data_types_transform(table): 
+def data_types_transform(table, time_1, time_2): 
 
     table_columns_name = []
     for i in ['revenue', 'profit', 'cost', 'discount', 'avg_list_price',  'avg_cost_price', 'avg_sell_price']:
@@ -310,17 +314,17 @@ def draw_double_bar(pictures, column_label, column_bar1, column_bar2, y_label):
    可從2-3的aggfunc中挑選想觀察的績效指標，最多設定6個　
 '''
 
-def draw_and_report(index_cols, aggfunc_pick):       
+def draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2):       
         
     if index_cols == ['month']:
-        sales_review = sales_report(table, index_cols, cols, aggfunc_pick).sort_values(by = 'month')
+        sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2).sort_values(by = 'month')
     else:
-        sales_review = sales_report(table, index_cols, cols, aggfunc_pick)
+        sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
         
     pictures = []
     if len(index_cols) == 2:
-        sales_review[f'{index_cols[0]}_{index_cols[1]}'] = (sales_review[index_cols[0]] + '_' + 
-                                                            sales_review[index_cols[1]])
+        sales_review[f'{index_cols[0]}_{index_cols[1]}'] = (sales_review[index_cols[0]].astype(str) + '_' + 
+                                                            sales_review[index_cols[1]].astype(str))
         if sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() > 12:
             sales_review = sales_review.sort_values(by = 'revenue_diff', ascending = True).head(10)   
         elif sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() <= 12:   
@@ -345,9 +349,9 @@ def draw_and_report(index_cols, aggfunc_pick):
     draw_double_bar(pictures, 0, 1, 2, '')
     
     if len(index_cols) == 2:
-        print(f'{index_cols[0]}_{index_cols[1]} 業績 {sales_review.pipe(data_types_transform)}')
+        print(f'{index_cols[0]}_{index_cols[1]} 業績 {data_types_transform(sales_review, time_1, time_2)}')
     elif len(index_cols) == 1:
-        print(f'{index_cols} 業績 {sales_review.pipe(data_types_transform)}')
+        print(f'{index_cols} 業績 {data_types_transform(sales_review, time_1, time_2)}')
 
 
 ########################################## 業績的分析 ##########################################
@@ -361,12 +365,12 @@ time_1 = table[cols].max()
 time_2 = table[cols].min()
 
 #檢查變數與欄位
-check_columns()
-check_variables()
+check_columns(table)
+check_variables(table, index_cols, cols)
 
 #產出包含所有績效指標的報表底稿
 aggfunc_pick = ['revenue', 'revenue_share', 'profit', 'profit_rate', 'discount', 'discount_rate', 'avg_quantity', 'avg_sell_price']
-sales_review = sales_report(table, index_cols, cols, aggfunc_pick)
+sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  說明3-1-1  2023年業績 - 整體
@@ -400,10 +404,10 @@ print(f'淨利率_{time_1} {(perfomance.iloc[3]/perfomance.iloc[1]*100).round(1)
 print(f'淨利率_{time_2} {(perfomance.iloc[2]/perfomance.iloc[0]*100).round(1)}%')  
 print(f'折扣率_{time_1} {(perfomance.iloc[5]/perfomance.iloc[1]*100).round(1)}%')  
 print(f'折扣率_{time_2} {(perfomance.iloc[4]/perfomance.iloc[0]*100).round(1)}%')  
-print(f'平均售價_{time_1} {sta_1.iloc[7].round(1)}')  
-print(f'平均售價_{time_2} {sta_2.iloc[7].round(1)}')  
-print(f'平均訂單量_{time_1} {sta_1.iloc[2].round(2)}')  
-print(f'平均訂單量_{time_2} {sta_2.iloc[2].round(2)}')  
+print(f'平均售價_{time_1} {sta_1["sell_price"].round(1)}')  
+print(f'平均售價_{time_2} {sta_2["sell_price"].round(1)}')  
+print(f'平均訂單量_{time_1} {sta_1["quantity"].round(2)}')  
+print(f'平均訂單量_{time_2} {sta_2["quantity"].round(2)}')  
 
     
 '''  說明3-1-2  2023年業績 - 整體 - 各維度展開
@@ -420,17 +424,21 @@ print(f'平均訂單量_{time_2} {sta_2.iloc[2].round(2)}')
    ship_mode  不論哪種客群，都偏好Standard Class的配送模式，且營收由配送速度慢到快遞減，由此現象推測該電商為分級收取運費制
 '''
 
+#只建立一次彙總cube，以下報表皆由cube彙總，不再重複樞紐orders
+cube = OrderCube.from_orders(orders)
+table = cube
+
 #整體 x 各維度檢視
 for i in ['region', 'category', 'ship_mode', 'segment']:
     index_cols = [i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #segment x 其他維度 檢視
 for i in ['region', 'category', 'ship_mode']:
     index_cols = ['segment', i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  說明3-1-3 2023年業績 - 整體 - month展開
@@ -444,7 +452,7 @@ for i in ['region', 'category', 'ship_mode']:
 
 index_cols = ['month']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
     
 '''  說明3-2-1 2023年category_Furniture業績問題 - sub_category展開 
@@ -456,11 +464,11 @@ draw_and_report(index_cols, aggfunc_pick)
 可知Furniture的業績問題來自Tables, Furnishings兩個子類別
 '''
 
-table = orders.copy().query('category == "Furniture"')
+table = cube.query('category == "Furniture"')
 
 index_cols = ['sub_category']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  說明3-2-2 2023年category_Furniture_Tables, Furnishings業績問題 - 各維度展開 
@@ -477,26 +485,26 @@ segment   幾乎是全面性的營收衰退，連讓利促銷都無法挽回此
 '''
 
 #Tables, Furnishings x 其他維度檢視
-table = orders.copy().query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
+table = cube.query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
 
 for i in ['region', 'ship_mode', 'segment']:
     index_cols = ['sub_category', i]
     aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-    draw_and_report(index_cols, aggfunc_pick)
+    draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #整體_region x ship_mode檢視
-table = orders
+table = cube
 
 index_cols = ['region', 'ship_mode']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 #Tables, Furnishings_region x ship_mode檢視
-table = orders.copy().query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
+table = cube.query('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")')
 
 index_cols = ['region', 'ship_mode']
 aggfunc_pick = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
-draw_and_report(index_cols, aggfunc_pick)
+draw_and_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
 
 
 '''  說明3-2-3 2023年category_Furniture_Tables, Furnishings業績問題 - 小結
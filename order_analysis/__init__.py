@@ -0,0 +1,16 @@
+'''
+order_analysis
+
+Reusable building blocks behind the Part 1 sales report and the Part 2 product RFM model,
+so the same calculations can run on order histories far larger than the Kaggle sample.
+'''
+
+from order_analysis.cache import load_orders
+from order_analysis.cube import OrderCube
+from order_analysis.incremental import IncrementalState
+from order_analysis.ingest import ingest_orders, iter_orders
+from order_analysis.memo import ReportCache
+from order_analysis.preprocessing import preprocess_orders
+from order_analysis.report import ReportContext
+from order_analysis.rfm import combine_rfm_base, rfm_base, rfm_bases, rfm_scores, rfm_segment, rfm_table, rfm_tables
+from order_analysis.schema import apply_schema
@@ -0,0 +1,170 @@
+'''
+Headless batch run of the Part 1 analysis (Description 3-x).
+
+Every report section is computed without a display: the overview of Description 3-1-1 and, for every
+draw_and_report call of 3-1-2 to 3-2-2, the sales_review table and its Star/Review lists are written as
+csv files, and figures are either skipped or rendered to PNG/SVG with the non-interactive Agg backend in
+a process pool, so rendering never sits on the critical path of the report computation.
+
+    python -m order_analysis.batch orders.csv --out reports --figures png
+'''
+
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from order_analysis import trace
+from order_analysis.cube import OrderCube
+from order_analysis.preprocessing import preprocess_orders
+from order_analysis.report import chart_review, compared_periods, kpi_list, sales_overview, sales_report
+
+
+AGGFUNC_PICK = ['revenue', 'revenue_share', 'profit_rate', 'avg_quantity', 'discount_rate', 'avg_sell_price']
+OVERVIEW_PICK = ['revenue', 'revenue_share', 'profit', 'profit_rate', 'discount', 'discount_rate', 'avg_quantity',
+                 'avg_sell_price']
+
+FURNITURE = 'category == "Furniture"'
+TABLES_FURNISHINGS = 'category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")'
+
+
+def report_sections():
+    '''
+    (name, query, index_cols) of every draw_and_report call in Description 3-1-2 to 3-2-2.
+    Description 3-1-1 is a report by order_id with its overview, see run_batch.
+    '''
+    sections = []
+
+    #3-1-2 overall x dimensions, segment x dimensions
+    for i in ['region', 'category', 'ship_mode', 'segment']:
+        sections.append((f'overall_{i}', None, [i]))
+    for i in ['region', 'category', 'ship_mode']:
+        sections.append((f'overall_segment_{i}', None, ['segment', i]))
+
+    #3-1-3 overall x month
+    sections.append(('overall_month', None, ['month']))
+
+    #3-2-1, 3-2-2 Furniture drill-down
+    sections.append(('furniture_sub_category', FURNITURE, ['sub_category']))
+    for i in ['region', 'ship_mode', 'segment']:
+        sections.append((f'tables_furnishings_sub_category_{i}', TABLES_FURNISHINGS, ['sub_category', i]))
+    sections.append(('overall_region_ship_mode', None, ['region', 'ship_mode']))
+    sections.append(('tables_furnishings_region_ship_mode', TABLES_FURNISHINGS, ['region', 'ship_mode']))
+
+    return sections
+
+
+def render_figure(pictures, path):
+    '''Worker: draw the dual-bar chart with the Agg backend and save it (format from the file extension).'''
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    from order_analysis.report import draw_double_bar
+
+    fig = draw_double_bar(pictures, 0, 1, 2, '')
+    fig.savefig(path)
+    plt.close(fig)
+    return path
+
+
+def run_batch(orders, out_dir = 'reports', cols = 'year', aggfunc_pick = AGGFUNC_PICK, figures = None,
+              workers = None):
+    '''
+    Run every report section and write <section>_sales_review.csv, _star_list.csv and _review_list.csv.
+    For an orders frame, Description 3-1-1 is written first: overall_order_id_sales_review.csv and
+    overall_sales_overview.csv (see sales_overview); a cube or a lazy table has no order lines and skips it.
+    figures: None to skip figure creation, or 'png'/'svg' to render each chart in a worker process.
+    Returns {section name: sales_review}, the overview under 'overall_sales_overview'.
+    '''
+    os.makedirs(out_dir, exist_ok = True)
+
+    with trace.stage('cube', orders) as step:
+        #a cube or a lazy table (see engine.py) is used as it is
+        cube = OrderCube.from_orders(orders) if isinstance(orders, pd.DataFrame) else orders
+        step.rows_out = cube
+    time_1, time_2 = compared_periods(cube, cols)
+
+    pool = ProcessPoolExecutor(workers) if figures else None
+    renders = []
+    results = {}
+    try:
+        if isinstance(orders, pd.DataFrame):
+            with trace.stage('section', section = 'overall_order_id', index_cols = ['order_id'], query = None):
+                with trace.stage('sales_report', orders, index_cols = ['order_id']) as step:
+                    sales_review = sales_report(orders, ['order_id'], cols, OVERVIEW_PICK, time_1, time_2)
+                    step.rows_out = len(sales_review)
+                overview = sales_overview(sales_review, orders, cols, time_1, time_2)
+
+                with trace.stage('write_csv', len(sales_review)):
+                    sales_review.to_csv(os.path.join(out_dir, 'overall_order_id_sales_review.csv'), index = False)
+                    overview.to_csv(os.path.join(out_dir, 'overall_sales_overview.csv'))
+                results['overall_order_id'] = sales_review
+                results['overall_sales_overview'] = overview
+
+        for name, query, index_cols in report_sections():
+            if cols in index_cols:
+                continue
+            with trace.stage('section', section = name, index_cols = index_cols, query = query):
+                with trace.stage('slice', cube) as step:
+                    table = cube.query(query) if query else cube
+                    step.rows_out = table
+
+                with trace.stage('sales_report', table, index_cols = index_cols) as step:
+                    sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+                    step.rows_out = len(sales_review)
+                star_list, review_list = kpi_list(sales_review, cols)
+
+                with trace.stage('write_csv', len(sales_review)):
+                    sales_review.to_csv(os.path.join(out_dir, f'{name}_sales_review.csv'), index = False)
+                    star_list.to_csv(os.path.join(out_dir, f'{name}_star_list.csv'), index = False)
+                    review_list.to_csv(os.path.join(out_dir, f'{name}_review_list.csv'), index = False)
+                results[name] = sales_review
+
+                if pool is not None:
+                    with trace.stage('chart_review', len(sales_review)):
+                        _, pictures = chart_review(sales_review, table, index_cols, aggfunc_pick, time_1, time_2)
+                    renders.append(pool.submit(render_figure, pictures, os.path.join(out_dir, f'{name}.{figures}')))
+
+        #surface rendering errors only after every table has been written
+        with trace.stage('render_wait', len(renders)):
+            for i in renders:
+                i.result()
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    return results
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Run the Part 1 sales reports without a display.')
+    parser.add_argument('path', help = 'orders csv file (raw Kaggle layout or the enriched orders.csv)')
+    parser.add_argument('--out', default = 'reports', help = 'output directory')
+    parser.add_argument('--cols', default = 'year', choices = ['year', 'month'], help = 'period column to compare')
+    parser.add_argument('--figures', default = None, choices = ['png', 'svg'], help = 'render figures in this format')
+    parser.add_argument('--workers', default = None, type = int, help = 'figure rendering processes')
+    parser.add_argument('--trace', default = None,
+                        help = 'write stage timings to this file (.jsonl for a log, otherwise a Chrome trace)')
+    parser.add_argument('--trace-memory', action = 'store_true', help = 'also record allocations per stage')
+    args = parser.parse_args(argv)
+
+    tracer = trace.enable(args.trace_memory) if args.trace else None
+    try:
+        with trace.stage('parse') as step:
+            orders = pd.read_csv(args.path, encoding = 'utf-8-sig')
+            step.rows_out = len(orders)
+        orders = preprocess_orders(orders)
+        results = run_batch(orders, args.out, args.cols, figures = args.figures, workers = args.workers)
+    finally:
+        if tracer is not None:
+            trace.disable()
+            tracer.write(args.trace)
+    print(f'{len(results)} reports written to {args.out}')
+    if tracer is not None:
+        print(tracer.summary().to_string(float_format = '{:.3f}'.format))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+'''
+Benchmark of the Part 1 pipeline and the Part 2 RFM model on synthetic order tables.
+
+For every table size the synthetic raw file is written once (see synthetic.py) and then every stage runs
+in a fresh worker process, so the peak RSS of one stage is never hidden by the high-water mark of another:
+
+    parse            pd.read_csv of the raw file
+    preprocess       Description 1-3 and 1-4 (preprocess_orders)
+    sales_report     the report pivot with YoY and diff columns
+    pivot_table      the eight-metric aggregation of the report with DataFrame.pivot_table
+    group_reduce     the same aggregation with the group-reduce kernel (groupreduce.group_pivot; the numba
+                     kernel when numba is installed, the numpy one otherwise)
+    kpi_list         Star/Review lists of that report
+    draw_and_report  chart tables and the dual-bar figure (Agg backend)
+    rfm              Power BI RFM table (rfm_table)
+
+Each stage records the wall time (best of the repeats), the RSS before the stage and the peak RSS during it.
+The results are written as JSON, and two result files can be compared to spot regressions:
+
+    python -m order_analysis.benchmark --sizes 10000 1000000 --out bench.json
+    python -m order_analysis.benchmark --compare bench-old.json bench.json
+'''
+
+import argparse
+import datetime
+import gc
+import json
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.batch import AGGFUNC_PICK
+from order_analysis.ingest import CHUNKSIZE
+
+
+SIZES = [10_000, 1_000_000, 10_000_000, 100_000_000]
+STAGES = ['parse', 'preprocess', 'sales_report', 'pivot_table', 'group_reduce', 'kpi_list', 'draw_and_report', 'rfm']
+
+BENCH_DIR = os.path.join('.cache', 'benchmark')
+
+#report slice of the sales_report/kpi_list/draw_and_report stages (Description 3-2-2)
+INDEX_COLS = ['region', 'ship_mode']
+
+#wall time increase reported as a regression by compare()
+THRESHOLD = 0.1
+
+
+def _rss_mb():
+    '''Current and peak resident set size of this process in MB.'''
+    current = peak = None
+    if os.path.exists('/proc/self/status'):
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    current = int(line.split()[1]) / 1024
+                elif line.startswith('VmHWM:'):
+                    peak = int(line.split()[1]) / 1024
+    if peak is None:
+        #ru_maxrss is in KB on Linux and in bytes on macOS
+        import resource
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 ** 2 if sys.platform == 'darwin' else 1024)
+    return current, peak
+
+
+def _reset_peak_rss():
+    '''Reset the RSS high-water mark where the kernel allows it (Linux), so the peak covers one stage only.'''
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def _prepared_path(raw_path):
+    return f'{os.path.splitext(raw_path)[0]}.arrow'
+
+
+def _chunk_peaks(chunks, peaks):
+    '''Pass the chunks through, appending the peak RSS of every chunk (read, preprocessed and written) to peaks.'''
+    _reset_peak_rss()
+    for chunk in chunks:
+        yield chunk
+        peaks.append(_rss_mb()[1])
+        _reset_peak_rss()
+
+
+def prepare(n_rows, bench_dir = BENCH_DIR, seed = 0, chunksize = CHUNKSIZE):
+    '''
+    Write the synthetic raw csv and its preprocessed Arrow file for n_rows lines, once per size and seed.
+    The Arrow file is written chunk by chunk, so preparing a size never holds more than one chunk of lines.
+    '''
+    from order_analysis.cache import write_order_chunks
+    from order_analysis.ingest import iter_orders
+    from order_analysis.synthetic import write_synthetic_orders
+
+    raw_path = os.path.join(bench_dir, f'orders-{n_rows}-{seed}.csv')
+    if not os.path.exists(raw_path):
+        write_synthetic_orders(raw_path, n_rows, seed = seed)
+
+    prepared = _prepared_path(raw_path)
+    if not os.path.exists(prepared):
+        peaks = []
+        write_order_chunks(_chunk_peaks(iter_orders(raw_path, chunksize), peaks), prepared)
+        print(f'{n_rows:>11,} rows  {"prepare":<16} {len(peaks):>7} chunks  {max(peaks):9.1f} MB peak per chunk')
+
+    return raw_path
+
+
+def _setup(stage, raw_path, index_cols):
+    '''Inputs of a stage, built before the measurement starts.'''
+    from order_analysis.cache import read_orders
+    from order_analysis.report import compared_periods, sales_report
+
+    if stage == 'parse':
+        return {}
+    if stage == 'preprocess':
+        return {'raw' : pd.read_csv(raw_path, encoding = 'utf-8-sig')}
+
+    orders = read_orders(_prepared_path(raw_path))
+    time_1, time_2 = compared_periods(orders, 'year')
+    inputs = {'orders' : orders, 'time_1' : time_1, 'time_2' : time_2}
+    if stage == 'kpi_list':
+        inputs['sales_review'] = sales_report(orders, index_cols, 'year', AGGFUNC_PICK, time_1, time_2)
+    return inputs
+
+
+def _run(stage, raw_path, index_cols, inputs):
+    '''Run one stage and return the number of rows it produced.'''
+    from order_analysis.groupreduce import group_pivot
+    from order_analysis.preprocessing import preprocess_orders
+    from order_analysis.report import (PERIOD_AGGFUNC, chart_review, data_types_transform, draw_double_bar, kpi_list,
+                                       sales_report)
+    from order_analysis.rfm import rfm_table
+
+    if stage == 'parse':
+        return len(pd.read_csv(raw_path, encoding = 'utf-8-sig'))
+    if stage == 'preprocess':
+        return len(preprocess_orders(inputs['raw']))
+    if stage == 'rfm':
+        return len(rfm_table(inputs['orders']))
+    if stage == 'kpi_list':
+        star_list, review_list = kpi_list(inputs['sales_review'], 'year')
+        return len(star_list) + len(review_list)
+
+    orders, time_1, time_2 = inputs['orders'], inputs['time_1'], inputs['time_2']
+    if stage == 'sales_report':
+        return len(sales_report(orders, index_cols, 'year', AGGFUNC_PICK, time_1, time_2))
+    if stage == 'pivot_table':
+        aggfunc = {i : [j] for i, j in PERIOD_AGGFUNC}
+        return len(orders.pivot_table(index = index_cols, columns = 'year', aggfunc = aggfunc, observed = True))
+    if stage == 'group_reduce':
+        aggfunc = {i : [j] for i, j in PERIOD_AGGFUNC}
+        return len(group_pivot(orders, index_cols, 'year', aggfunc, exact = False))
+    if stage == 'draw_and_report':
+        #draw_and_report without plt.show() and print: chart tables, figure and the formatted report
+        import matplotlib.pyplot as plt
+        sales_review = sales_report(orders, index_cols, 'year', AGGFUNC_PICK, time_1, time_2)
+        sales_review, pictures = chart_review(sales_review, orders, index_cols, AGGFUNC_PICK, time_1, time_2)
+        plt.close(draw_double_bar(pictures, 0, 1, 2, ''))
+        return len(data_types_transform(sales_review, time_1, time_2))
+
+    raise ValueError(f'unknown stage {stage!r}; please use one of {STAGES}')
+
+
+def _measure(stage, raw_path, index_cols, repeat):
+    '''Worker: set up the stage inputs, then time the stage and track its RSS.'''
+    import matplotlib
+    matplotlib.use('Agg')
+
+    inputs = _setup(stage, raw_path, index_cols)
+    rows_in = len(next(iter(inputs.values()))) if inputs else None
+
+    times = []
+    gc.collect()
+    rss_before, _ = _rss_mb()
+    exact = _reset_peak_rss()
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows_out = _run(stage, raw_path, index_cols, inputs)
+        times.append(time.perf_counter() - start)
+    _, peak = _rss_mb()
+
+    return {'seconds' : min(times),
+            'rows_in' : rows_in,
+            'rows_out' : rows_out,
+            'rss_before_mb' : rss_before,
+            'peak_rss_mb' : peak,
+            'peak_covers_setup' : not exact}
+
+
+def run_benchmark(sizes = SIZES, stages = STAGES, index_cols = INDEX_COLS, repeat = 1, bench_dir = BENCH_DIR,
+                  seed = 0):
+    '''Benchmark every stage at every size, each (size, stage) in its own worker process; returns the result dict.'''
+    context = multiprocessing.get_context('spawn')
+    results = []
+    for n_rows in sizes:
+        raw_path = prepare(n_rows, bench_dir, seed)
+        for stage in stages:
+            with context.Pool(1) as pool:
+                result = pool.apply(_measure, (stage, raw_path, list(index_cols), repeat))
+            results.append({'rows' : n_rows, 'stage' : stage, **result})
+            print(f'{n_rows:>11,} rows  {stage:<16} {result["seconds"]:9.3f} s  {result["peak_rss_mb"]:9.1f} MB peak')
+
+    return {'created' : datetime.datetime.now().isoformat(timespec = 'seconds'),
+            'commit' : _commit(),
+            'python' : platform.python_version(),
+            'pandas' : pd.__version__,
+            'numpy' : np.__version__,
+            'numba' : _version('numba'),
+            'machine' : platform.platform(),
+            'cpus' : os.cpu_count(),
+            'index_cols' : list(index_cols),
+            'repeat' : repeat,
+            'seed' : seed,
+            'results' : results}
+
+
+def _version(module):
+    try:
+        return __import__(module).__version__
+    except ImportError:
+        return None
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output = True, text = True,
+                              check = True, cwd = os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(old, new, threshold = THRESHOLD):
+    '''
+    Per (rows, stage) ratio of the new to the old wall time and peak RSS; old and new are result dicts or paths.
+    Returns a frame with a regression flag where either grew by more than threshold.
+    '''
+    frames = []
+    for results in [old, new]:
+        if isinstance(results, str):
+            with open(results, encoding = 'utf-8') as f:
+                results = json.load(f)
+        frames.append(pd.DataFrame(results['results']).set_index(['rows', 'stage'])[['seconds', 'peak_rss_mb']])
+
+    table = frames[0].join(frames[1], how = 'inner', lsuffix = '_old', rsuffix = '_new')
+    table['time_ratio'] = table['seconds_new'] / table['seconds_old']
+    table['rss_ratio'] = table['peak_rss_mb_new'] / table['peak_rss_mb_old']
+    table['regression'] = (table['time_ratio'] > 1 + threshold) | (table['rss_ratio'] > 1 + threshold)
+    return table
+
+
+def main(argv = None):
+    parser = argparse.ArgumentParser(description = 'Benchmark the order analysis on synthetic order tables.')
+    parser.add_argument('--sizes', nargs = '+', type = int, default = SIZES, help = 'table sizes in rows')
+    parser.add_argument('--stages', nargs = '+', default = STAGES, choices = STAGES, help = 'stages to run')
+    parser.add_argument('--index-cols', nargs = '+', default = INDEX_COLS, help = 'report dimensions')
+    parser.add_argument('--repeat', type = int, default = 1, help = 'runs per stage, the fastest is kept')
+    parser.add_argument('--seed', type = int, default = 0, help = 'seed of the synthetic data')
+    parser.add_argument('--dir', default = BENCH_DIR, help = 'directory of the synthetic data files')
+    parser.add_argument('--out', default = 'bench.json', help = 'result file')
+    parser.add_argument('--compare', nargs = 2, metavar = ('OLD', 'NEW'), help = 'compare two result files and exit')
+    args = parser.parse_args(argv)
+
+    if args.compare:
+        table = compare(*args.compare)
+        print(table.to_string(float_format = '{:.3f}'.format))
+        return 1 if table['regression'].any() else 0
+
+    results = run_benchmark(args.sizes, args.stages, args.index_cols, args.repeat, args.dir, args.seed)
+    with open(args.out, 'w', encoding = 'utf-8') as f:
+        json.dump(results, f, indent = 2, default = float)
+    print(f'results written to {args.out}')
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,223 @@
+'''
+Bitmap / inverted index over the dimension columns of the orders table.
+
+The drill-downs of Description 3-2 filter with query strings such as
+'category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")', which evaluates
+every condition over every row. BitmapIndex keeps, per dimension value, the rows holding it in one of two
+compressed forms (as Roaring bitmaps do): frequent values as a packed bitmap (one bit per row), rare values
+as a sorted list of row ids (4 bytes per row of the value). A query is translated once (see
+partition.translate_query) into AND/OR of those containers, sparse results stay row lists, and only the
+selected rows are gathered for the report.
+
+    index = BitmapIndex(orders)
+    table = index.query(orders, 'category == "Furniture" and region in ["West", "South"]')
+    draw_and_report(table, ['sub_category'], cols, aggfunc_pick, time_1, time_2)
+
+Only the dimension codes are read when the index is built, so the index can be built from (and kept next to)
+a memory-mapped orders file.
+'''
+
+import operator
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.partition import translate_query
+
+
+INDEX_COLUMNS = ['region', 'ship_mode', 'segment', 'category', 'sub_category', 'state', 'city', 'product_id',
+                 'year', 'month']
+
+#a value (or result) is kept as a row list while it holds fewer than 1 / DENSE of the rows: below that
+#a 4-byte row id per row is smaller than a bitmap of one bit per row of the table
+DENSE = 32
+
+
+class Selection:
+    '''Rows of a table of n rows, as sorted row ids (sparse) or a packed bitmap (dense).'''
+
+    def __init__(self, n, ids = None, bits = None):
+        self.n = n
+        self.ids = ids
+        self.bits = bits
+
+    @classmethod
+    def from_ids(cls, n, ids):
+        '''Selection of sorted unique row ids, converted to a bitmap when they are many.'''
+        if len(ids) * DENSE < n:
+            return cls(n, ids = ids)
+        return cls(n, bits = _pack(n, ids))
+
+    def __len__(self):
+        if self.ids is not None:
+            return len(self.ids)
+        return int(np.bitwise_count(self.bits).sum()) if hasattr(np, 'bitwise_count') else len(self.rows())
+
+    def _bitmap(self):
+        return self.bits if self.bits is not None else _pack(self.n, self.ids)
+
+    def __and__(self, other):
+        if self.ids is not None and other.ids is not None:
+            return Selection(self.n, ids = np.intersect1d(self.ids, other.ids, assume_unique = True))
+        if self.ids is not None or other.ids is not None:
+            sparse, dense = (self, other) if self.ids is not None else (other, self)
+            ids = sparse.ids
+            return Selection(self.n, ids = ids[((dense.bits[ids >> 3] >> (7 - (ids & 7)).astype(np.uint8)) & 1).astype(bool)])
+        return Selection(self.n, bits = self.bits & other.bits)
+
+    def __or__(self, other):
+        if self.ids is not None and other.ids is not None:
+            return Selection.from_ids(self.n, np.union1d(self.ids, other.ids))
+        return Selection(self.n, bits = self._bitmap() | other._bitmap())
+
+    def __invert__(self):
+        bits = ~self._bitmap()
+        #padding bits past the last row stay unset
+        if self.n % 8:
+            bits[-1] &= np.uint8(0xFF << (8 - self.n % 8) & 0xFF)
+        return Selection(self.n, bits = bits)
+
+    def rows(self):
+        '''Sorted row positions of the selection.'''
+        if self.ids is not None:
+            return self.ids
+        return np.flatnonzero(np.unpackbits(self.bits, count = self.n))
+
+
+def _pack(n, ids):
+    bits = np.zeros((n + 7) // 8, dtype = np.uint8)
+    np.bitwise_or.at(bits, ids >> 3, (np.uint8(128) >> (ids & 7).astype(np.uint8)))
+    return bits
+
+
+class IndexColumn:
+    '''The containers of one dimension: row lists of the rare values (CSR layout) and bitmaps of the frequent ones.'''
+
+    def __init__(self, column, n_rows):
+        codes, values = pd.factorize(column, sort = True)
+        #plain values, so categoricals compare like their values
+        self.values = pd.Index(np.asarray(values))
+        self.n = n_rows
+        #rows of every value, grouped by value and ascending within it; codes + 1 keeps missing values first
+        shifted = (codes + 1).astype(np.min_scalar_type(len(self.values)))
+        counts = np.bincount(shifted, minlength = len(self.values) + 1)
+        row_dtype = np.uint32 if n_rows < 2 ** 32 else np.int64
+        order = np.argsort(shifted, kind = 'stable').astype(row_dtype)
+
+        dense = counts * DENSE >= n_rows
+        self.bitmaps = {k : _pack(n_rows, order[start:start + count])
+                        for k, (start, count) in enumerate(zip(np.cumsum(counts) - counts, counts)) if dense[k]}
+        #the row lists of the frequent values are dropped once they are bitmaps
+        sparse_counts = np.where(dense, 0, counts)
+        self.ids = order[np.repeat(~dense, counts)]
+        self.offsets = np.concatenate([[0], np.cumsum(sparse_counts)])
+
+    def _select(self, codes):
+        '''Union of the rows of the given value positions in self.values (-1 is the missing value).'''
+        ids, bits = [], None
+        for k in np.asarray(codes) + 1:
+            if k in self.bitmaps:
+                bits = self.bitmaps[k].copy() if bits is None else bits | self.bitmaps[k]
+            elif self.offsets[k + 1] > self.offsets[k]:
+                ids.append(self.ids[self.offsets[k]:self.offsets[k + 1]])
+
+        selection = Selection.from_ids(self.n, np.sort(np.concatenate(ids))) if ids else None
+        if bits is not None:
+            dense = Selection(self.n, bits = bits)
+            return dense if selection is None else dense | selection
+        return selection if selection is not None else Selection(self.n, ids = self.ids[:0])
+
+    def where(self, mask):
+        '''Rows whose value meets a boolean mask over self.values.'''
+        return self._select(np.flatnonzero(mask))
+
+    def memory_usage(self):
+        return self.ids.nbytes + self.offsets.nbytes + sum(i.nbytes for i in self.bitmaps.values())
+
+
+class _Field:
+    '''Column of the index as seen by translate_query: comparisons and isin give a Selection.'''
+
+    __hash__ = None
+
+    def __init__(self, column):
+        self.column = column
+
+    def _compare(self, compare, value):
+        values = self.column.values
+        try:
+            return self.column.where(np.asarray(compare(values, value), dtype = bool))
+        except TypeError as e:
+            raise KeyError(f'{value!r} cannot be compared with the index values') from e
+
+    def __eq__(self, value):
+        return self._compare(operator.eq, value)
+
+    def __ne__(self, value):
+        return self._compare(operator.ne, value)
+
+    def __lt__(self, value):
+        return self._compare(operator.lt, value)
+
+    def __le__(self, value):
+        return self._compare(operator.le, value)
+
+    def __gt__(self, value):
+        return self._compare(operator.gt, value)
+
+    def __ge__(self, value):
+        return self._compare(operator.ge, value)
+
+    def isin(self, values):
+        return self.column.where(pd.Index(self.column.values).isin(values))
+
+    def is_null(self):
+        return self.column._select([-1])
+
+
+class BitmapIndex:
+
+    def __init__(self, orders, columns = INDEX_COLUMNS):
+        '''Index the given dimension columns of orders (columns that are missing are skipped).'''
+        self.n = len(orders)
+        self.columns = {i : IndexColumn(orders[i], self.n) for i in columns if i in orders.columns}
+
+    def field(self, name):
+        if name not in self.columns:
+            raise KeyError(f'{name} is not indexed; please add it to the index columns')
+        return _Field(self.columns[name])
+
+    def select(self, query):
+        '''(Selection, exact) of a query string; exact is False when parts of it are not on indexed columns.'''
+        selection, exact = translate_query(query, self.field)
+        if selection is None:
+            selection = ~Selection(self.n, ids = np.empty(0, dtype = np.int64))
+        return selection, exact
+
+    def rows(self, query):
+        '''Positions of the rows meeting the query; raises when the query is not fully resolved by the index.'''
+        selection, exact = self.select(query)
+        if not exact:
+            raise ValueError(f'{query!r} uses columns or operations the index cannot resolve; please use query()')
+        return selection.rows()
+
+    def query(self, orders, query, columns = None):
+        '''
+        Same rows as orders.query(query) (columns optionally limits the columns gathered): the index resolves
+        the conditions on indexed columns and only the selected rows are gathered; any other condition is
+        then applied to those rows with query().
+        '''
+        if len(orders) != self.n:
+            raise ValueError('the index was built on a different table; please rebuild it')
+        selection, exact = self.select(query)
+        table = orders if columns is None or not exact else orders[list(columns)]
+        table = table.take(selection.rows())
+        if not exact:
+            table = table.query(query)
+            if columns is not None:
+                table = table[list(columns)]
+        return table
+
+    def memory_usage(self):
+        '''Bytes held per indexed column.'''
+        return pd.Series({i : column.memory_usage() for i, column in self.columns.items()})
@@ -0,0 +1,233 @@
+'''
+Columnar on-disk cache of the cleaned and enriched orders frame.
+
+Description 1-1 to 1-4 (download, CSV parsing, date coercion, type fixes, derived columns) are repeated
+on every run. The result is written once as an uncompressed Arrow IPC file keyed on a hash of the source
+file and the preprocessing parameters; later runs memory-map that file instead of reparsing the CSV.
+pyarrow is only needed when this module is used.
+'''
+
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from order_analysis import trace
+from order_analysis.preprocessing import DISCOUNT_MULTIPLIER, preprocess_orders
+
+
+CACHE_DIR = '.cache'
+
+#bump when the preprocessing steps change so that old cache files are no longer picked up
+CACHE_VERSION = 2
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.compute
+        import pyarrow.ipc
+    except ImportError as e:
+        raise ImportError('the orders cache needs pyarrow; please install it with `pip install pyarrow`') from e
+    return pyarrow
+
+
+def find_orders_file(dataset = 'ankitbansal06/retail-orders'):
+    '''Description 1-1: download the Kaggle dataset (kagglehub keeps its own local copy) and return the csv path.'''
+    import kagglehub
+
+    with trace.stage('download', dataset = dataset):
+        path = kagglehub.dataset_download(dataset).replace('\\', '/')
+    for dirname, _, filenames in os.walk(path):
+        for filename in sorted(filenames):
+            if filename.endswith('csv'):
+                return os.path.join(dirname, filename)
+
+    raise FileNotFoundError(f'{path} has no csv file; please check the dataset')
+
+
+def file_digest(path, cache_dir = CACHE_DIR):
+    '''
+    sha256 of the source file. Digests are remembered per (path, size, mtime) in the cache directory,
+    so an unchanged file is hashed only once.
+    '''
+    stat = os.stat(path)
+    index_path = os.path.join(cache_dir, 'digests.json')
+    entry = f'{os.path.abspath(path)}|{stat.st_size}|{stat.st_mtime_ns}'
+
+    index = {}
+    if os.path.exists(index_path):
+        with open(index_path, encoding = 'utf-8') as f:
+            index = json.load(f)
+    if entry in index:
+        return index[entry]
+
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+
+    index[entry] = digest.hexdigest()
+    os.makedirs(cache_dir, exist_ok = True)
+    _write_atomic(index_path, lambda tmp: _dump_json(index, tmp))
+
+    return index[entry]
+
+
+def cache_key(path, discount_multiplier = DISCOUNT_MULTIPLIER, cache_dir = CACHE_DIR):
+    '''Fingerprint of the cleaned orders: source file hash + preprocessing parameters.'''
+    params = json.dumps({'source' : file_digest(path, cache_dir),
+                         'discount_multiplier' : discount_multiplier,
+                         'version' : CACHE_VERSION}, sort_keys = True)
+    return hashlib.sha256(params.encode()).hexdigest()[:16]
+
+
+def cache_path(key, cache_dir = CACHE_DIR):
+    return os.path.join(cache_dir, f'orders-{key}.arrow')
+
+
+def write_orders(orders, path):
+    '''Write the orders frame as an uncompressed Arrow IPC file, which can be memory-mapped when read back.'''
+    pa = _pyarrow()
+    table = pa.Table.from_pandas(orders, preserve_index = False)
+
+    def write(tmp):
+        with pa.OSFile(tmp, 'wb') as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+
+    _write_atomic(path, write)
+
+
+def _spooled_type(pa, field):
+    #categoricals are spooled as their values and integers as int64, the same in every chunk
+    if pa.types.is_dictionary(field.type):
+        return field.type.value_type
+    if pa.types.is_integer(field.type):
+        return pa.int64()
+    return field.type
+
+
+def write_order_chunks(chunks, path):
+    '''
+    Write cleaned and enriched chunks of the orders (e.g. ingest.iter_orders) as one orders file, holding
+    one chunk at a time. apply_schema gives every chunk its own categories and integer widths, so the chunks
+    are spooled to a temporary file with plain values first and written again with the sorted categories of
+    all chunks and the widest integer types: read_orders gives the frame of preprocess_orders on the whole
+    file. Returns the number of lines written.
+    '''
+    pa = _pyarrow()
+    spool = f'{path}.{os.getpid()}.spool'
+    schema = writer = None
+    categories, widths = {}, {}
+    rows = 0
+    try:
+        with pa.OSFile(spool, 'wb') as sink:
+            for chunk in chunks:
+                with trace.stage('cache.write_chunk', chunk):
+                    table = pa.Table.from_pandas(chunk, preserve_index = False)
+                    if writer is None:
+                        schema = table.schema
+                        spooled = pa.schema([i.with_type(_spooled_type(pa, i)) for i in schema],
+                                            metadata = schema.metadata)
+                        writer = pa.ipc.new_file(sink, spooled)
+                    for field in table.schema:
+                        if pa.types.is_dictionary(field.type):
+                            values = table[field.name].cast(field.type.value_type).chunks
+                            values += [categories[field.name]] if field.name in categories else []
+                            values = pa.chunked_array(values, type = field.type.value_type)
+                            categories[field.name] = pa.compute.unique(pa.compute.drop_null(values))
+                        elif pa.types.is_integer(field.type):
+                            widths[field.name] = max(widths.get(field.name, 8), field.type.bit_width)
+                    writer.write_table(table.cast(spooled))
+                    rows += len(table)
+            if writer is None:
+                raise ValueError('there are no order lines to write; please check the raw data')
+            writer.close()
+
+        #the sorted categories, as astype('category') on the whole column gives them
+        for name, values in categories.items():
+            categories[name] = values.take(pa.compute.array_sort_indices(values))
+        fields = []
+        for field in schema:
+            if field.name in categories:
+                field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+            elif field.name in widths:
+                field = field.with_type(getattr(pa, f'int{widths[field.name]}')())
+            fields.append(field)
+        schema = pa.schema(fields, metadata = schema.metadata)
+
+        def write(tmp):
+            with pa.memory_map(spool, 'r') as source, pa.OSFile(tmp, 'wb') as sink, \
+                    pa.ipc.new_file(sink, schema) as writer:
+                reader = pa.ipc.open_file(source)
+                for i in range(reader.num_record_batches):
+                    batch = reader.get_batch(i)
+                    columns = []
+                    for field, column in zip(schema, batch.columns):
+                        if field.name in categories:
+                            codes = pa.compute.index_in(column, value_set = categories[field.name]).cast(pa.int32())
+                            column = pa.DictionaryArray.from_arrays(codes, categories[field.name])
+                        else:
+                            column = column.cast(field.type)
+                        columns.append(column)
+                    writer.write_batch(pa.record_batch(columns, schema = schema))
+
+        _write_atomic(path, write)
+    finally:
+        if os.path.exists(spool):
+            os.remove(spool)
+
+    return rows
+
+
+def read_orders(path):
+    '''Memory-map a cached orders file.'''
+    pa = _pyarrow()
+    with pa.memory_map(path, 'r') as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def load_orders(path = None, discount_multiplier = DISCOUNT_MULTIPLIER, cache_dir = CACHE_DIR):
+    '''
+    Cleaned and enriched orders frame (Description 1-1 to 1-4), served from the cache when possible.
+    The cache key is stored in orders.attrs['fingerprint'] so results derived from it can be keyed on it too,
+    with the id of the returned frame: pandas copies attrs onto slices and copies, which get an id of their own.
+    '''
+    if path is None:
+        path = find_orders_file()
+
+    key = cache_key(path, discount_multiplier, cache_dir)
+    cached = cache_path(key, cache_dir)
+    if os.path.exists(cached):
+        with trace.stage('cache.read') as step:
+            orders = read_orders(cached)
+            step.rows_out = len(orders)
+    else:
+        with trace.stage('parse') as step:
+            orders = pd.read_csv(path, encoding = 'utf-8-sig')
+            step.rows_out = len(orders)
+        orders = preprocess_orders(orders, discount_multiplier = discount_multiplier)
+        orders = orders.reset_index(drop = True)
+        with trace.stage('cache.write', len(orders)):
+            write_orders(orders, cached)
+
+    orders.attrs['fingerprint'] = key
+    orders.attrs['fingerprint_id'] = id(orders)
+    return orders
+
+
+def _dump_json(data, path):
+    with open(path, 'w', encoding = 'utf-8') as f:
+        json.dump(data, f)
+
+
+def _write_atomic(path, write):
+    '''Write to a temporary file first so a crashed run never leaves a half-written cache file behind.'''
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        write(tmp)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
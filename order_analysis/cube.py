@@ -0,0 +1,111 @@
+'''
+Aggregate cube behind the Part 1 report template (Description 2-3).
+
+Every draw_and_report call used to run a fresh DataFrame.pivot_table over the whole orders table.
+The cube aggregates orders once into additive cells (sum and count of every report metric per
+dimension x period combination); each report then only rolls up those cells, deriving means as sum / count.
+'''
+
+import pandas as pd
+
+from order_analysis.preprocessing import with_derived
+
+
+#dimensions used by the analysis in Description 3-x; add 'state', 'city' etc. when needed
+DIMENSIONS = ['region', 'category', 'sub_category', 'ship_mode', 'segment']
+PERIODS = ['year', 'month']
+METRICS = ['revenue', 'profit', 'cost', 'discount', 'quantity', 'list_price', 'cost_price', 'sell_price']
+
+
+class OrderCube:
+    '''
+    Additive cells of the orders table, grouped by dimensions + periods.
+    Supports the subset of the DataFrame API used by the report template:
+    query(), column access, nunique() on dimensions and pivot_table() with sum/mean/count aggfuncs.
+    '''
+
+    def __init__(self, cells, dimensions = DIMENSIONS, periods = PERIODS, metrics = METRICS):
+        self.cells = cells
+        self.dimensions = list(dimensions)
+        self.periods = list(periods)
+        self.metrics = list(metrics)
+        self._rollups = {}
+
+    @classmethod
+    def from_orders(cls, orders, dimensions = DIMENSIONS, periods = PERIODS, metrics = METRICS):
+        '''Build the cube with a single groupby over the orders table.'''
+        keys = list(dimensions) + list(periods)
+        orders = with_derived(orders, metrics)
+        grouped = orders.groupby(keys, observed = True, sort = False)[list(metrics)]
+
+        sums = grouped.sum().add_suffix('_sum')
+        counts = grouped.count().add_suffix('_count')
+        cells = pd.concat([sums, counts], axis = 1).reset_index()
+
+        return cls(cells, dimensions, periods, metrics)
+
+    @classmethod
+    def combine(cls, cubes):
+        '''Merge cubes built from disjoint parts of the orders (e.g. chunks of a file) by adding their cells.'''
+        cubes = [i for i in cubes if i is not None]
+        first = cubes[0]
+        keys = first.dimensions + first.periods
+
+        cells = pd.concat([i.cells for i in cubes], ignore_index = True)
+        cells = cells.groupby(keys, observed = True, sort = False).sum().reset_index()
+
+        return cls(cells, first.dimensions, first.periods, first.metrics)
+
+    @property
+    def columns(self):
+        return self.cells.columns
+
+    def __getitem__(self, key):
+        return self.cells[key]
+
+    def __len__(self):
+        return len(self.cells)
+
+    def query(self, expr):
+        '''Filter cells on dimension/period values, e.g. 'category == "Furniture"'.'''
+        return OrderCube(self.cells.query(expr), self.dimensions, self.periods, self.metrics)
+
+    def rollup(self, by):
+        '''Sum the additive cells up to the given keys; repeated roll-ups are served from memory.'''
+        by = list(by)
+        missing = [i for i in by if i not in self.cells.columns]
+        if missing:
+            raise KeyError(f'{missing} are not dimensions of the cube; rebuild it with these dimensions')
+
+        key = tuple(by)
+        if key not in self._rollups:
+            values = [i for i in self.cells.columns if i.endswith(('_sum', '_count'))]
+            self._rollups[key] = self.cells.groupby(by, observed = True, sort = True)[values].sum()
+        return self._rollups[key]
+
+    def pivot_table(self, index, columns, aggfunc, observed = True):
+        '''
+        Same result layout as DataFrame.pivot_table(index, columns, aggfunc) for an aggfunc dict
+        such as {'revenue' : ['sum'], 'quantity' : ['mean']}: columns are (metric, func, period).
+        Cells only exist for observed combinations, so observed is accepted for API compatibility only.
+        '''
+        index = [index] if isinstance(index, str) else list(index)
+        columns = [columns] if isinstance(columns, str) else list(columns)
+        cells = self.rollup(index + columns)
+
+        values = {}
+        for metric, funcs in aggfunc.items():
+            for func in [funcs] if isinstance(funcs, str) else funcs:
+                if func == 'sum':
+                    values[(metric, func)] = cells[f'{metric}_sum']
+                elif func == 'mean':
+                    values[(metric, func)] = cells[f'{metric}_sum'] / cells[f'{metric}_count']
+                elif func == 'count':
+                    values[(metric, func)] = cells[f'{metric}_count']
+                else:
+                    raise ValueError(f'{func} is not additive; the cube supports sum, mean and count')
+
+        table = pd.DataFrame(values, index = cells.index)
+        table.columns = pd.MultiIndex.from_tuples(table.columns)
+
+        return table.unstack(columns[0] if len(columns) == 1 else columns).dropna(how = 'all')
@@ -0,0 +1,147 @@
+'''
+Explain the delta: the slices over all dimension combinations that contribute most to a metric change.
+
+Description 3-2 finds the slice behind the Furniture revenue_diff by hand: category, then sub_category,
+then region x ship_mode. explain_delta searches the whole dimension lattice instead, every combination of
+region, ship_mode, segment, category, sub_category and state down to single (region, ..., state) cells, for
+the k slices with the largest decline (or growth) of an additive metric between time_2 and time_1.
+
+The table is aggregated once into additive cells per (dimensions x compared period), and each lattice node
+is only a roll-up of those cells, grouped with the codes of its parent node. The search goes level by level
+(1 dimension, 2 dimensions ...) and prunes as it goes: a slice can never lose (gain) more than the sum of
+the declines (gains) of its cells, so a slice whose bound is below the k-th largest change found so far is
+not drilled into, and a combination is only grouped on the cells of slices that all of its parents kept.
+A slice that equals a slice of a parent (e.g. category x sub_category, as every sub_category has one
+category) is reported once, at the parent.
+
+    table = explain_delta(orders, 'year', 2023, 2022, 'revenue', k = 10)
+    context.query(table['slice'][0]).draw_and_report(['sub_category'], aggfunc_pick)
+'''
+
+import itertools
+
+import numpy as np
+import pandas as pd
+
+from order_analysis import trace
+from order_analysis.preprocessing import with_derived
+
+
+#dimensions searched by default, all of them from the drill-downs of Description 3-x
+DIMENSIONS = ['region', 'ship_mode', 'segment', 'category', 'sub_category', 'state']
+
+
+def _condition(name, value):
+    #query() condition of a slice value, quoted as the Part 1 script quotes them
+    if isinstance(value, np.generic):
+        value = value.item()
+    return f'{name} == "{value}"' if isinstance(value, str) else f'{name} == {value!r}'
+
+
+def _period(pivot, period):
+    if period not in pivot.columns:
+        return np.zeros(len(pivot))
+    return np.nan_to_num(pivot[period].to_numpy(dtype = float))
+
+
+def explain_delta(table, cols, time_1, time_2, metric = 'revenue', dimensions = DIMENSIONS, k = 10, largest = False,
+                  max_depth = None):
+    '''
+    The k slices (combinations of dimension values, at most max_depth dimensions) with the largest decline
+    (largest = False) or growth of the metric sum from time_2 to time_1, largest first. One row per slice:
+    the slice value of every dimension (missing for dimensions the slice does not fix), the slice as a
+    query() string, the metric of both periods, the difference and its share of the total difference.
+    table is an orders frame, an OrderCube or a LazyOrders table holding the dimensions; the metric must be
+    additive (revenue, profit, cost, discount, quantity ...).
+    '''
+    dimensions = list(dimensions)
+    max_depth = len(dimensions) if max_depth is None else min(max_depth, len(dimensions))
+    if isinstance(table, pd.DataFrame):
+        table = with_derived(table, [metric])
+        table = table.loc[table[cols].isin([time_1, time_2]).to_numpy(), dimensions + [cols, metric]]
+
+    #additive cells of the compared periods, the only aggregation over the table
+    with trace.stage('explain.cells', table, dimensions = dimensions) as step:
+        pivot = table.pivot_table(index = dimensions, columns = cols, aggfunc = {metric : ['sum']}, observed = True)
+        pivot = pivot.droplevel([0, 1], axis = 1)
+        step.rows_out = len(pivot)
+    cells = pivot.index if isinstance(pivot.index, pd.MultiIndex) else pd.MultiIndex.from_arrays([pivot.index])
+    previous, current = _period(pivot, time_2), _period(pivot, time_1)
+    del pivot
+
+    codes = [np.asarray(i, dtype = np.intp) for i in cells.codes]
+    sizes = [len(i) for i in cells.levels]
+    sign = 1 if largest else -1
+    #change of every cell in the searched direction, and the part of it a slice can at most reach
+    gain = np.maximum(sign * (current - previous), 0)
+
+    best, order = [], itertools.count()
+    threshold = -np.inf
+    nodes = skipped = slices = pruned = 0
+
+    with trace.stage('explain.search', len(cells), k = k, max_depth = max_depth) as step:
+        #slice code of every cell per node of the previous level (-1 where the slice was pruned)
+        level = {() : np.zeros(len(cells), dtype = np.intp)}
+        counts = {() : np.array([len(cells)])}
+        for depth in range(1, max_depth + 1):
+            next_level, next_counts = {}, {}
+            for node in itertools.combinations(range(len(dimensions)), depth):
+                parents = [node[:i] + node[i + 1:] for i in range(depth)]
+                if any(i not in level for i in parents):
+                    skipped += 1
+                    continue
+                #only the cells of slices that every parent kept can form a slice worth grouping
+                rows = np.flatnonzero(np.logical_and.reduce([level[i] >= 0 for i in parents]))
+                if not len(rows):
+                    skipped += 1
+                    continue
+                nodes += 1
+
+                #the slices of the node are the slices of its first parent split by the added dimension
+                combined = level[node[:-1]][rows] * sizes[node[-1]] + codes[node[-1]][rows]
+                _, first, code = np.unique(combined, return_index = True, return_inverse = True)
+                n = len(first)
+                slices += n
+                count = np.bincount(code, minlength = n)
+                after = np.bincount(code, weights = current[rows], minlength = n)
+                before = np.bincount(code, weights = previous[rows], minlength = n)
+                bound = np.bincount(code, weights = gain[rows], minlength = n)
+                score = sign * (after - before)
+
+                #a slice holding the same cells as a slice of a parent is that slice
+                duplicate = np.zeros(n, dtype = bool)
+                for i in parents:
+                    duplicate |= counts[i][level[i][rows[first]]] == count
+                for i in np.flatnonzero(~duplicate & (score > threshold)):
+                    best.append((score[i], next(order), node, rows[first[i]], before[i], after[i]))
+                if len(best) > k:
+                    best = sorted(best, key = lambda i : (-i[0], i[1]))[:k]
+                if len(best) == k:
+                    threshold = min(i[0] for i in best)
+
+                #no slice inside one whose bound does not beat the k-th change can enter the top k
+                #(with a margin for the rounding of the sums)
+                keep = bound * (1 + 1e-9) > threshold
+                pruned += n - int(keep.sum())
+                if keep.any():
+                    slice_code = np.full(len(cells), -1, dtype = np.intp)
+                    slice_code[rows] = np.where(keep[code], code, -1)
+                    next_level[node], next_counts[node] = slice_code, count
+            level, counts = next_level, next_counts
+            if not level:
+                break
+        step.rows_out = len(best)
+
+    best = sorted(best, key = lambda i : (-i[0], i[1]))
+    rows = []
+    for _, _, node, cell, before, after in best:
+        values = {dimensions[j] : cells.levels[j][codes[j][cell]] for j in node}
+        rows.append({**values, 'slice' : ' and '.join(_condition(i, j) for i, j in values.items()),
+                     f'{metric}_{time_2}' : before, f'{metric}_{time_1}' : after})
+    result = pd.DataFrame(rows, columns = dimensions + ['slice', f'{metric}_{time_2}', f'{metric}_{time_1}'])
+    result[f'{metric}_diff'] = result[f'{metric}_{time_1}'] - result[f'{metric}_{time_2}']
+    total = float(current.sum() - previous.sum())
+    result['share'] = result[f'{metric}_diff'] / total if total else np.nan
+
+    result.attrs.update(total = total, nodes = nodes, skipped = skipped, slices = slices, pruned = pruned)
+    return result
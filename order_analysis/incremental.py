@@ -0,0 +1,123 @@
+'''
+Incremental (daily append) mode for the report aggregates and the RFM state.
+
+Instead of re-running Part 1 and rebuilding the Power BI RFM table from scratch, the state keeps
+(1)the OrderCube cells: additive sums and counts per (dimension, year, month),
+(2)the rfm_base table: last order date, frequency and monetary per product,
+(3)the ship_mode counts used for the Description 1-3 mode fill and the highest order_id seen so far,
+and only the new order lines since the last run are merged in. Because every piece of state is additive
+(or a max), sales_report YoY/MoM and RFM recency/frequency/monetary equal a full recompute.
+'''
+
+import os
+
+import pandas as pd
+
+from order_analysis.cube import DIMENSIONS, OrderCube
+from order_analysis.ingest import CHUNKSIZE, mode_of_counts, read_ship_mode_counts, ship_mode_counts
+from order_analysis.preprocessing import DISCOUNT_MULTIPLIER, preprocess_orders
+from order_analysis.rfm import combine_rfm_base, rfm_base, rfm_scores
+
+
+class IncrementalState:
+    '''
+    Running aggregates of every order line merged so far: the report cube, the RFM base table, the
+    ship_mode counts behind the mode fill and the order_id watermark (the highest order_id merged).
+    Load it, append the new lines (append for cleaned frames, append_file for raw delta files), read
+    cube / rfm_table and save it again; re-sent lines at or below the watermark are skipped.
+    '''
+
+    def __init__(self, dimensions = DIMENSIONS, rfm_key = 'product_id'):
+        self.dimensions = list(dimensions)
+        self.rfm_key = rfm_key
+        self.cube = None
+        self.base = None
+        self.ship_mode_counts = pd.Series(dtype = 'int64')
+        self.last_order_id = None
+        self.rows = 0
+
+    def new_lines(self, orders, watermark = None):
+        '''
+        Order lines after the watermark (by default the state's); order_id is assumed to increase with
+        every new order.
+        '''
+        if not pd.api.types.is_numeric_dtype(orders['order_id']):
+            raise ValueError(f'order_id has dtype {orders["order_id"].dtype}, but the watermark needs numeric '
+                             'order ids; please pass the lines through preprocess_orders with compact = True')
+        watermark = self.last_order_id if watermark is None else watermark
+        if watermark is None:
+            return orders
+        return orders[orders['order_id'] > watermark]
+
+    def append(self, orders, ship_mode_counts = None):
+        '''
+        Merge cleaned and enriched order lines (see preprocess_orders) into the state.
+        Lines at or below the watermark are skipped, so re-sending a file is harmless.
+        ship_mode_counts are the raw ship_mode counts of the new lines (see ingest.ship_mode_counts); by
+        default the ship_mode of the cleaned lines is counted, missing values filled by then included.
+        Returns the number of lines merged.
+        '''
+        orders = self.new_lines(orders)
+        rows = self._merge(orders, ship_mode_counts)
+        if rows:
+            self._raise_watermark(orders['order_id'].max())
+        return rows
+
+    def append_file(self, path, chunksize = CHUNKSIZE, discount_multiplier = DISCOUNT_MULTIPLIER):
+        '''
+        Read a raw delta file (same layout as the Kaggle orders file) chunk by chunk and merge it.
+        Missing ship_mode values are filled with the mode of all lines seen so far, history included.
+        Every chunk is compared with the watermark before the file, which is raised once the whole file is
+        merged, so the lines of the file may come in any order.
+        '''
+        watermark = self.last_order_id
+        delta_counts = read_ship_mode_counts(path, chunksize, watermark)
+        ship_mode_fill = mode_of_counts(self.ship_mode_counts.add(delta_counts, fill_value = 0))
+
+        rows = 0
+        last_order_id = None
+        for chunk in pd.read_csv(path, chunksize = chunksize, encoding = 'utf-8-sig'):
+            #the raw counts, so the filled values are not counted (_merge adds them with the lines)
+            counts = ship_mode_counts(chunk, watermark)
+            orders = self.new_lines(preprocess_orders(chunk, ship_mode_fill, discount_multiplier), watermark)
+            if self._merge(orders, counts):
+                rows += len(orders)
+                chunk_last = orders['order_id'].max()
+                last_order_id = chunk_last if last_order_id is None else max(last_order_id, chunk_last)
+
+        if rows:
+            self._raise_watermark(last_order_id)
+        return rows
+
+    def _merge(self, orders, ship_mode_counts = None):
+        #add new lines to the aggregates, the watermark is left to the caller
+        if orders.empty:
+            return 0
+
+        self.cube = OrderCube.combine([self.cube, OrderCube.from_orders(orders, self.dimensions)])
+        self.base = combine_rfm_base([self.base, rfm_base(orders, self.rfm_key)])
+        if ship_mode_counts is None:
+            ship_mode_counts = orders['ship_mode'].astype(object).value_counts()
+        self.ship_mode_counts = self.ship_mode_counts.add(ship_mode_counts[ship_mode_counts > 0], fill_value = 0)
+        self.rows += len(orders)
+
+        return len(orders)
+
+    def _raise_watermark(self, last_order_id):
+        self.last_order_id = last_order_id if self.last_order_id is None else max(self.last_order_id, last_order_id)
+
+    def rfm_table(self, last_orderdate = None):
+        '''RFM table of all lines merged so far, identical to rfm_table on the full history (see combine_rfm_base).'''
+        return rfm_scores(self.base, last_orderdate).reset_index()
+
+    def save(self, path):
+        '''Persist the state between runs (pickle of the aggregates, not of the order lines).'''
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+        pd.to_pickle(self, path)
+
+    @classmethod
+    def load(cls, path, dimensions = DIMENSIONS, rfm_key = 'product_id'):
+        '''Load a saved state, or start an empty one on the first run.'''
+        if os.path.exists(path):
+            return pd.read_pickle(path)
+        return cls(dimensions, rfm_key)
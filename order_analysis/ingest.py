@@ -0,0 +1,84 @@
+'''
+Streaming ingest of orders.csv with bounded memory.
+
+pd.read_csv on the whole file followed by the Description 1-4 columns keeps several full-length copies
+of the data in memory. Here the file is read in chunks, each chunk is cleaned (Description 1-3) and
+enriched (Description 1-4) on its own, and then folded straight into the running report cube and
+RFM base table, so only one chunk plus the aggregates is ever held in memory.
+'''
+
+import pandas as pd
+
+from order_analysis.cube import DIMENSIONS, OrderCube
+from order_analysis.preprocessing import (DISCOUNT_MULTIPLIER, SHIP_MODE_OUTLIERS, preprocess_orders,
+                                          standardize_columns)
+from order_analysis.rfm import combine_rfm_base, rfm_base
+
+
+CHUNKSIZE = 1_000_000
+
+
+def ship_mode_counts(chunk, after_order_id = None):
+    '''
+    ship_mode value counts of raw order lines without the outliers (and the missing values),
+    optionally only for the lines after a given order_id.
+    '''
+    chunk = chunk.set_axis(standardize_columns(chunk.columns), axis = 1)
+    if after_order_id is not None:
+        chunk = chunk[pd.to_numeric(chunk['order_id'], errors = 'coerce') > after_order_id]
+    ship_mode = chunk['ship_mode']
+    return ship_mode[~ship_mode.isin(SHIP_MODE_OUTLIERS)].value_counts()
+
+
+def read_ship_mode_counts(path, chunksize = CHUNKSIZE, after_order_id = None):
+    '''
+    First pass over the file reading only ship_mode (and order_id when after_order_id is given):
+    value counts without the outliers, optionally only for the lines after a given order_id.
+    '''
+    columns = ['ship_mode'] if after_order_id is None else ['ship_mode', 'order_id']
+    counts = pd.Series(dtype = 'int64')
+    for chunk in pd.read_csv(path, chunksize = chunksize, encoding = 'utf-8-sig',
+                             usecols = lambda i: standardize_columns([i])[0] in columns):
+        counts = counts.add(ship_mode_counts(chunk, after_order_id), fill_value = 0)
+    return counts
+
+
+def mode_of_counts(counts):
+    '''Same tie-break as Series.mode(): the smallest of the most frequent values.'''
+    if counts.empty:
+        raise ValueError('there are no ship_mode values; please check the raw data')
+    return min(counts[counts == counts.max()].index)
+
+
+def read_ship_mode_fill(path, chunksize = CHUNKSIZE):
+    '''
+    Mode of ship_mode over the whole file, so every chunk is filled exactly as
+    Description 1-3 does on the full table.
+    '''
+    return mode_of_counts(read_ship_mode_counts(path, chunksize))
+
+
+def iter_orders(path, chunksize = CHUNKSIZE, discount_multiplier = DISCOUNT_MULTIPLIER, ship_mode_fill = None):
+    '''Yield cleaned and enriched chunks of the orders file.'''
+    if ship_mode_fill is None:
+        ship_mode_fill = read_ship_mode_fill(path, chunksize)
+    for chunk in pd.read_csv(path, chunksize = chunksize, encoding = 'utf-8-sig'):
+        yield preprocess_orders(chunk, ship_mode_fill, discount_multiplier)
+
+
+def ingest_orders(path, chunksize = CHUNKSIZE, dimensions = DIMENSIONS, rfm_key = 'product_id',
+                  discount_multiplier = DISCOUNT_MULTIPLIER):
+    '''
+    Stream the orders file into the running aggregates used downstream.
+    Returns (cube, base): the OrderCube behind sales_report and the rfm_base table behind rfm_scores.
+    '''
+    cube = None
+    base = None
+    for chunk in iter_orders(path, chunksize, discount_multiplier):
+        cube = OrderCube.combine([cube, OrderCube.from_orders(chunk, dimensions)])
+        base = combine_rfm_base([base, rfm_base(chunk, rfm_key)])
+
+    if cube is None:
+        raise ValueError(f'{path} has no order lines; please check the raw data')
+
+    return cube, base
@@ -0,0 +1,142 @@
+'''
+KPI rules engine of Description 2-4.
+
+A rule is a list of threshold conditions (column, operator, threshold) that must all hold; a label
+(star, review ...) applies to a report row when any of its rules holds. The rules are compiled once
+into arrays: the distinct conditions are grouped per (column, operator) and evaluated by broadcasting
+each report column against all of its thresholds at the same time, and the AND within a rule and the
+OR within a label are reductions over bit-packed condition rows. No expression string is parsed, so
+thousands of rules over millions of report rows cost a few vectorized passes.
+
+    rules = CompiledRules(kpi_rules('year'))
+    labels = rules.labels(sales_review)      # 'star', 'review' or 'neutral' per row
+'''
+
+import functools
+import operator
+
+import numpy as np
+import pandas as pd
+
+
+OPERATORS = {'>=' : operator.ge, '>' : operator.gt, '<=' : operator.le, '<' : operator.lt,
+             '==' : operator.eq, '!=' : operator.ne}
+
+#Description 2-4 KPI conditions; {change} is yoy or mom
+KPI_RULES = {'star' : [[('revenue_{change}', '>=', 0.1), ('profit_rate_{change}', '>=', 0.1)],
+                       [('revenue_{change}', '>=', 0.2)]],
+             'review' : [[('revenue_{change}', '<=', -0.1), ('profit_rate_{change}', '<=', -0.1)],
+                         [('revenue_{change}', '<=', -0.2)],
+                         [('profit_rate_{change}', '<=', -0.2)]]}
+
+NEUTRAL = 'neutral'
+
+#report rows evaluated at a time, which bounds the (conditions x rows) bit matrix
+CHUNKSIZE = 65_536
+
+
+def kpi_rules(cols, rules = KPI_RULES):
+    '''The KPI rules of a yearly (yoy) or monthly (mom) report.'''
+    change = {'year' : 'yoy', 'month' : 'mom'}[cols]
+    return {label : [[(column.format(change = change), op, threshold) for column, op, threshold in rule]
+                     for rule in label_rules]
+            for label, label_rules in rules.items()}
+
+
+def _by_length(members):
+    '''(positions, members matrix) per member count, e.g. the condition codes of all two-condition rules.'''
+    groups = {}
+    for k, i in enumerate(members):
+        groups.setdefault(len(i), []).append(k)
+    return [(np.array(index), np.array([members[k] for k in index])) for index in groups.values()]
+
+
+class CompiledRules:
+    '''
+    Rules of several labels compiled into condition groups and reduction groups.
+    Rows where a condition column is NaN do not meet that condition, as in DataFrame.query.
+    '''
+
+    def __init__(self, rules):
+        self.label_names = list(rules)
+
+        conditions = {}
+        rule_conditions = []
+        label_rules = []
+        for label in self.label_names:
+            label_rules.append(len(rule_conditions))
+            for rule in rules[label]:
+                if not rule:
+                    raise ValueError(f'a rule of {label!r} has no condition; please give at least one')
+                codes = []
+                for column, op, threshold in rule:
+                    if op not in OPERATORS:
+                        raise ValueError(f'unknown operator {op!r}; please use one of {list(OPERATORS)}')
+                    codes.append(conditions.setdefault((column, op, float(threshold)), len(conditions)))
+                rule_conditions.append(codes)
+            if len(rule_conditions) == label_rules[-1]:
+                raise ValueError(f'{label!r} has no rule; please give at least one')
+
+        #distinct conditions grouped by (column, operator): one broadcast comparison per group
+        groups = {}
+        for (column, op, threshold), code in conditions.items():
+            groups.setdefault((column, op), ([], []))
+            groups[(column, op)][0].append(threshold)
+            groups[(column, op)][1].append(code)
+        self.groups = [(column, OPERATORS[op], np.array(thresholds), np.array(codes))
+                       for (column, op), (thresholds, codes) in groups.items()]
+        self.columns = sorted({column for column, _, _ in conditions})
+        self.n_conditions = len(conditions)
+
+        #rules grouped by their number of conditions and labels by their number of rules, so the AND within
+        #a rule and the OR within a label are each one reduction over a regular (rules x k x rows) array
+        self.rule_groups = _by_length(rule_conditions)
+        self.label_groups = _by_length([list(range(start, stop)) for start, stop in
+                                        zip(label_rules, label_rules[1:] + [len(rule_conditions)])])
+        self.n_rules = len(rule_conditions)
+
+    def masks(self, table, chunksize = CHUNKSIZE):
+        '''Boolean (rows x labels) array: whether each row meets any rule of each label.'''
+        missing = [i for i in self.columns if i not in table.columns]
+        if missing:
+            raise KeyError(f'the report has no {missing} column; please check the rules and cols')
+
+        values = {i : table[i].to_numpy(dtype = float) for i in self.columns}
+        n_rows = len(table)
+        result = np.empty((n_rows, len(self.label_names)), dtype = bool)
+
+        #conditions and rules are held as bit-packed rows (8 report rows per byte)
+        with np.errstate(invalid = 'ignore'):
+            for start in range(0, n_rows, chunksize):
+                stop = min(start + chunksize, n_rows)
+                met = np.empty((self.n_conditions, (stop - start + 7) // 8), dtype = np.uint8)
+                for column, compare, thresholds, codes in self.groups:
+                    met[codes] = np.packbits(compare(values[column][None, start:stop], thresholds[:, None]), axis = 1)
+
+                rules = np.empty((self.n_rules, met.shape[1]), dtype = np.uint8)
+                for index, codes in self.rule_groups:
+                    rules[index] = np.bitwise_and.reduce(met[codes], axis = 1)
+
+                labels = np.empty((len(self.label_names), met.shape[1]), dtype = np.uint8)
+                for index, codes in self.label_groups:
+                    labels[index] = np.bitwise_or.reduce(rules[codes], axis = 1)
+
+                result[start:stop] = np.unpackbits(labels, axis = 1, count = stop - start).T.astype(bool)
+
+        return result
+
+    def mask(self, table, label):
+        return self.masks(table)[:, self.label_names.index(label)]
+
+    def labels(self, table, neutral = NEUTRAL):
+        '''One label per row: the first label (in rule order) whose rules the row meets, otherwise neutral.'''
+        masks = self.masks(table)
+        names = np.array(self.label_names + [neutral], dtype = object)
+        first = np.where(masks.any(axis = 1), masks.argmax(axis = 1), len(self.label_names))
+        return pd.Series(names[first], index = table.index, name = 'kpi_label')
+
+
+@functools.lru_cache(maxsize = None)
+def report_rules(cols):
+    '''Compiled Description 2-4 rules of a yearly or monthly report, built once per process.'''
+    return CompiledRules(kpi_rules(cols))
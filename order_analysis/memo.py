@@ -0,0 +1,183 @@
+'''
+Memoized report results.
+
+Many analyses in Description 3-2 rebuild the same slices (category == "Furniture" ...) and the same
+reports (region x ship_mode for the whole table and for Tables/Furnishings). ReportCache puts a
+size-bounded LRU cache in front of both the filtered-table construction and sales_report, keyed by
+(dataset fingerprint, normalized query, index_cols, cols, compared periods, aggfunc_pick), so repeated
+drill-downs come back from memory. When the underlying orders change (a new load_orders cache key),
+reset() drops every entry of the old dataset. A LazyOrders table reads its file on every query, so its
+fingerprint holds the modification time of the file, and the entries are dropped as soon as it changes.
+'''
+
+import ast
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import pandas as pd
+
+from order_analysis.cube import OrderCube
+from order_analysis.engine import LazyOrders
+from order_analysis.partition import METADATA_FILE
+from order_analysis.report import ReportContext
+
+
+MAX_ENTRIES = 256
+MAX_BYTES = 512 * 1024 ** 2
+
+
+def _hash(text):
+    return hashlib.sha256(text).hexdigest()[:16]
+
+
+def _reads_file(table):
+    return isinstance(table, LazyOrders) and not isinstance(table.source, pd.DataFrame)
+
+
+def _modified(source):
+    #a partitioned dataset is rewritten as a whole, with its metadata file
+    path = os.path.join(source, METADATA_FILE) if os.path.isdir(source) else source
+    return os.stat(path).st_mtime_ns
+
+
+def fingerprint(table):
+    '''
+    Identity of a dataset: the load_orders cache key for the very frame load_orders returned, otherwise a
+    hash of its content (pandas copies attrs onto slices and changed copies, so the key alone is not enough).
+    A LazyOrders table is identified by its source (the path and modification time of the file, or the
+    frame) and its WHERE clause, so no query is run.
+    '''
+    if isinstance(table, LazyOrders):
+        if _reads_file(table):
+            source = f'{os.path.abspath(table.source)}@{_modified(table.source)}'
+        else:
+            source = fingerprint(table.source)
+        return _hash(f'{source}|{" AND ".join(table.where)}'.encode())
+
+    frame = table.cells if isinstance(table, OrderCube) else table
+    key = frame.attrs.get('fingerprint')
+    if key is None or frame.attrs.get('fingerprint_id') != id(frame):
+        key = _hash(pd.util.hash_pandas_object(frame, index = True).to_numpy().tobytes())
+    return f'{key}-{len(frame)}'
+
+
+def normalize_query(query):
+    '''Canonical form of a query string, so quoting and spacing differences hit the same entry.'''
+    if not query:
+        return ''
+    return ast.unparse(ast.parse(query.strip(), mode = 'eval'))
+
+
+def _size(value):
+    if isinstance(value, ReportContext):
+        value = value.table
+    if isinstance(value, OrderCube):
+        value = value.cells
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return int(value.memory_usage(deep = True).sum())
+    return 0
+
+
+class LRUCache:
+    '''Least-recently-used cache bounded by number of entries and by total bytes of the cached frames.'''
+
+    def __init__(self, max_entries = MAX_ENTRIES, max_bytes = MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key][0]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        size = _size(value)
+        if size > self.max_bytes:
+            return value
+
+        with self._lock:
+            if key in self.entries:
+                self.bytes -= self.entries.pop(key)[1]
+            self.entries[key] = (value, size)
+            self.bytes += size
+
+            while len(self.entries) > self.max_entries or self.bytes > self.max_bytes:
+                _, (_, evicted) = self.entries.popitem(last = False)
+                self.bytes -= evicted
+
+        return value
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class ReportCache:
+    '''
+    Report suite over one dataset with memoized slices and reports.
+
+        cache = ReportCache(load_orders())
+        cache.sales_report(['region', 'ship_mode'], aggfunc_pick, query = 'category == "Furniture"')
+    '''
+
+    def __init__(self, table, cols = 'year', time_1 = None, time_2 = None,
+                 max_entries = MAX_ENTRIES, max_bytes = MAX_BYTES):
+        self.cache = LRUCache(max_entries, max_bytes)
+        self.cols = cols
+        self._periods = (time_1, time_2)
+        self.reset(table)
+
+    def reset(self, table):
+        '''Point the cache at a (possibly new) dataset; entries of a different dataset are dropped.'''
+        key = fingerprint(table)
+        if getattr(self, 'fingerprint', None) != key:
+            self.cache.clear()
+        self.fingerprint = key
+        self.context = ReportContext(table, self.cols, *self._periods)
+
+    def _refresh(self):
+        #a LazyOrders table whose file was rewritten is opened again, without the entries of the old file
+        table = self.context.table
+        if _reads_file(table) and fingerprint(table) != self.fingerprint:
+            self.reset(LazyOrders(table.source, where = table.where))
+
+    def slice(self, query = None):
+        '''ReportContext of a filtered table, built once per normalized query.'''
+        self._refresh()
+        query = normalize_query(query)
+        if not query:
+            return self.context
+
+        key = (self.fingerprint, 'slice', query)
+        context = self.cache.get(key)
+        if context is None:
+            context = self.cache.put(key, self.context.query(query))
+        return context
+
+    def sales_report(self, index_cols, aggfunc_pick, query = None):
+        '''sales_report of a slice; a copy is returned so callers cannot alter the cached result.'''
+        self._refresh()
+        query = normalize_query(query)
+        context = self.context
+        key = (self.fingerprint, 'sales_report', query, tuple(index_cols), context.cols,
+               context.time_1, context.time_2, tuple(aggfunc_pick))
+
+        report = self.cache.get(key)
+        if report is None:
+            report = self.cache.put(key, self.slice(query).sales_report(index_cols, aggfunc_pick))
+        return report.copy()
@@ -0,0 +1,255 @@
+'''
+Date-partitioned Parquet storage of the cleaned and enriched orders.
+
+A report only compares two periods (time_1 vs time_2 of cols = 'year' or 'month') of a slice such as
+category == "Furniture", yet orders.query(...) scans and copies the whole frame. Here the orders are written
+once as a hive-partitioned dataset, root/year=2023/month=1[/category=Furniture]/part-0.parquet, and the
+reader turns the compared periods and the slice query into a filter: files of other periods (and categories)
+are pruned from their directory names without being opened, and the remaining conditions are applied to
+the row groups while they are read, so only the lines of the slice ever reach pandas.
+
+    write_partitioned(load_orders(), 'orders-parquet', by_category = True)
+    table = read_partitioned('orders-parquet', 'category == "Furniture"', 'year', [2023, 2022])
+    draw_and_report(table, ['sub_category'], 'year', aggfunc_pick, 2023, 2022)
+
+pyarrow is only needed when this module is used.
+'''
+
+import ast
+import json
+import os
+import shutil
+
+import pandas as pd
+
+from order_analysis import trace
+
+
+PARTITION_COLS = ['year', 'month']
+
+#lines buffered per partition before a row group is written
+ROW_GROUP_SIZE = 1 << 17
+
+METADATA_FILE = '_common_metadata'
+METADATA_KEY = b'order_analysis.partition_cols'
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.dataset
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError('the partitioned orders need pyarrow; please install it with `pip install pyarrow`') from e
+    return pyarrow
+
+
+def write_partitioned(orders, root, partition_cols = PARTITION_COLS, by_category = False):
+    '''
+    Write the orders as a hive-partitioned Parquet dataset under root, by year and month (and category
+    with by_category). An existing dataset at root is replaced only once the new one is complete.
+    '''
+    pa = _pyarrow()
+    partition_cols = list(partition_cols) + (['category'] if by_category else [])
+    missing = [i for i in partition_cols if i not in orders.columns]
+    if missing:
+        raise KeyError(f'the orders have no {missing} column; please run preprocess_orders first')
+
+    with trace.stage('partition.write', len(orders), partition_cols = partition_cols):
+        table = pa.Table.from_pandas(orders, preserve_index = False)
+        #categoricals are written as plain strings: Parquet dictionary-encodes them per row group anyway,
+        #while an Arrow dictionary would carry every category (e.g. all product ids) into every file
+        for i, field in enumerate(table.schema):
+            if pa.types.is_dictionary(field.type):
+                table = table.set_column(i, field.name, table[field.name].cast(field.type.value_type))
+
+        partitioning = pa.dataset.partitioning(pa.schema([table.schema.field(i) for i in partition_cols]),
+                                               flavor = 'hive')
+        tmp = f'{root}.{os.getpid()}.tmp'
+        try:
+            pa.dataset.write_dataset(table, tmp, format = 'parquet', partitioning = partitioning,
+                                     min_rows_per_group = ROW_GROUP_SIZE, max_rows_per_group = ROW_GROUP_SIZE * 8,
+                                     existing_data_behavior = 'delete_matching')
+            #full schema (column order, pandas dtypes) and the partition columns, read back by read_partitioned
+            schema = pa.Table.from_pandas(orders.head(0), preserve_index = False).schema
+            schema = schema.with_metadata({**schema.metadata, METADATA_KEY : json.dumps(partition_cols).encode()})
+            pa.parquet.write_metadata(schema, os.path.join(tmp, METADATA_FILE))
+
+            if os.path.exists(root):
+                shutil.rmtree(root)
+            os.replace(tmp, root)
+        finally:
+            if os.path.exists(tmp):
+                shutil.rmtree(tmp)
+
+    return root
+
+
+def open_dataset(root):
+    '''(dataset, full schema, partition columns) of a dataset written by write_partitioned.'''
+    pa = _pyarrow()
+    path = os.path.join(root, METADATA_FILE)
+    if not os.path.exists(path):
+        raise FileNotFoundError(f'{root} is not a partitioned orders dataset; please write it with write_partitioned')
+
+    schema = pa.parquet.read_schema(path)
+    partition_cols = json.loads(schema.metadata[METADATA_KEY])
+    fields = [schema.field(i) for i in partition_cols]
+    fields = [i.with_type(i.type.value_type) if pa.types.is_dictionary(i.type) else i for i in fields]
+
+    #categorical columns are decoded straight into dictionaries again, i.e. pandas categoricals
+    dictionary_columns = [i.name for i in schema if pa.types.is_dictionary(i.type) and i.name not in partition_cols]
+    dataset = pa.dataset.dataset(root, format = pa.dataset.ParquetFileFormat(dictionary_columns = dictionary_columns),
+                                 exclude_invalid_files = True,
+                                 partitioning = pa.dataset.partitioning(pa.schema(fields), flavor = 'hive'))
+    return dataset, schema, partition_cols
+
+
+def partitions(root):
+    '''Partition values of every file of the dataset, e.g. to find the available years without reading any data.'''
+    pa = _pyarrow()
+    dataset, _, partition_cols = open_dataset(root)
+    rows = [{**pa.dataset.get_partition_keys(i.partition_expression), 'path' : i.path} for i in dataset.get_fragments()]
+    return pd.DataFrame(rows, columns = partition_cols + ['path'])
+
+
+_COMPARE = {ast.Eq : '__eq__', ast.NotEq : '__ne__', ast.Lt : '__lt__', ast.LtE : '__le__',
+            ast.Gt : '__gt__', ast.GtE : '__ge__'}
+_FLIPPED = {ast.Lt : ast.Gt, ast.LtE : ast.GtE, ast.Gt : ast.Lt, ast.GtE : ast.LtE, ast.Eq : ast.Eq, ast.NotEq : ast.NotEq}
+
+
+def _constant(node):
+    if isinstance(node, ast.Constant):
+        return node.value
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub) and isinstance(node.operand, ast.Constant):
+        return -node.operand.value
+    if isinstance(node, (ast.List, ast.Tuple)):
+        return [_constant(i) for i in node.elts]
+    raise ValueError
+
+
+def _expression(node, field, literal):
+    '''(expression, exact) of an ast node; the expression is None when nothing of the node can be pushed down.'''
+    if isinstance(node, ast.BoolOp):
+        parts = [_expression(i, field, literal) for i in node.values]
+        if isinstance(node.op, ast.And):
+            #conditions that cannot be translated are left out of an AND and applied afterwards
+            kept = [i for i, _ in parts if i is not None]
+            expression = None
+            for i in kept:
+                expression = i if expression is None else expression & i
+            return expression, all(exact for _, exact in parts)
+        if any(i is None or not exact for i, exact in parts):
+            return None, False
+        expression = parts[0][0]
+        for i, _ in parts[1:]:
+            expression = expression | i
+        return expression, True
+
+    if isinstance(node, ast.Compare) and len(node.ops) == 1:
+        left, op, right = node.left, type(node.ops[0]), node.comparators[0]
+        if isinstance(right, ast.Name) and not isinstance(left, ast.Name) and op in _FLIPPED:
+            left, op, right = right, _FLIPPED[op], left
+        if isinstance(left, ast.Name):
+            try:
+                value = _constant(right)
+                column = field(left.id)
+                #a missing value is != and not in anything for query(), while a filter on null drops it
+                if op is ast.NotEq:
+                    return (column != value) | column.is_null(), True
+                if op in _COMPARE:
+                    return getattr(column, _COMPARE[op])(value), True
+                #an empty list matches no line (in) or every line (not in)
+                if op in (ast.In, ast.NotIn) and value == [] and literal is not None:
+                    return literal(op is ast.NotIn), True
+                if op is ast.In and isinstance(value, list):
+                    return column.isin(value), True
+                if op is ast.NotIn and isinstance(value, list):
+                    return ~column.isin(value) | column.is_null(), True
+            except (ValueError, KeyError):
+                return None, False
+
+    return None, False
+
+
+def translate_query(query, field, literal = None):
+    '''
+    Filter of a DataFrame.query string such as 'category == "Furniture" and month in [1, 2]' built from the
+    column objects field(name) returns (pyarrow fields, bitmap index columns ...): comparisons of a column with
+    constants, in / not in lists, and / or. Returns (expression, exact); exact is False when parts of the query
+    could not be translated (or field raised KeyError) and still have to be applied with query().
+    literal(value) optionally builds a constant true / false filter, used for in / not in an empty list.
+    '''
+    if not query:
+        return None, True
+    try:
+        tree = ast.parse(query.strip(), mode = 'eval')
+    except SyntaxError as e:
+        raise ValueError(f'{query!r} is not a valid query; please check its syntax') from e
+    return _expression(tree.body, field, literal)
+
+
+def query_filter(query):
+    '''pyarrow filter of a DataFrame.query string, see translate_query.'''
+    if not query:
+        return None, True
+    dataset = _pyarrow().dataset
+    #pyarrow cannot type the value set of an empty isin, so that is a literal
+    return translate_query(query, dataset.field, dataset.scalar)
+
+
+def _read(dataset, names, expression, query, cols, periods):
+    if trace.enabled():
+        #files whose partition values fail the filter are skipped from their paths alone
+        files = sum(1 for _ in dataset.get_fragments(filter = expression))
+    else:
+        files = None
+    with trace.stage('partition.read', query = query, cols = cols, periods = periods, files = files) as step:
+        orders = dataset.to_table(columns = names, filter = expression).to_pandas()
+        step.rows_out = len(orders)
+    return orders
+
+
+def read_partitioned(root, query = None, cols = None, periods = None, columns = None):
+    '''
+    Orders of the partitioned dataset at root, pruned to the given periods of cols (e.g. 'year', [2023, 2022])
+    and to the slice query. Only the files of matching partitions are opened. columns optionally limits the
+    columns read. The frame has the column order and dtypes of the orders that were written.
+    '''
+    pa = _pyarrow()
+    dataset, schema, partition_cols = open_dataset(root)
+
+    period = None
+    if periods is not None:
+        if cols is None:
+            raise ValueError('periods need the period column; please give cols (year or month)')
+        period = pa.dataset.field(cols).isin(list(periods))
+
+    #conditions pyarrow cannot compare (e.g. year == "2023" on the integer year) raise when the filter is
+    #built or applied; the query is then left to query() and only the periods are pushed down
+    try:
+        expression, exact = query_filter(query)
+        if period is not None:
+            expression = period if expression is None else period & expression
+        #a query that is not fully pushed down may need columns beyond the requested ones
+        names = [i for i in schema.names if columns is None or i in columns or not exact]
+        orders = _read(dataset, names, expression, query, cols, periods)
+    except (pa.ArrowInvalid, pa.ArrowNotImplementedError, pa.ArrowTypeError):
+        exact = False
+        orders = _read(dataset, schema.names, period, query, cols, periods)
+
+    #restore the dtypes that were written: partition columns come back as plain values, and categoricals
+    #get their categories in sorted order as apply_schema gives them (the report rows follow that order)
+    for i in orders.columns:
+        dtype = schema.field(i).type
+        if pa.types.is_dictionary(dtype):
+            column = orders[i].astype('category')
+            orders[i] = column.cat.reorder_categories(column.cat.categories.sort_values())
+        elif i in partition_cols:
+            orders[i] = orders[i].astype(dtype.to_pandas_dtype())
+
+    if not exact:
+        orders = orders.query(query)
+        if columns is not None:
+            orders = orders[[i for i in schema.names if i in columns]]
+    return orders
@@ -0,0 +1,166 @@
+'''
+Data preprocessing of Part 1 (Description 1-3 and 1-4) as reusable functions.
+'''
+
+import ast
+
+import numpy as np
+import pandas as pd
+
+from order_analysis import trace
+from order_analysis.schema import apply_schema
+
+
+#ship_mode values treated as outliers in Description 1-3
+SHIP_MODE_OUTLIERS = ['Not Available', 'unknown']
+
+#2023 U.S. e-commerce discount level, see Description 1-4
+DISCOUNT_MULTIPLIER = 1.97
+
+#derived columns of Description 1-4 as expressions of the columns before them (discount_percent is the
+#adjusted rate); a column is only computed when it is asked for, see derive
+DERIVED_COLUMNS = {'sell_price' : 'list_price * (1 - discount_percent)',
+                   'revenue' : 'sell_price * quantity',
+                   'cost' : 'cost_price * quantity',
+                   'profit' : 'revenue - cost',
+                   'discount' : 'revenue * discount_percent'}
+
+#rows evaluated at a time by derive, so the temporaries of an expression stay small
+BLOCK_ROWS = 1 << 16
+
+
+def standardize_columns(columns):
+    '''Column name format of Description 1-3, e.g. 'Order Date' -> 'order_date'.'''
+    return [i.replace(' ', '_').lower() for i in columns]
+
+
+def ship_mode_fill_value(ship_mode):
+    '''Mode of ship_mode after the outliers are removed, used to fill its missing values.'''
+    return ship_mode[~ship_mode.isin(SHIP_MODE_OUTLIERS)].mode()[0]
+
+
+def clean_orders(orders, ship_mode_fill = None):
+    '''
+    Description 1-3: standardize column names, fix the column types, remove the ship_mode outliers
+    and fill the missing ship_mode with the mode.
+    ship_mode_fill can be given so that every chunk of a streamed file uses the mode of the whole file.
+    '''
+    with trace.stage('clean.standardize_columns', len(orders)):
+        orders = orders.copy()
+        orders.columns = standardize_columns(orders.columns)
+
+    with trace.stage('clean.to_datetime', len(orders)):
+        orders['order_date'] = pd.to_datetime(orders['order_date'], errors = 'coerce')
+
+    with trace.stage('clean.fix_types', len(orders)):
+        orders['order_id'] = orders['order_id'].astype(str)
+        orders['postal_code'] = orders['postal_code'].astype(str)
+
+    with trace.stage('clean.ship_mode', len(orders)) as step:
+        orders = orders[~orders['ship_mode'].isin(SHIP_MODE_OUTLIERS)]
+
+        if ship_mode_fill is None:
+            ship_mode_fill = orders['ship_mode'].mode()[0]
+        orders['ship_mode'] = orders['ship_mode'].fillna(ship_mode_fill)
+        step.rows_out = len(orders)
+
+    return orders
+
+
+def _derived_tree(name, stored):
+    tree = ast.parse(DERIVED_COLUMNS[name], mode = 'eval').body
+
+    class Inline(ast.NodeTransformer):
+        def visit_Name(self, node):
+            if node.id in DERIVED_COLUMNS and node.id not in stored:
+                return _derived_tree(node.id, stored)
+            return node
+
+    return Inline().visit(tree)
+
+
+def derived_expression(name, stored = ()):
+    '''
+    Expression of a derived column over the stored columns, the derived columns it uses inlined unless they
+    are stored, e.g. revenue -> 'list_price * (1 - discount_percent) * quantity'.
+    '''
+    if name not in DERIVED_COLUMNS:
+        raise KeyError(f'{name} is not a derived column; please use one of {list(DERIVED_COLUMNS)}')
+    return ast.unparse(_derived_tree(name, set(stored)))
+
+
+def derive(orders, names = None):
+    '''
+    Derived columns (all of them by default) that the orders do not store yet, as {name: array}. Each one is
+    a single expression over the stored columns (see derived_expression), evaluated BLOCK_ROWS rows at a
+    time into its result array, so no full-length temporary is created; columns derived earlier in the
+    same call are reused by the later ones.
+    '''
+    names = [i for i in (DERIVED_COLUMNS if names is None else names) if i not in orders.columns]
+    arrays = {}
+    for name in DERIVED_COLUMNS:
+        if name not in names:
+            continue
+        tree = ast.Expression(_derived_tree(name, set(orders.columns) | set(arrays)))
+        code = compile(tree, name, 'eval')
+        inputs = {i.id : arrays[i.id] if i.id in arrays else orders[i.id].to_numpy()
+                  for i in ast.walk(tree) if isinstance(i, ast.Name)}
+
+        #the dtype of the result follows from the dtypes of the inputs
+        values = np.empty(len(orders), dtype = eval(code, {}, {i : j[:0] for i, j in inputs.items()}).dtype)
+        for start in range(0, len(orders), BLOCK_ROWS):
+            values[start:start + BLOCK_ROWS] = eval(code, {}, {i : j[start:start + BLOCK_ROWS] for i, j in inputs.items()})
+        arrays[name] = values
+
+    return {i : arrays[i] for i in names}
+
+
+def column_values(orders, name):
+    '''Array of a stored column, or of a derived column computed on demand when it is not stored.'''
+    if name in orders.columns:
+        return orders[name].to_numpy()
+    return derive(orders, [name])[name]
+
+
+def with_derived(orders, names):
+    '''The orders with the derived columns among names added when they are not stored (the same frame otherwise).'''
+    arrays = derive(orders, [i for i in names if i in DERIVED_COLUMNS])
+    return orders.assign(**arrays) if arrays else orders
+
+
+def add_columns(orders, discount_multiplier = DISCOUNT_MULTIPLIER, derived = None):
+    '''
+    Description 1-4: add the date parts, the adjusted discount rate and the revenue/cost/profit columns.
+    derived lists the derived columns to store (all by default); the others are left to be computed on
+    demand by the reports (see with_derived) or inside the queries of the duckdb engine.
+    '''
+    with trace.stage('derive.date_parts', len(orders)):
+        orders['year'] = orders['order_date'].dt.year
+        orders['month'] = orders['order_date'].dt.month
+        orders['day'] = orders['order_date'].dt.day
+
+    with trace.stage('derive.amounts', len(orders)):
+        orders['discount_percent'] = orders['discount_percent'] / 100 * discount_multiplier
+        for name, values in derive(orders, derived).items():
+            orders[name] = values
+
+    return orders
+
+
+def preprocess_orders(orders, ship_mode_fill = None, discount_multiplier = DISCOUNT_MULTIPLIER, compact = True,
+                      derived = None):
+    '''
+    Description 1-3 and 1-4 in one call, followed by the compact dtype schema unless compact is False.
+    Files that already carry the derived columns (such as the orders.csv shipped with this project)
+    are only cleaned, so the discount adjustment is never applied twice.
+    derived lists the derived columns to store (all by default, [] for none), see add_columns.
+    '''
+    with trace.stage('preprocess', len(orders)) as step:
+        orders = clean_orders(orders, ship_mode_fill)
+        if 'year' not in orders.columns:
+            orders = add_columns(orders, discount_multiplier, derived)
+        if compact:
+            with trace.stage('schema', len(orders)):
+                orders = apply_schema(orders)
+        step.rows_out = len(orders)
+    return orders
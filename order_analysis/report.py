@@ -0,0 +1,459 @@
+'''
+Report template of Part 1 (Description 2-3 to 2-7) as a library.
+
+The functions are the same as in the Part 1 script, except that the computation of the chart tables is
+separated from the matplotlib rendering so reports can run without a display. None of them reads
+module-level state or mutates its input: a report is a pure function of its arguments, so reports can run
+in parallel threads and be cached by argument. ReportContext bundles the arguments shared by a report suite.
+'''
+
+import numpy as np
+import pandas as pd
+
+from order_analysis import trace
+from order_analysis.cube import OrderCube
+from order_analysis.explain import DIMENSIONS, explain_delta
+from order_analysis.kpi import report_rules
+from order_analysis.preprocessing import with_derived
+from order_analysis.topk import top_k
+
+
+def compared_periods(table, cols):
+    '''time_1 (latest) and time_2 (earliest) period of the table, as set in the Part 1 script.'''
+    return table[cols].max(), table[cols].min()
+
+
+'''  Description 2-3 (array core) Report metrics of any number of periods, e.g. 24 months of MoM or 5 years of YoY  '''
+
+#(metric, aggfunc) of the sales_report pivot and the report names of the base metrics
+PERIOD_AGGFUNC = [('revenue', 'sum'), ('profit', 'sum'), ('cost', 'sum'), ('discount', 'sum'),
+                  ('quantity', 'mean'), ('list_price', 'mean'), ('cost_price', 'mean'), ('sell_price', 'mean')]
+PERIOD_METRICS = ['revenue', 'profit', 'cost', 'discount',
+                  'avg_quantity', 'avg_list_price', 'avg_cost_price', 'avg_sell_price',
+                  'revenue_share', 'profit_rate', 'discount_rate']
+
+
+def period_values(table, index_cols, cols, periods = None, share_totals = None):
+    '''
+    Report metrics of every group and period as one (group x period x metric) ndarray.
+    cols is a period column or a list of them (e.g. ['year', 'month'] for a monthly series across years);
+    periods selects the given periods in the given order (missing ones are NaN), or the last n periods when it is an int.
+    share_totals ({period: revenue}) replaces the table's own period totals in revenue_share, for tables
+    that hold only some of the groups (see top_movers).
+    Returns (groups, periods, values) with the metrics in PERIOD_METRICS order.
+    '''
+    aggfunc = {i : [j] for i, j in PERIOD_AGGFUNC}
+    if isinstance(table, pd.DataFrame):
+        #derived metrics that the orders do not store are computed for this pivot only
+        table = with_derived(table, list(aggfunc))
+    with trace.stage('report.pivot', table, index_cols = index_cols, cols = cols) as step:
+        pivot = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc, observed = True)
+        step.rows_out = len(pivot)
+
+    #every (metric, period) combination, chronological unless periods are given, so the values reshape into a regular array
+    names = pivot.columns.names[2:]
+    if periods is None or isinstance(periods, int):
+        period_index = pivot.columns.droplevel([0, 1]).unique().sort_values()
+        period_index = period_index if periods is None else period_index[-periods:]
+    elif len(names) > 1:
+        period_index = pd.MultiIndex.from_tuples(periods, names = names)
+    else:
+        period_index = pd.Index(periods, name = names[0])
+
+    columns = pd.MultiIndex.from_tuples([(i, j) + (k if isinstance(k, tuple) else (k,))
+                                         for i, j in PERIOD_AGGFUNC for k in period_index])
+    position = pivot.columns.get_indexer(columns)
+
+    #fill one preallocated array: the pivoted metrics first, then the derived ratios written in place
+    #(the pivot frame is released before the array is allocated, so at most two copies are alive)
+    groups, pivoted = pivot.index, pivot.to_numpy(dtype = float)
+    del pivot
+    n_groups, n_periods, n_base = len(groups), len(period_index), len(PERIOD_AGGFUNC)
+    values = np.full((n_groups, n_periods, len(PERIOD_METRICS)), np.nan)
+    for k in range(n_base):
+        for p in range(n_periods):
+            column = position[k * n_periods + p]
+            if column >= 0:
+                values[:, p, k] = pivoted[:, column]
+    del pivoted
+
+    revenue, profit, discount = values[:, :, 0], values[:, :, 1], values[:, :, 3]
+    has_revenue = revenue != 0
+
+    #revenue share within each period, net profit margin and discount rate (0 where there is no revenue,
+    #NaN where the group has no orders in the period, as in the pivot_table version)
+    totals = np.nansum(revenue, axis = 0, keepdims = True)
+    if share_totals is not None:
+        totals = np.array([[share_totals.get(i, np.nan) for i in period_index]])
+    for k, numerator, denominator in [(n_base, revenue, totals), (n_base + 1, profit, revenue), (n_base + 2, discount, revenue)]:
+        values[:, :, k] = 0
+        np.divide(numerator, denominator, out = values[:, :, k], where = has_revenue)
+
+    return groups, period_index, values
+
+
+def period_over_period(values, lag = 1):
+    '''
+    Relative change and difference of every metric against the period lag steps earlier, computed on the whole
+    (group x period x metric) array at once. The periods must be consecutive (see calendar_periods), so a step
+    is one calendar period. The first lag periods have no comparison and are NaN.
+    '''
+    previous = values[:, :-lag, :]
+
+    change = np.full(values.shape, np.nan)
+    diff = np.full(values.shape, np.nan)
+    np.subtract(values[:, lag:, :], previous, out = diff[:, lag:, :])
+    np.divide(diff[:, lag:, :], previous, out = change[:, lag:, :], where = previous != 0)
+    change[:, lag:, :][previous == 0] = 0
+
+    return change, diff
+
+
+def calendar_periods(period_index):
+    '''
+    Every calendar period from the first to the last of period_index: consecutive years or months for a single
+    period column, consecutive months across years for ['year', 'month'].
+    '''
+    if period_index.nlevels == 1:
+        return pd.Index(range(period_index.min(), period_index.max() + 1), name = period_index.name)
+    if period_index.nlevels == 2 and period_index.names[1] == 'month':
+        first, last = [i[0] * 12 + i[1] - 1 for i in [period_index.min(), period_index.max()]]
+        return pd.MultiIndex.from_tuples([(i // 12, i % 12 + 1) for i in range(first, last + 1)],
+                                         names = period_index.names)
+    raise ValueError(f'there is no calendar for the periods {list(period_index.names)}; '
+                     'please compare year, month or [\'year\', \'month\']')
+
+
+def period_report(table, index_cols, cols, periods = None, lag = 1, aggfunc_pick = None):
+    '''
+    Rolling multi-period report: one row per group and period with the metrics, their change against the
+    period lag steps earlier (_yoy for years or 12-month lags, _mom otherwise) and the difference (_diff).
+    Lags count calendar periods, so a period without orders in the table leaves the comparisons NaN
+    instead of shifting them onto another period.
+    The frame is built once from the arrays instead of inserting one column per metric and period.
+    '''
+    cols_list = [cols] if isinstance(cols, str) else list(cols)
+    groups, period_index, values = period_values(table, index_cols, cols, periods)
+
+    #shift on the full calendar, periods without orders are NaN
+    calendar = calendar_periods(period_index)
+    position = calendar.get_indexer(period_index)
+    on_calendar = np.full((len(groups), len(calendar), values.shape[2]), np.nan)
+    on_calendar[:, position, :] = values
+    change, diff = [i[:, position, :] for i in period_over_period(on_calendar, lag)]
+    del on_calendar
+
+    suffix = 'yoy' if cols_list == ['year'] or (cols_list[-1] == 'month' and lag == 12) else 'mom'
+    names = (PERIOD_METRICS + [f'{i}_{suffix}' for i in PERIOD_METRICS] + [f'{i}_diff' for i in PERIOD_METRICS])
+
+    n_groups, n_periods, n_metrics = values.shape
+    data = np.concatenate([values, change, diff], axis = 2).reshape(n_groups * n_periods, 3 * n_metrics)
+
+    keys = [groups.to_frame(index = False).iloc[np.repeat(np.arange(n_groups), n_periods)],
+            period_index.to_frame(index = False).iloc[np.tile(np.arange(n_periods), n_groups)]]
+    keys = [i.reset_index(drop = True) for i in keys]
+
+    if aggfunc_pick is not None:
+        picked = [j for i in aggfunc_pick for j in [i, f'{i}_{suffix}', f'{i}_diff']]
+        data = data[:, [names.index(i) for i in picked]]
+        names = picked
+
+    return pd.concat(keys + [pd.DataFrame(data, columns = names)], axis = 1)
+
+
+'''  Description 2-3 Create a report template that presents indicators using MoM, YoY, and difference methods  '''
+
+def sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2, share_totals = None):
+
+    #pivot the two compared periods into one (group x period x metric) array
+    groups, _, values = period_values(table, index_cols, cols, [time_2, time_1], share_totals)
+
+    #report columns of the picked metrics: time_2, time_1, diff(revenue/profit_rate only), yoy/mom
+    picked = [i for i in aggfunc_pick if i in PERIOD_METRICS]
+    position = [PERIOD_METRICS.index(i) for i in picked]
+    suffix = {'year' : 'yoy', 'month' : 'mom'}.get(cols)
+    names = []
+    for i in picked:
+        names += [f'{i}_{time_2}', f'{i}_{time_1}']
+        if i in ['revenue', 'profit_rate']:
+            names.append(f'{i}_diff')
+        if suffix is not None:
+            names.append(f'{i}_{suffix}')
+
+    sort = []
+    for i in aggfunc_pick:
+        for j in [f'_{time_1}', '_diff']:
+            if i + j in names:
+                sort.append(i + j)
+
+    #rank the groups on the sort keys first, so the report array is filled directly in report row order
+    keys = {}
+    for k, i in zip(position, picked):
+        keys[f'{i}_{time_1}'] = values[:, 1, k]
+        keys[f'{i}_diff'] = values[:, 1, k] - values[:, 0, k]
+    order = pd.DataFrame({i : keys[i] for i in sort}).sort_values(by = sort, ascending = False).index.to_numpy()
+    del keys
+
+    #fill one preallocated array; diff and YoY/MoM are written straight into their columns
+    data = np.empty((len(groups), len(names)))
+    column = names.index
+    for k, i in zip(position, picked):
+        previous, current = values[order, 0, k], values[order, 1, k]
+        diff = np.subtract(current, previous, out = data[:, column(f'{i}_diff')] if f'{i}_diff' in names else None)
+        data[:, column(f'{i}_{time_2}')] = previous
+        data[:, column(f'{i}_{time_1}')] = current
+        if suffix is not None:
+            change = data[:, column(f'{i}_{suffix}')]
+            change[:] = 0
+            np.divide(diff, previous, out = change, where = previous != 0)
+    del values
+
+    #generate the report; the frame wraps the array without another copy
+    table = pd.DataFrame(data, index = groups.take(order), columns = names, copy = False).reset_index()
+    table.index = order
+
+    return table
+
+
+'''  Description 2-4 Set KPI conditions and generate Star/Review lists, see kpi.py for the conditions  '''
+
+def kpi_list(table, cols):
+    '''
+    Star and Review lists of a report. The conditions are compiled once into array masks (see kpi.py)
+    and every condition of a list is applied, as documented in Description 2-4.
+    '''
+    with trace.stage('kpi_list', table) as step:
+        rules = report_rules(cols)
+        masks = rules.masks(table)
+        star_list = table[masks[:, rules.label_names.index('star')]]
+        review_list = table[masks[:, rules.label_names.index('review')]]
+        step.rows_out = len(star_list) + len(review_list)
+
+    return star_list, review_list
+
+
+'''  Description 2-5 Enhance the readability of the report by setting columns as integers or as floats.  '''
+
+def data_types_transform(table, time_1, time_2):
+    '''Readable copy of a report for presentation; the numeric report itself is left as it is.'''
+
+    table_columns_name = []
+    for i in ['revenue', 'profit', 'cost', 'discount', 'avg_list_price',  'avg_cost_price', 'avg_sell_price']:
+        for j in [f'_{time_2}', f'_{time_1}', '_diff']:
+            table_columns_name.append(i + j)
+
+    #format every column once and build the presentation frame in one go
+    columns = {}
+    for i in table.columns:
+        if i in table_columns_name:
+            columns[i] = table[i].astype(int)
+        elif i in [f'avg_quantity_{time_1}'] or i in [f'avg_quantity_{time_2}']:
+            columns[i] = table[i].round(2).astype(str)
+        elif table[i].dtypes == float:
+            columns[i] = (table[i] * 100).round(2).astype(str) + '%'
+        else:
+            columns[i] = table[i]
+
+    return pd.DataFrame(columns, index = table.index)
+
+
+'''  Description 2-6 Up to 6 indicators can be specified and each will produce an individual dual-bar chart.  '''
+
+def draw_double_bar(pictures, column_label, column_bar1, column_bar2, y_label):
+    '''Build the dual-bar figure and return it; showing or saving it is up to the caller.'''
+    import matplotlib.pyplot as plt
+
+    num_pictures = min(len(pictures), 6)
+    num_rows = (num_pictures + 1) // 2
+    num_cols = min(num_pictures, 2)
+
+    fig, axes = plt.subplots(num_rows, num_cols, figsize = (12, 6 * num_rows))
+    if num_pictures == 1:
+        axes = [axes]
+    else:
+        axes = axes.flatten()
+
+    width = 0.3
+
+    for i in range(num_pictures):
+        j = pictures[i]
+        x = np.arange(len(j.iloc[:, column_label]))
+        x_label = j.iloc[:, column_label]
+        x_bar_1 = j.iloc[:, column_bar1]
+        x_bar_2 = j.iloc[:, column_bar2]
+        x_name = j.columns[0]
+
+        axes[i].bar(x, x_bar_1, width, color = 'aquamarine', label = j.iloc[:, column_bar1].name)
+        axes[i].bar(x + width, x_bar_2, width, color = 'dodgerblue', label = j.iloc[:, column_bar2].name)
+        axes[i].set_xticks(x + width / 2)
+        axes[i].set_xticklabels(x_label, rotation = 45, ha = 'right')
+        axes[i].set_ylabel(y_label)
+        axes[i].set_title(x_name)
+        axes[i].legend(bbox_to_anchor = (1, 1), loc = 'upper left')
+
+    fig.tight_layout()
+    return fig
+
+
+'''  Description 2-7 Report and chart tables of draw_and_report, see the Part 1 script for the index_cols/aggfunc_pick rules  '''
+
+def chart_review(sales_review, table, index_cols, aggfunc_pick, time_1, time_2):
+    '''
+    Sort/limit a sales_report the way draw_and_report does and build the chart tables.
+    Returns (sales_review, pictures) without touching matplotlib.
+    '''
+    sales_review = sales_review.copy()
+    if index_cols == ['month']:
+        sales_review = sales_review.sort_values(by = 'month')
+
+    pictures = []
+    if len(index_cols) == 2:
+        sales_review[f'{index_cols[0]}_{index_cols[1]}'] = (sales_review[index_cols[0]].astype(str) + '_' +
+                                                            sales_review[index_cols[1]].astype(str))
+        if sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() > 12:
+            sales_review = sales_review.iloc[top_k(sales_review['revenue_diff'], 10, largest = False)]
+        elif sales_review[f'{index_cols[0]}_{index_cols[1]}'].nunique() <= 12:
+            sales_review = sales_review.sort_values(by = 'revenue_diff', ascending = True)
+        for i in aggfunc_pick:
+            pictures.append(sales_review.loc[:, [f'{index_cols[0]}_{index_cols[1]}', f'{i}_{time_2}', f'{i}_{time_1}']])
+
+    elif len(index_cols) == 1:
+        if table[index_cols[0]].nunique() > 12:
+            sales_review = sales_review.iloc[top_k(sales_review['revenue_diff'], 10, largest = False)]
+        elif table[index_cols[0]].nunique() <= 12:
+            if index_cols != ['month']:
+                sales_review = sales_review.sort_values(by = 'revenue_diff', ascending = True)
+        for i in aggfunc_pick:
+            pictures.append(sales_review.loc[:, [index_cols[0], f'{i}_{time_2}', f'{i}_{time_1}']])
+
+    elif len(index_cols) > 2:
+        raise ValueError(f'The maximum limit for the index_cols parameter is 2, there are {len(index_cols)}. Please adjust accordingly')
+
+    return sales_review, pictures
+
+
+def members(table, index_cols):
+    '''Number of groups of the index_cols, as chart_review counts them.'''
+    if len(index_cols) == 1:
+        return table[index_cols[0]].nunique()
+    return len(table[list(index_cols)].drop_duplicates())
+
+
+def top_movers(table, index_cols, cols, aggfunc_pick, time_1, time_2, k = 10, largest = False):
+    '''
+    sales_report of only the k groups with the largest revenue decline (or growth when largest is True),
+    which are the rows chart_review keeps for dimensions with more than 12 members. The groups are picked by
+    partial selection on a revenue-only aggregation and the full report is built for them alone; revenue_share
+    still uses the totals of all groups.
+    '''
+    if isinstance(table, pd.DataFrame):
+        table = with_derived(table, ['revenue'])
+    revenue = table.pivot_table(index = index_cols, columns = cols, aggfunc = {'revenue' : ['sum']}, observed = True)
+    revenue = revenue.droplevel([0, 1], axis = 1)
+    previous, current = revenue.get(time_2), revenue.get(time_1)
+
+    #groups without orders in one of the periods have no revenue_diff and are ranked by the report order,
+    #so the full report is needed when fewer than k groups can be ranked on revenue_diff
+    if previous is None or current is None or (current - previous).notna().sum() < k:
+        return sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+
+    keys = revenue.index[top_k(current - previous, k, largest)]
+    if hasattr(table, 'select_groups'):
+        #lazy tables (see engine.py) add the groups to their query plan
+        selected = table.select_groups(index_cols, keys)
+    else:
+        frame = table.cells if isinstance(table, OrderCube) else table
+        selected = frame[index_cols[0]] if len(index_cols) == 1 else pd.MultiIndex.from_frame(frame[index_cols])
+        selected = frame[np.asarray(selected.isin(keys))]
+        if isinstance(table, OrderCube):
+            selected = OrderCube(selected, table.dimensions, table.periods, table.metrics)
+
+    share_totals = {time_2 : np.nansum(previous.to_numpy()), time_1 : np.nansum(current.to_numpy())}
+    return sales_report(selected, index_cols, cols, aggfunc_pick, time_1, time_2, share_totals)
+
+
+def draw_and_report(table, index_cols, cols, aggfunc_pick, time_1 = None, time_2 = None):
+    '''Interactive version of Description 2-7: show the chart and print the readable report.'''
+    import matplotlib.pyplot as plt
+
+    if time_1 is None or time_2 is None:
+        time_1, time_2 = compared_periods(table, cols)
+
+    with trace.stage('draw_and_report', table, index_cols = index_cols, cols = cols):
+        with trace.stage('sales_report', table, index_cols = index_cols) as step:
+            #only 10 groups are charted and printed for a dimension with more than 12 members
+            if len(index_cols) <= 2 and index_cols != ['month'] and members(table, index_cols) > 12:
+                sales_review = top_movers(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+            else:
+                sales_review = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+            step.rows_out = len(sales_review)
+        with trace.stage('chart_review', len(sales_review)):
+            sales_review, pictures = chart_review(sales_review, table, index_cols, aggfunc_pick, time_1, time_2)
+
+        with trace.stage('plot', len(sales_review)):
+            draw_double_bar(pictures, 0, 1, 2, '')
+            plt.show()
+
+        with trace.stage('data_types_transform', len(sales_review)):
+            report = data_types_transform(sales_review, time_1, time_2)
+        print(f'{"_".join(index_cols)} sales {report}')
+
+
+'''  Description 3-1-1 Overview of the report by order_id: totals, rates and averages of the compared periods  '''
+
+def sales_overview(sales_review, table, cols, time_1, time_2):
+    '''
+    The sales overview printed in Description 3-1-1: revenue, profit and discount totals of a report by order_id
+    (each order truncated to an integer, as in the Part 1 script), net profit and discount rates and the average
+    sell_price and quantity of the order lines of each period. Returns a frame of metrics x [time_2, time_1].
+    '''
+    sales_review = sales_review.fillna(0)
+    rows = {i : [sales_review[f'{i}_{j}'].astype(int).sum() for j in [time_2, time_1]]
+            for i in ['revenue', 'profit', 'discount']}
+    for i in ['profit', 'discount']:
+        rows[f'{i}_rate'] = [j / k for j, k in zip(rows[i], rows['revenue'])]
+
+    averages = with_derived(table, ['sell_price', 'quantity']).groupby(cols)[['sell_price', 'quantity']].mean()
+    for i in ['sell_price', 'quantity']:
+        rows[f'avg_{i}'] = averages.loc[[time_2, time_1], i].tolist()
+
+    overview = pd.DataFrame.from_dict(rows, orient = 'index', columns = [time_2, time_1])
+    return overview
+
+
+class ReportContext:
+    '''
+    The table (orders frame, OrderCube or LazyOrders), the period column and the compared periods of a report suite,
+    i.e. what the Part 1 script keeps in the table/cols/time_1/time_2 variables.
+    The context is never modified; query() returns a new context for a slice with the same periods.
+    '''
+
+    def __init__(self, table, cols = 'year', time_1 = None, time_2 = None):
+        if time_1 is None or time_2 is None:
+            time_1, time_2 = compared_periods(table, cols)
+        self.table = table
+        self.cols = cols
+        self.time_1 = time_1
+        self.time_2 = time_2
+
+    def query(self, expr):
+        '''Context of a slice such as 'category == "Furniture"', compared over the same periods.'''
+        return ReportContext(self.table.query(expr), self.cols, self.time_1, self.time_2)
+
+    def sales_report(self, index_cols, aggfunc_pick):
+        return sales_report(self.table, index_cols, self.cols, aggfunc_pick, self.time_1, self.time_2)
+
+    def kpi_list(self, sales_review):
+        return kpi_list(sales_review, self.cols)
+
+    def data_types_transform(self, sales_review):
+        return data_types_transform(sales_review, self.time_1, self.time_2)
+
+    def chart_review(self, sales_review, index_cols, aggfunc_pick):
+        return chart_review(sales_review, self.table, index_cols, aggfunc_pick, self.time_1, self.time_2)
+
+    def draw_and_report(self, index_cols, aggfunc_pick):
+        return draw_and_report(self.table, index_cols, self.cols, aggfunc_pick, self.time_1, self.time_2)
+
+    def explain_delta(self, metric = 'revenue', dimensions = DIMENSIONS, k = 10, largest = False, max_depth = None):
+        return explain_delta(self.table, self.cols, self.time_1, self.time_2, metric, dimensions, k, largest, max_depth)
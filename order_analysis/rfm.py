@@ -0,0 +1,233 @@
+'''
+Product-level RFM model (Part 2) in Python.
+
+The `RFM` table in `Part2. Product RFM model_DAX.txt` filters the whole orders table once per
+product (FILTER/EARLIER) and re-evaluates PERCENTILEX.INC for every row and every score tier.
+Here the same table is built with one grouped aggregation and one quantile computation per metric,
+and the same kernel serves other grains (customers, product x region ...).
+'''
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.preprocessing import column_values
+
+
+#PERCENTILEX.INC cut points used by every score tier of the DAX measure
+QUANTILES = [0.2, 0.4, 0.6, 0.8]
+
+#monetary is summed as an integer number of millionths of revenue: integer sums do not depend on the order or
+#the chunking of the lines, while float sums do in the last bits, which can move a product across a cut point
+MONETARY_SCALE = 10 ** 6
+
+#grains of the RFM model: the DAX product level, a customer proxy (the data has no customer id, see the README)
+#and products per region
+RFM_KEYS = {'product' : 'product_id',
+            'customer' : ['city', 'postal_code'],
+            'product_region' : ['product_id', 'region']}
+
+SEGMENTS = ['1.Star', '2.Hot Seller', '3.Potential', '4.Revival',
+            '5.New', '6.Disposal', '7.Regular', '8.Others']
+
+
+def compact_codes(codes, size):
+    '''Codes (-1 kept) compacted to the values that occur, and the positions of those values.'''
+    missing = codes.min(initial = 0) < 0
+    observed = np.bincount(codes[codes >= 0] if missing else codes, minlength = size) > 0
+    if observed.all():
+        return codes.astype(np.intp), np.arange(size)
+    remap = np.cumsum(observed) - 1
+    if missing:
+        return np.where(codes >= 0, remap[np.maximum(codes, 0)], -1), np.flatnonzero(observed)
+    return remap[codes], np.flatnonzero(observed)
+
+
+def column_codes(column):
+    '''
+    pd.factorize(column, sort = True) without hashing where the values already are small integers:
+    categoricals are compacted from their category codes and integer columns of a small range (year,
+    month ...) from their offset to the minimum.
+    '''
+    if isinstance(column.dtype, pd.CategoricalDtype):
+        codes, positions = compact_codes(column.cat.codes.to_numpy(), len(column.cat.categories))
+        return codes, pd.Categorical.from_codes(positions, dtype = column.dtype)
+    if isinstance(column.dtype, np.dtype) and column.dtype.kind in 'iu' and len(column):
+        values = column.to_numpy()
+        low, high = int(values.min()), int(values.max())
+        if high - low <= len(values):
+            codes, positions = compact_codes((values - low).astype(np.int64), high - low + 1)
+            return codes, (positions + low).astype(values.dtype)
+    return pd.factorize(column, sort = True)
+
+
+def key_codes(orders, key):
+    '''
+    Integer group code of every order line for a key column or a list of key columns (composite key),
+    and the index of the groups in sorted order. Lines with a missing key get -1, as groupby drops them.
+    '''
+    columns = [key] if isinstance(key, str) else list(key)
+    codes, levels = [], []
+    for i in columns:
+        code, uniques = column_codes(orders[i])
+        codes.append(code)
+        levels.append(uniques)
+
+    if len(columns) == 1:
+        return codes[0], pd.Index(levels[0], name = columns[0])
+
+    #mixed-radix code of the combination, then compacted to the observed combinations (still sorted):
+    #through a bincount over the code space when it is not much larger than the table, a factorize otherwise
+    missing = np.logical_or.reduce([i < 0 for i in codes])
+    shape = [max(len(i), 1) for i in levels]
+    combined = np.ravel_multi_index([np.where(missing, 0, i) for i in codes], shape)
+    if np.prod(shape, dtype = float) <= max(len(combined), 1 << 20):
+        code, uniques = compact_codes(np.where(missing, -1, combined), int(np.prod(shape)))
+    else:
+        code, uniques = pd.factorize(np.where(missing, -1, combined), sort = True, use_na_sentinel = False)
+        if missing.any():
+            #-1 sorts first; shift it out
+            code, uniques = code - 1, uniques[1:]
+    groups = pd.MultiIndex(levels = levels, codes = np.unravel_index(uniques, shape), names = columns)
+    return code, groups
+
+
+def monetary_units(revenue):
+    '''Revenue of order lines in int64 millionths (missing revenue counts 0), see MONETARY_SCALE.'''
+    return np.rint(np.nan_to_num(np.asarray(revenue, dtype = float)) * MONETARY_SCALE).astype(np.int64)
+
+
+def rfm_bases(orders, keys):
+    '''
+    Grouped RFM kernel: the rfm_base of several keys (e.g. {'product' : 'product_id',
+    'customer' : ['city', 'postal_code'], 'product_region' : ['product_id', 'region']}) in one pass over
+    the order columns. Each key is reduced to integer codes, then frequency and monetary are integer sums and
+    the last order date a maximum per code, so no grain needs its own groupby or DAX table. monetary_units
+    keeps the exact integer sum behind monetary, so bases of order chunks combine to the same monetary.
+    '''
+    dates = orders['order_date'].to_numpy()
+    stamps = dates.view(np.int64)
+    has_order_id = orders['order_id'].notna().to_numpy()
+    units = monetary_units(column_values(orders, 'revenue'))
+
+    bases = {}
+    for name, key in keys.items():
+        codes, groups = key_codes(orders, key)
+        observed = codes >= 0
+        codes = codes[observed]
+        n_groups = len(groups)
+
+        #NaT is the smallest int64, so a maximum over the raw stamps skips it like groupby max does
+        last_order_date = np.full(n_groups, np.iinfo(np.int64).min)
+        np.maximum.at(last_order_date, codes, stamps[observed])
+
+        monetary = np.zeros(n_groups, dtype = np.int64)
+        np.add.at(monetary, codes, units[observed])
+
+        bases[name] = pd.DataFrame({'last_order_date' : last_order_date.view(dates.dtype),
+                                    'frequency' : np.bincount(codes, weights = has_order_id[observed],
+                                                              minlength = n_groups).astype(np.int64),
+                                    'monetary' : monetary / MONETARY_SCALE,
+                                    'monetary_units' : monetary},
+                                   index = groups)
+    return bases
+
+
+def rfm_base(orders, key = 'product_id'):
+    '''
+    BaseTable of the DAX measure: last order date, frequency (COUNT of order_id) and
+    monetary (SUM of revenue) per key (a column or a list of columns), see rfm_bases.
+    '''
+    return rfm_bases(orders, {'base' : key})['base']
+
+
+def combine_rfm_base(bases):
+    '''
+    Merge rfm_base tables of disjoint order chunks: latest last_order_date, summed frequency and monetary.
+    monetary is summed in integer units, so the result equals the rfm_base of all the chunks' lines at once.
+    '''
+    base = pd.concat([i for i in bases if i is not None])
+    if 'monetary_units' not in base.columns:
+        base = base.assign(monetary_units = monetary_units(base['monetary']))
+    base = base.groupby(level = list(range(base.index.nlevels)), sort = True).agg(last_order_date = ('last_order_date', 'max'),
+                                                                                   frequency = ('frequency', 'sum'),
+                                                                                   monetary_units = ('monetary_units', 'sum'))
+    base.insert(2, 'monetary', base['monetary_units'] / MONETARY_SCALE)
+    return base
+
+
+def percentile_inc(values, quantiles = QUANTILES):
+    '''PERCENTILEX.INC equivalent: inclusive percentiles with linear interpolation between ranks.'''
+    return np.quantile(np.asarray(values, dtype = float), quantiles)
+
+
+def rfm_scores(base, last_orderdate = None, cuts = None):
+    '''
+    Add recency and the 1-5 Recency/Frequency/Monetary scores to an rfm_base table.
+    (1)last_orderdate defaults to the latest last_order_date, i.e. MAX(orders[order_date]).
+    (2)cuts optionally supplies precomputed {'recency': ..., 'frequency': ..., 'monetary': ...} cut points.
+    '''
+    if last_orderdate is None:
+        last_orderdate = base['last_order_date'].max()
+
+    recency = (pd.Timestamp(last_orderdate) - base['last_order_date']).dt.days.abs().to_numpy()
+    frequency = base['frequency'].to_numpy()
+    monetary = base['monetary'].to_numpy()
+    recency_score, frequency_score, monetary_score = score_arrays(recency, frequency, monetary, cuts)
+
+    table = pd.DataFrame({'recency' : recency,
+                          'frequency' : frequency,
+                          'monetary' : monetary,
+                          'RecencyScore' : recency_score.astype(np.int8),
+                          'FrequencyScore' : frequency_score.astype(np.int8),
+                          'MonetaryScore' : monetary_score.astype(np.int8)},
+                         index = base.index)
+    table['RFM_Score'] = (table['RecencyScore'].astype(str) + table['FrequencyScore'].astype(str) +
+                          table['MonetaryScore'].astype(str))
+    table['Segment'] = rfm_segment(recency_score, frequency_score, monetary_score)
+
+    return table
+
+
+def score_arrays(recency, frequency, monetary, cuts = None):
+    '''1-5 Recency, Frequency and Monetary score arrays, with the PERCENTILEX.INC cuts of the values unless given.'''
+    if cuts is None:
+        cuts = {'recency' : percentile_inc(recency),
+                'frequency' : percentile_inc(frequency),
+                'monetary' : percentile_inc(monetary)}
+
+    #[recency] <= P20 -> 5, ..., [recency] <= P80 -> 2, else 1
+    recency_score = 5 - np.searchsorted(cuts['recency'], recency, side = 'left')
+    #[frequency] >= P80 -> 5, ..., [frequency] >= P20 -> 2, else 1 (same for monetary)
+    frequency_score = 1 + np.searchsorted(cuts['frequency'], frequency, side = 'right')
+    monetary_score = 1 + np.searchsorted(cuts['monetary'], monetary, side = 'right')
+    return recency_score, frequency_score, monetary_score
+
+
+def segment_codes(r, f, m):
+    '''Position in SEGMENTS of the segment of every score triple (see rfm_segment).'''
+    r, f, m = np.asarray(r), np.asarray(f), np.asarray(m)
+
+    conditions = [(r == 5) & (f == 5) & (m == 5),
+                  (r >= 4) & (f >= 4) & (m >= 4),
+                  (r >= 4) & (f <= 3) & (m >= 4),
+                  (r <= 2) & (f >= 4) & (m >= 4),
+                  (r >= 4) & (f <= 2) & (m <= 3),
+                  (r <= 2) & (f <= 2) & (m <= 2),
+                  (r >= 2) & (r <= 4) & (f >= 2) & (f <= 4) & (m >= 2) & (m <= 4)]
+
+    return np.select(conditions, np.arange(len(SEGMENTS) - 1, dtype = np.int8), default = len(SEGMENTS) - 1)
+
+
+def rfm_segment(r, f, m):
+    '''Segment rules of the DAX SWITCH(TRUE(), ...), evaluated top to bottom on whole score arrays.'''
+    return np.array(SEGMENTS)[segment_codes(r, f, m)]
+
+
+def rfm_table(orders, key = 'product_id'):
+    '''Python equivalent of the Power BI `RFM` table: one row per key with scores and Segment.'''
+    return rfm_scores(rfm_base(orders, key)).reset_index()
+
+
+def rfm_tables(orders, keys = RFM_KEYS):
+    '''RFM table of every key (product, customer proxy, composite grains) from one run of the grouped kernel.'''
+    return {name : rfm_scores(base).reset_index() for name, base in rfm_bases(orders, keys).items()}
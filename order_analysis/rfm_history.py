@@ -0,0 +1,178 @@
+'''
+RFM history: the product segments as of every month end.
+
+The DAX measure anchors recency at MAX(orders[order_date]), so the Power BI table only shows the segments
+as of the last order. RFMHistory assigns every order line to the interval between two cutoffs (month ends)
+with one binary search, aggregates each (interval, product) cell once, and turns the cells into the
+cumulative per-product state (last order date, frequency, monetary) at every cutoff with a running sum and
+maximum, instead of rebuilding the rfm_base at every cutoff. The snapshot of a cutoff is the RFM table of
+the orders up to that day: recency is anchored at the last order date up to the cutoff and the quintile
+cut points are taken over the products ordered by then.
+
+Monetary is summed interval by interval in the integer units of rfm_bases, so every snapshot equals the
+rfm_table of the orders up to its cutoff.
+
+    history = RFMHistory(orders, months = 24)
+    history.segments()                          # Segment per product (rows) and month end (columns)
+    history.migrations()                        # segment-migration matrix between consecutive month ends
+    history.as_of('2016-06-15')                 # RFM table as of any day, replayed from the last checkpoint
+'''
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.preprocessing import column_values
+from order_analysis.rfm import (MONETARY_SCALE, SEGMENTS, key_codes, monetary_units, rfm_scores, score_arrays,
+                                segment_codes)
+
+
+#row / column label of products without any order yet in a migration matrix
+UNSEEN = '0.Not ordered yet'
+
+
+def month_ends(dates, months = None):
+    '''Month ends from the first to the last order month (the last months only, if months is given).'''
+    dates = pd.Series(dates).dropna()
+    if dates.empty:
+        return pd.DatetimeIndex([])
+    ends = pd.period_range(dates.min(), dates.max(), freq = 'M').to_timestamp(how = 'end').normalize()
+    return ends if months is None else ends[-months:]
+
+
+class RFMHistory:
+
+    def __init__(self, orders, key = 'product_id', cutoffs = None, months = None):
+        '''
+        orders are cleaned and enriched order lines (see preprocess_orders); cutoffs are the snapshot days
+        (inclusive), by default the month ends of the order history or of its last `months` months.
+        Lines without an order_date or key are left out, as they belong to no cutoff.
+        '''
+        codes, self.groups = key_codes(orders, key)
+        dates = orders['order_date'].to_numpy()
+        keep = (codes >= 0) & ~np.isnat(dates)
+        self.codes = codes[keep]
+        self.dates = dates[keep]
+        self.has_order_id = orders['order_id'].notna().to_numpy()[keep]
+        self.units = monetary_units(column_values(orders, 'revenue'))[keep]
+
+        self.cutoffs = pd.DatetimeIndex(month_ends(orders['order_date'], months) if cutoffs is None else cutoffs)
+        if not self.cutoffs.is_monotonic_increasing:
+            raise ValueError('cutoffs must be in increasing order; please sort them')
+
+        #interval of every line: 0 up to the first cutoff, i after cutoff i - 1 and up to cutoff i, ...
+        self.bucket = np.searchsorted(self._day_ends(self.cutoffs), self.dates, side = 'right')
+
+        #state of the lines of each interval, then the cumulative state at every cutoff: a running sum
+        #(frequency, monetary) or maximum (last order date) over the intervals instead of a rebuild per cutoff
+        n_groups, n_cutoffs = len(self.groups), len(self.cutoffs)
+        cell = self.bucket * n_groups + self.codes
+        size = (n_cutoffs + 1) * n_groups
+        last_order = np.full(size, np.iinfo(np.int64).min)
+        np.maximum.at(last_order, cell, self.dates.view(np.int64))
+        frequency = np.bincount(cell, weights = self.has_order_id, minlength = size).astype(np.int64)
+        monetary = np.zeros(size, dtype = np.int64)
+        np.add.at(monetary, cell, self.units)
+
+        self.last_order = np.maximum.accumulate(last_order.reshape(-1, n_groups), axis = 0)[:n_cutoffs]
+        self.frequency = np.cumsum(frequency.reshape(-1, n_groups), axis = 0)[:n_cutoffs]
+        self.monetary = np.cumsum(monetary.reshape(-1, n_groups), axis = 0)[:n_cutoffs]
+        #last order date up to each cutoff, the recency anchor of its snapshot
+        self.anchors = self.last_order.max(axis = 1, initial = np.iinfo(np.int64).min)
+        self._segment_codes = None
+
+    def _day_ends(self, days):
+        #an inclusive cutoff covers its whole day
+        return (pd.DatetimeIndex(days).normalize() + pd.Timedelta(days = 1)).to_numpy().astype(self.dates.dtype)
+
+    def _empty_state(self):
+        n_groups = len(self.groups)
+        return (np.full(n_groups, np.iinfo(np.int64).min), np.zeros(n_groups, dtype = np.int64),
+                np.zeros(n_groups, dtype = np.int64))
+
+    def _base(self, state):
+        '''rfm_base of a state: the products ordered so far and their last order date, frequency and monetary.'''
+        last_order, frequency, monetary = state
+        seen = last_order > np.iinfo(np.int64).min
+        return pd.DataFrame({'last_order_date' : last_order[seen].view(self.dates.dtype),
+                             'frequency' : frequency[seen],
+                             'monetary' : monetary[seen] / MONETARY_SCALE,
+                             'monetary_units' : monetary[seen]},
+                            index = self.groups[seen])
+
+    def snapshot_base(self, i):
+        '''rfm_base as of the i-th cutoff.'''
+        return self._base((self.last_order[i], self.frequency[i], self.monetary[i]))
+
+    def as_of(self, day):
+        '''
+        RFM table (see rfm_table) of the orders up to and including day: the state of the latest cutoff
+        before day plus the lines after it, so only the lines of one interval are replayed.
+        '''
+        i = np.searchsorted(self.cutoffs, pd.Timestamp(day).normalize(), side = 'right')
+        if i > 0 and self.cutoffs[i - 1] == pd.Timestamp(day).normalize():
+            return rfm_scores(self.snapshot_base(i - 1)).reset_index()
+
+        last_order, frequency, monetary = (self.last_order[i - 1].copy(), self.frequency[i - 1].copy(),
+                                           self.monetary[i - 1].copy()) if i > 0 else self._empty_state()
+        lines = (self.bucket == i) & (self.dates < self._day_ends([day])[0])
+        codes = self.codes[lines]
+        np.maximum.at(last_order, codes, self.dates[lines].view(np.int64))
+        frequency += np.bincount(codes, weights = self.has_order_id[lines], minlength = len(frequency)).astype(np.int64)
+        np.add.at(monetary, codes, self.units[lines])
+        return rfm_scores(self._base((last_order, frequency, monetary))).reset_index()
+
+    def segment_codes(self):
+        '''(cutoffs x groups) int8 array of positions in SEGMENTS, -1 where a group has no order yet.'''
+        if self._segment_codes is not None:
+            return self._segment_codes
+        result = np.full(self.last_order.shape, -1, dtype = np.int8)
+        day = np.timedelta64(1, 'D') // np.timedelta64(1, np.datetime_data(self.dates.dtype)[0])
+        for i in range(len(self.cutoffs)):
+            seen = self.last_order[i] > np.iinfo(np.int64).min
+            if not seen.any():
+                continue
+            #recency in whole days from the last order date up to the cutoff, as rfm_scores computes it
+            recency = (self.anchors[i] - self.last_order[i][seen]) // day
+            scores = score_arrays(recency, self.frequency[i][seen], self.monetary[i][seen] / MONETARY_SCALE)
+            result[i][seen] = segment_codes(*scores)
+        self._segment_codes = result
+        return result
+
+    def segments(self):
+        '''Segment per group (rows) as of every cutoff (columns); missing before the first order of a group.'''
+        return pd.DataFrame({cutoff : pd.Categorical.from_codes(codes, SEGMENTS)
+                             for cutoff, codes in zip(self.cutoffs, self.segment_codes())}, index = self.groups)
+
+    def migrations(self, unseen = True):
+        '''
+        Segment-migration matrices between consecutive cutoffs: number of groups per (cutoff, segment at the
+        previous cutoff) row and segment column. With unseen, products without an order yet are counted in
+        an UNSEEN row and column, so every matrix covers every group.
+        '''
+        codes = self.segment_codes().astype(np.int64) + 1
+        labels = [UNSEEN] + SEGMENTS
+        n = len(labels)
+
+        #one bincount over (pair, from, to) for all consecutive pairs at once
+        flat = (np.arange(len(codes) - 1)[:, None] * n + codes[:-1]) * n + codes[1:]
+        counts = np.bincount(flat.ravel(), minlength = max(len(codes) - 1, 0) * n * n).reshape(-1, n)
+
+        index = pd.MultiIndex.from_product([self.cutoffs[1:], labels], names = ['cutoff', 'from_segment'])
+        table = pd.DataFrame(counts, index = index, columns = pd.Index(labels, name = 'to_segment'))
+        if not unseen:
+            table = table.drop(index = UNSEEN, level = 'from_segment').drop(columns = UNSEEN)
+        return table
+
+    def migration(self, start, end, unseen = True):
+        '''Segment-migration matrix between any two cutoffs (given as dates).'''
+        i, j = self.cutoffs.get_loc(pd.Timestamp(start)), self.cutoffs.get_loc(pd.Timestamp(end))
+        codes = self.segment_codes()[[i, j]].astype(np.int64) + 1
+        labels = [UNSEEN] + SEGMENTS
+        n = len(labels)
+        counts = np.bincount(codes[0] * n + codes[1], minlength = n * n).reshape(n, n)
+
+        table = pd.DataFrame(counts, index = pd.Index(labels, name = 'from_segment'),
+                             columns = pd.Index(labels, name = 'to_segment'))
+        if not unseen:
+            table = table.drop(index = UNSEEN, columns = UNSEEN)
+        return table
@@ -0,0 +1,183 @@
+'''
+Approximate-quantile RFM scoring with mergeable quantile sketches.
+
+rfm_scores needs the PERCENTILEX.INC cut points of recency, frequency and monetary over every product,
+i.e. the whole product table in memory and a sort of it. Here each partition of the products summarizes
+its rfm_base into a KLL-style quantile sketch per metric (a few thousand numbers whatever the partition
+size); the sketches are merged and the merged cut points are handed to rfm_scores, which scores every
+partition on its own with a binary search, without a global sort.
+
+Recency is sketched as the last order date (in days) and turned into recency cut points at the end,
+because the recency anchor MAX(orders[order_date]) is only known once every partition has been seen.
+
+The partitions must not share products (e.g. orders split by a hash of product_id, or the rfm_base of
+IncrementalState read in slices): a sketch summarizes per-product values, not order lines.
+
+    sketch = RFMSketch(k = 400)
+    for base in partition_bases:
+        sketch.update(base)
+    cuts = sketch.cuts()
+    scores = [rfm_scores(base, sketch.last_orderdate, cuts) for base in partition_bases]
+    drift = cut_drift(pd.concat(partition_bases), cuts)
+'''
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.rfm import QUANTILES, percentile_inc, rfm_scores
+
+
+#size of the sketch levels; the rank error shrinks roughly as 1/K
+K = 200
+
+METRICS = ['recency', 'frequency', 'monetary']
+
+
+class QuantileSketch:
+    '''
+    KLL-style quantile sketch: a stack of sorted compactors, level h holding items of weight 2**h.
+    A full level is sorted and every other item (random offset) is promoted to the next level.
+    rank_error is a worst-case bound of the normalized rank error of any quantile, tracked as the
+    compactions happen; in practice the error is several times smaller.
+    '''
+
+    def __init__(self, k = K, seed = 0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.n = 0
+        self.error = 0.0
+        self.rng = np.random.default_rng(seed)
+
+    def _capacity(self, level):
+        #lower levels get geometrically smaller buffers (factor 2/3), but never fewer than 2 items
+        return max(2, int(np.ceil(self.k * (2 / 3) ** (len(self.levels) - 1 - level))))
+
+    def update(self, values):
+        values = np.asarray(values, dtype = float)
+        values = values[~np.isnan(values)]
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self.n += len(values)
+        self._compress()
+        return self
+
+    def merge(self, other):
+        for h, items in enumerate(other.levels):
+            if h == len(self.levels):
+                self.levels.append(np.empty(0))
+            self.levels[h] = np.concatenate([self.levels[h], items])
+        self.n += other.n
+        self.error += other.error
+        self._compress()
+        return self
+
+    def _compress(self):
+        h = 0
+        while h < len(self.levels):
+            items = self.levels[h]
+            if len(items) > self._capacity(h):
+                if h + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                #an odd item out stays at this level
+                keep, items = (items[:1], items[1:]) if len(items) % 2 else (items[:0], items)
+                self.levels[h + 1] = np.concatenate([self.levels[h + 1], items[self.rng.integers(2)::2]])
+                self.levels[h] = keep
+                self.error += 2 ** h
+                h = 0
+            else:
+                h += 1
+
+    @property
+    def rank_error(self):
+        return self.error / self.n if self.n else 0.0
+
+    def quantile(self, quantiles):
+        '''PERCENTILEX.INC-style quantiles (linear interpolation between ranks) of the summarized values.'''
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(i), 2 ** h) for h, i in enumerate(self.levels)])
+        order = np.argsort(items, kind = 'stable')
+        items, ends = items[order], np.cumsum(weights[order])
+
+        #every item stands for `weight` consecutive ranks; exact when nothing has been compacted
+        rank = np.asarray(quantiles, dtype = float) * (ends[-1] - 1)
+        lower = items[np.searchsorted(ends, np.floor(rank), side = 'right')]
+        upper = items[np.searchsorted(ends, np.ceil(rank), side = 'right')]
+        return lower + (upper - lower) * (rank - np.floor(rank))
+
+
+class RFMSketch:
+    '''Quantile sketches of the last order date, frequency and monetary of the products seen so far.'''
+
+    def __init__(self, k = K, seed = 0):
+        self.sketches = {i : QuantileSketch(k, seed + j) for j, i in enumerate(['last_order_day', 'frequency', 'monetary'])}
+        self.last_orderdate = None
+        self.products = 0
+
+    def update(self, base):
+        '''Add an rfm_base table (see rfm.rfm_base) whose products are not in any other partition.'''
+        dates = base['last_order_date']
+        self.sketches['last_order_day'].update(_days(dates))
+        self.sketches['frequency'].update(base['frequency'].to_numpy())
+        self.sketches['monetary'].update(base['monetary'].to_numpy())
+
+        last_orderdate = dates.max()
+        if self.last_orderdate is None or last_orderdate > self.last_orderdate:
+            self.last_orderdate = last_orderdate
+        self.products += len(base)
+        return self
+
+    def merge(self, other):
+        for i, sketch in self.sketches.items():
+            sketch.merge(other.sketches[i])
+        if self.last_orderdate is None or (other.last_orderdate is not None and other.last_orderdate > self.last_orderdate):
+            self.last_orderdate = other.last_orderdate
+        self.products += other.products
+        return self
+
+    def cuts(self, last_orderdate = None, quantiles = QUANTILES):
+        '''Cut points in the format of rfm_scores(cuts = ...), recency anchored at last_orderdate.'''
+        if last_orderdate is None:
+            last_orderdate = self.last_orderdate
+        anchor = _days(pd.Series([pd.Timestamp(last_orderdate)]))[0]
+
+        #linear interpolation is symmetric: the q-quantile of (anchor - date) is anchor minus the (1 - q)-quantile of date
+        dates = self.sketches['last_order_day'].quantile(1 - np.asarray(quantiles))
+        return {'recency' : np.abs(anchor - dates),
+                'frequency' : self.sketches['frequency'].quantile(quantiles),
+                'monetary' : self.sketches['monetary'].quantile(quantiles)}
+
+    def rank_error(self):
+        return {'recency' : self.sketches['last_order_day'].rank_error,
+                'frequency' : self.sketches['frequency'].rank_error,
+                'monetary' : self.sketches['monetary'].rank_error}
+
+
+def _days(dates):
+    #NaT (a product whose lines have no valid order_date) would become the smallest int64: it is NaN
+    #instead, which the sketches skip
+    days = dates.to_numpy(dtype = 'datetime64[ns]').astype('datetime64[D]')
+    return np.where(np.isnat(days), np.nan, days.astype(np.int64).astype(float))
+
+
+def cut_drift(base, cuts, last_orderdate = None, quantiles = QUANTILES):
+    '''
+    How far approximate cut points are from the exact PERCENTILEX.INC computation on the full rfm_base:
+    one row per (metric, quantile) with the exact and approximate cut, their difference, the rank error
+    (share of products between the two cuts) and the share of products whose score of that metric changes.
+    '''
+    exact = rfm_scores(base, last_orderdate)
+    approx = rfm_scores(base, last_orderdate, cuts)
+
+    rows = []
+    for metric in METRICS:
+        values = np.sort(exact[metric].to_numpy(dtype = float))
+        exact_cuts = percentile_inc(values, quantiles)
+        score = f'{metric.capitalize()}Score'
+        rescored = float((exact[score] != approx[score]).mean())
+        for q, i, j in zip(quantiles, exact_cuts, cuts[metric]):
+            between = abs(np.searchsorted(values, i, side = 'right') - np.searchsorted(values, j, side = 'right'))
+            rows.append({'metric' : metric, 'quantile' : q, 'exact' : i, 'approx' : float(j),
+                         'difference' : float(j) - i, 'rank_error' : between / len(values),
+                         'rescored' : rescored})
+
+    return pd.DataFrame(rows).set_index(['metric', 'quantile'])
@@ -0,0 +1,61 @@
+'''
+Parallel execution of independent report slices.
+
+Each report slice is a spec (filter, index_cols, aggfunc_pick), e.g. the Description 3-2 drill-down
+
+    specs = [('category == "Furniture"', ['sub_category'], aggfunc_pick),
+             ('category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")',
+              ['region', 'ship_mode'], aggfunc_pick)]
+
+The slices do not depend on each other, so they are spread over a process pool. The table (orders frame
+or OrderCube) is handed to every worker once, not once per slice: forked workers inherit it read-only,
+other start methods receive it through the pool initializer.
+'''
+
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+from order_analysis.report import ReportContext
+
+
+#report context of the current worker process
+_shared = {}
+
+
+def _init_worker(context):
+    _shared['context'] = context
+
+
+def _run_spec(spec, context = None):
+    query, index_cols, aggfunc_pick = spec
+    context = context or _shared['context']
+    return (context.query(query) if query else context).sales_report(index_cols, aggfunc_pick)
+
+
+def run_reports(table, specs, cols = 'year', time_1 = None, time_2 = None, workers = None):
+    '''
+    Run sales_report for every (filter, index_cols, aggfunc_pick) spec and return the reports in spec order.
+    table can also be a ReportContext; the compared periods default to those of the whole table,
+    as in the Part 1 script. workers defaults to the number of cores; workers = 1 runs the slices in this process.
+    '''
+    specs = list(specs)
+    context = table if isinstance(table, ReportContext) else ReportContext(table, cols, time_1, time_2)
+
+    workers = min(workers or os.cpu_count() or 1, len(specs))
+    if workers <= 1:
+        return [_run_spec(i, context) for i in specs]
+
+    if 'fork' in multiprocessing.get_all_start_methods():
+        #workers inherit the context from this process instead of unpickling a copy each
+        _init_worker(context)
+        pool = ProcessPoolExecutor(workers, mp_context = multiprocessing.get_context('fork'))
+    else:
+        pool = ProcessPoolExecutor(workers, initializer = _init_worker, initargs = (context,))
+
+    try:
+        with pool:
+            return list(pool.map(_run_spec, specs, chunksize = max(1, len(specs) // (workers * 4))))
+    finally:
+        _shared.clear()
+
@@ -0,0 +1,47 @@
+'''
+Compact dtype schema for the orders table.
+
+After Description 1-3 every text column is an object string and order_id/postal_code are cast to str.
+The schema stores low-cardinality text as categoricals, ids as the smallest integer type that holds them
+and the small counters (quantity, year, month, day) as small ints, which cuts memory several times over
+and lets groupby/pivot_table work on integer codes.
+'''
+
+import numpy as np
+import pandas as pd
+
+
+CATEGORICAL_COLUMNS = ['ship_mode', 'segment', 'country', 'city', 'state', 'region',
+                       'category', 'sub_category', 'product_id']
+ID_COLUMNS = ['order_id', 'postal_code']
+SMALL_INT_COLUMNS = {'quantity' : np.int16,
+                     'year' : np.int16,
+                     'month' : np.int8,
+                     'day' : np.int8}
+
+
+def integer_codes(column):
+    '''
+    Ids as compact integers: the numeric value downcast to the smallest integer type when every id is a
+    number (order_id, postal_code in the Kaggle data), otherwise categorical codes.
+    '''
+    numbers = pd.to_numeric(column, errors = 'coerce')
+    if numbers.notna().all() and (numbers % 1 == 0).all():
+        return pd.to_numeric(numbers.astype(np.int64), downcast = 'integer')
+    return column.astype('category')
+
+
+def apply_schema(orders):
+    '''Convert the orders table to the compact schema; columns that are missing are skipped.'''
+    columns = {}
+    for i in CATEGORICAL_COLUMNS:
+        if i in orders.columns:
+            columns[i] = orders[i].astype('category')
+    for i in ID_COLUMNS:
+        if i in orders.columns:
+            columns[i] = integer_codes(orders[i])
+    for i, dtype in SMALL_INT_COLUMNS.items():
+        if i in orders.columns and orders[i].notna().all():
+            columns[i] = orders[i].astype(dtype)
+
+    return orders.assign(**columns)
@@ -0,0 +1,149 @@
+'''
+Synthetic order lines in the layout of the Kaggle orders file, for benchmarks at any size.
+
+The generator learns its catalog from a template orders file (by default the orders.csv shipped with
+this project): the city/state/postal_code/region combinations and the ship_mode, segment and quantity
+mix with their observed frequencies, and the category/sub_category/price of the products. Larger tables
+get more products (the count grows sublinearly with the number of lines) and product popularity follows
+a Zipf law, so a few products carry many lines and most products only a few, as in a real shop.
+
+    write_synthetic_orders('.cache/benchmark/orders-1000000.csv', 1_000_000)
+'''
+
+import os
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.preprocessing import SHIP_MODE_OUTLIERS, standardize_columns
+
+
+TEMPLATE_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'orders.csv')
+
+#column names of the raw Kaggle file, which is what Description 1-3 expects
+RAW_COLUMNS = ['Order Id', 'Order Date', 'Ship Mode', 'Segment', 'Country', 'City', 'State', 'Postal Code',
+               'Region', 'Category', 'Sub Category', 'Product Id', 'Cost Price', 'List Price', 'Quantity',
+               'Discount Percent']
+
+#raw Discount Percent values of the Kaggle file (before the Description 1-4 adjustment)
+DISCOUNT_PERCENT = [2, 3, 4, 5]
+
+#Zipf exponent of product popularity and share of lines with a missing or outlier ship_mode
+SKEW = 0.7
+DIRTY = 0.001
+
+CHUNKSIZE = 1_000_000
+
+
+def products_for(n_rows, template_products):
+    '''Number of distinct products for a table of n_rows lines: never fewer than the template has.'''
+    return max(template_products, int(n_rows ** 0.8))
+
+
+def _frequencies(column):
+    counts = column.value_counts()
+    return counts.index.to_numpy(), (counts / counts.sum()).to_numpy()
+
+
+def order_catalog(template = None, n_products = None, n_rows = None, skew = SKEW, seed = 0):
+    '''
+    Everything the generator samples from, learned from the template orders (a frame in the raw or the
+    enriched layout, or a path; the project orders.csv by default).
+    n_products defaults to products_for(n_rows); products beyond those of the template copy the category,
+    sub_category and prices of a template line and get new ids with the same prefix.
+    '''
+    if template is None or isinstance(template, str):
+        template = pd.read_csv(template or TEMPLATE_PATH, encoding = 'utf-8-sig')
+    template = template.copy()
+    template.columns = standardize_columns(template.columns)
+    template = template[~template['ship_mode'].isin(SHIP_MODE_OUTLIERS) & template['ship_mode'].notna()]
+
+    rng = np.random.default_rng(seed)
+    products = template.drop_duplicates('product_id')
+    if n_products is None:
+        n_products = products_for(n_rows or len(template), len(products))
+
+    #the template products first, then new products modelled on randomly picked template lines
+    extra = template.iloc[rng.integers(0, len(template), max(0, n_products - len(products)))]
+    extra = extra.assign(product_id = [f'{i[:7]}{20000000 + k:08d}' for k, i in enumerate(extra['product_id'])])
+    products = pd.concat([products, extra]).iloc[:n_products]
+
+    #Zipf popularity over a random ranking of the products
+    rank = rng.permutation(n_products) + 1
+    popularity = 1 / rank ** skew
+
+    catalog = {'products' : products[['product_id', 'category', 'sub_category', 'cost_price', 'list_price']]
+                            .reset_index(drop = True),
+               'product_weights' : popularity / popularity.sum(),
+               'locations' : template[['country', 'city', 'state', 'postal_code', 'region']].reset_index(drop = True),
+               'date_range' : (pd.Timestamp(template['order_date'].min()), pd.Timestamp(template['order_date'].max()))}
+    for i in ['ship_mode', 'segment', 'quantity']:
+        catalog[i] = _frequencies(template[i])
+
+    return catalog
+
+
+def generate_orders(n_rows, catalog = None, seed = 0, first_order_id = 1):
+    '''n_rows synthetic order lines in the raw Kaggle layout (RAW_COLUMNS), one order per line as in the source.'''
+    if catalog is None:
+        catalog = order_catalog(n_rows = n_rows, seed = seed)
+    rng = np.random.default_rng([seed, first_order_id])
+
+    products, locations = catalog['products'], catalog['locations']
+    product = rng.choice(len(products), n_rows, p = catalog['product_weights'])
+    location = rng.integers(0, len(locations), n_rows)
+
+    start, end = catalog['date_range']
+    days = rng.integers(0, (end - start).days + 1, n_rows)
+    order_date = np.datetime_as_string(np.datetime64(start.date(), 'D') + days, unit = 'D')
+
+    columns = {'Order Id' : np.arange(first_order_id, first_order_id + n_rows, dtype = np.int64),
+               'Order Date' : order_date}
+    for name, i in [('Ship Mode', 'ship_mode'), ('Segment', 'segment')]:
+        values, p = catalog[i]
+        columns[name] = pd.Categorical.from_codes(rng.choice(len(values), n_rows, p = p), categories = values)
+
+    for name, i in [('Country', 'country'), ('City', 'city'), ('State', 'state'),
+                    ('Postal Code', 'postal_code'), ('Region', 'region')]:
+        columns[name] = locations[i].to_numpy()[location]
+    for name, i in [('Category', 'category'), ('Sub Category', 'sub_category'), ('Product Id', 'product_id'),
+                    ('Cost Price', 'cost_price'), ('List Price', 'list_price')]:
+        columns[name] = products[i].to_numpy()[product]
+
+    values, p = catalog['quantity']
+    columns['Quantity'] = values[rng.choice(len(values), n_rows, p = p)]
+    columns['Discount Percent'] = rng.choice(DISCOUNT_PERCENT, n_rows)
+
+    orders = pd.DataFrame(columns, columns = RAW_COLUMNS)
+
+    #a few missing and outlier ship_mode values, so Description 1-3 has something to clean
+    dirty = np.flatnonzero(rng.random(n_rows) < DIRTY)
+    if len(dirty):
+        ship_mode = orders['Ship Mode'].astype(object)
+        #an object array, or choice would turn the missing value into the string 'nan'
+        ship_mode.iloc[dirty] = rng.choice(np.array(SHIP_MODE_OUTLIERS + [np.nan], dtype = object), len(dirty))
+        orders['Ship Mode'] = ship_mode
+
+    return orders
+
+
+def iter_synthetic_orders(n_rows, chunksize = CHUNKSIZE, catalog = None, seed = 0):
+    '''Yield n_rows synthetic lines in chunks, so tables larger than memory can be written to disk.'''
+    if catalog is None:
+        catalog = order_catalog(n_rows = n_rows, seed = seed)
+    for first in range(0, n_rows, chunksize):
+        yield generate_orders(min(chunksize, n_rows - first), catalog, seed, first + 1)
+
+
+def write_synthetic_orders(path, n_rows, chunksize = CHUNKSIZE, catalog = None, seed = 0):
+    '''Write n_rows synthetic lines as a csv file in the raw Kaggle layout and return the path.'''
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+    tmp = f'{path}.{os.getpid()}.tmp'
+    try:
+        for k, chunk in enumerate(iter_synthetic_orders(n_rows, chunksize, catalog, seed)):
+            chunk.to_csv(tmp, mode = 'w' if k == 0 else 'a', header = k == 0, index = False)
+        os.replace(tmp, path)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+    return path
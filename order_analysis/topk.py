@@ -0,0 +1,127 @@
+'''
+Top-K selection for dimensions with many members (product_id, city, order_id ...).
+
+For a dimension with more than 12 members draw_and_report only charts the 10 groups with the largest
+revenue decline. top_k finds those with a partial selection (np.argpartition, O(n)) instead of sorting
+every member, and top_movers in report.py uses it on a revenue-only aggregation so the eight-metric
+report is built for those 10 groups only.
+
+For order files too large to aggregate per member in memory, stream_top_movers finds the movers with a
+heavy-hitters sketch: a weighted Misra-Gries summary keeps at most `capacity` candidate groups while the
+file is streamed, and a second pass computes their exact revenues. Any group whose revenue in the two
+compared periods exceeds (total revenue of the two periods) / (capacity + 1) is guaranteed to be a
+candidate, and a revenue change can never exceed that revenue, so every mover above that bound is found
+with its exact change.
+'''
+
+import numpy as np
+import pandas as pd
+
+from order_analysis.ingest import CHUNKSIZE, iter_orders, read_ship_mode_fill
+
+
+CAPACITY = 10_000
+
+
+def top_k(values, k, largest = True):
+    '''
+    Positions of the k largest (or smallest) values in order, as sort + head(k) would give them:
+    NaN comes after every number and ties keep their original order. k <= 0 gives no positions.
+    '''
+    if k <= 0:
+        return np.empty(0, dtype = np.intp)
+    key = np.asarray(values, dtype = float)
+    k = min(k, len(key))
+    key = -key if largest else key.copy()
+    key[np.isnan(key)] = np.inf
+
+    if k < len(key):
+        #kth smallest key, then everything below it plus the first ties at it
+        kth = np.partition(key, k - 1)[k - 1]
+        below = np.flatnonzero(key < kth)
+        tied = np.flatnonzero(key == kth)[:k - len(below)]
+        positions = np.concatenate([below, tied])
+    else:
+        positions = np.arange(len(key))
+
+    return positions[np.lexsort((positions, key[positions]))]
+
+
+class HeavyHitters:
+    '''
+    Weighted Misra-Gries summary: at most capacity keys with a lower-bound weight each.
+    The weight of any key is underestimated by at most (total weight) / (capacity + 1).
+    Summaries of separate chunks or partitions can be merged.
+    '''
+
+    def __init__(self, capacity = CAPACITY):
+        self.capacity = capacity
+        self.counts = pd.Series(dtype = float)
+        self.total = 0.0
+
+    def update(self, weights):
+        '''Add a Series of non-negative weights indexed by key (repeated keys are summed).'''
+        weights = weights[weights > 0]
+        self.total += float(weights.sum())
+        self.counts = self._prune(self._add(self.counts, weights))
+        return self
+
+    def merge(self, other):
+        self.total += other.total
+        self.counts = self._prune(self._add(self.counts, other.counts))
+        return self
+
+    @staticmethod
+    def _add(counts, weights):
+        counts = weights if counts.empty else pd.concat([counts, weights])
+        return counts.groupby(level = list(range(counts.index.nlevels)), observed = True).sum()
+
+    def _prune(self, counts):
+        #subtract the (capacity + 1)-th largest weight from every key and drop those left without weight
+        if len(counts) <= self.capacity:
+            return counts
+        cut = np.partition(counts.to_numpy(), len(counts) - self.capacity - 1)[len(counts) - self.capacity - 1]
+        counts = counts - cut
+        return counts[counts > 0]
+
+    @property
+    def error(self):
+        '''Upper bound of the underestimate of any key.'''
+        return self.total / (self.capacity + 1)
+
+    def keys(self):
+        return self.counts.index
+
+
+def stream_top_movers(path, index_cols, cols, time_1, time_2, k = 10, largest = False, capacity = CAPACITY,
+                      chunksize = CHUNKSIZE):
+    '''
+    revenue of time_2 and time_1 and revenue_diff of the k groups with the largest decline (largest = False)
+    or growth of a raw orders file, without aggregating every group: after the ship_mode pass, two streamed
+    passes, a heavy-hitters sketch over the revenue of the compared periods and then exact revenues of the
+    sketch candidates.
+    '''
+    index_cols = list(index_cols)
+    #the ship_mode pass is read once for both passes
+    ship_mode_fill = read_ship_mode_fill(path, chunksize)
+    sketch = HeavyHitters(capacity)
+    for chunk in iter_orders(path, chunksize, ship_mode_fill = ship_mode_fill):
+        chunk = chunk[chunk[cols].isin([time_1, time_2])]
+        sketch.update(chunk.groupby(index_cols, observed = True)['revenue'].sum())
+
+    candidates = sketch.keys()
+    revenue = []
+    for chunk in iter_orders(path, chunksize, ship_mode_fill = ship_mode_fill):
+        chunk = chunk[chunk[cols].isin([time_1, time_2])]
+        keys = chunk[index_cols[0]] if len(index_cols) == 1 else pd.MultiIndex.from_frame(chunk[index_cols])
+        chunk = chunk[np.asarray(keys.isin(candidates))]
+        revenue.append(chunk.groupby(index_cols + [cols], observed = True)['revenue'].sum())
+
+    revenue = pd.concat(revenue).groupby(level = list(range(len(index_cols) + 1))).sum().unstack(cols)
+    table = pd.DataFrame({f'revenue_{time_2}' : revenue.get(time_2),
+                          f'revenue_{time_1}' : revenue.get(time_1)}, index = revenue.index)
+    table['revenue_diff'] = table[f'revenue_{time_1}'] - table[f'revenue_{time_2}']
+
+    table = table.iloc[top_k(table['revenue_diff'], k, largest)].reset_index()
+    table.attrs['error'] = sketch.error
+    return table
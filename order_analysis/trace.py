@@ -0,0 +1,226 @@
+'''
+Stage timing for the Part 1 pipeline.
+
+Every step of the preprocessing and of each report (CSV parse, date coercion, derived columns, the report
+pivot, the KPI queries, plotting ...) is wrapped in a named stage. While tracing is enabled, a stage records
+its wall time, the rows going in and out and, optionally, the traced memory allocated during it; when it is
+disabled (the default) a stage is a shared no-op context and costs one function call.
+
+    from order_analysis import trace
+
+    with trace.tracing('trace.json', memory = True):
+        orders = load_orders()
+        draw_and_report(orders, ['region'], 'year', aggfunc_pick)
+
+A path ending in .jsonl gets one JSON record per stage (a structured log), any other path gets a Chrome
+trace that can be opened in chrome://tracing or https://ui.perfetto.dev. Memory figures come from
+tracemalloc, which is process-wide and slows allocation-heavy code, so it is only switched on on request.
+Stages nest per thread (a stage's parent is the stage open on the same thread), while a memory peak is the
+peak of the whole process during the stage, as tracemalloc cannot tell threads apart.
+'''
+
+import json
+import numbers
+import os
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+_tracer = None
+
+
+class _NullStage:
+    '''Stage used while tracing is disabled: entering, leaving and setting rows_out do nothing.'''
+
+    rows_out = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+
+_NULL_STAGE = _NullStage()
+
+
+class Stage:
+
+    def __init__(self, tracer, name, rows, args):
+        self.tracer = tracer
+        self.name = name
+        self.rows_in = rows
+        self.rows_out = None
+        self.args = args
+        self.peak = 0
+
+    def __enter__(self):
+        self.tracer._open(self)
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        end = time.perf_counter()
+        self.tracer._close(self, end)
+        return False
+
+
+class Tracer:
+    '''Collects one record per finished stage.'''
+
+    def __init__(self, memory = False):
+        self.memory = memory
+        self.records = []
+        self.origin = time.perf_counter()
+        self.epoch = time.time()
+        #open stages per thread, so stages of report threads never nest into each other
+        self._stacks = {}
+        self._lock = threading.Lock()
+        self._started_tracemalloc = False
+        if memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+
+    def stage(self, name, rows = None, **args):
+        #a table given as rows is only counted here, while tracing
+        if rows is not None and not isinstance(rows, numbers.Integral):
+            rows = len(rows)
+        return Stage(self, name, rows, args)
+
+    def _fold_peak(self):
+        #the tracemalloc peak is global: hand it to every open stage before resetting it for the next one
+        peak = tracemalloc.get_traced_memory()[1]
+        for stack in self._stacks.values():
+            for i in stack:
+                i.peak = max(i.peak, peak)
+        tracemalloc.reset_peak()
+
+    def _open(self, stage):
+        stage.thread = threading.get_ident()
+        with self._lock:
+            if self.memory:
+                self._fold_peak()
+                stage.allocated = tracemalloc.get_traced_memory()[0]
+            stack = self._stacks.setdefault(stage.thread, [])
+            stage.parent = stack[-1].name if stack else None
+            stack.append(stage)
+
+    def _close(self, stage, end):
+        rows_out = stage.rows_out
+        if rows_out is not None and not isinstance(rows_out, numbers.Integral):
+            rows_out = len(rows_out)
+        record = {'name' : stage.name,
+                  'start' : stage.start - self.origin,
+                  'seconds' : end - stage.start,
+                  'rows_in' : stage.rows_in,
+                  'rows_out' : rows_out,
+                  'pid' : os.getpid(),
+                  'thread' : stage.thread,
+                  'parent' : stage.parent}
+        with self._lock:
+            if self.memory:
+                self._fold_peak()
+                current = tracemalloc.get_traced_memory()[0]
+            stack = self._stacks.get(stage.thread, [])
+            if stage in stack:
+                stack.remove(stage)
+            if not stack:
+                self._stacks.pop(stage.thread, None)
+        if self.memory:
+            record['alloc_delta_mb'] = (current - stage.allocated) / 1024 ** 2
+            record['alloc_peak_mb'] = (stage.peak - stage.allocated) / 1024 ** 2
+        if stage.args:
+            record['args'] = stage.args
+        self.records.append(record)
+
+    def stop(self):
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+
+    def summary(self):
+        '''Total seconds, calls and largest peak allocation per stage name, slowest first.'''
+        import pandas as pd
+
+        table = pd.DataFrame(self.records)
+        if table.empty:
+            return table
+        aggfunc = {'seconds' : ['sum', 'count']}
+        if 'alloc_peak_mb' in table.columns:
+            aggfunc['alloc_peak_mb'] = ['max']
+        table = table.groupby('name').agg(aggfunc)
+        table.columns = [f'{i}_{j}' for i, j in table.columns]
+        return table.rename(columns = {'seconds_count' : 'calls'}).sort_values('seconds_sum', ascending = False)
+
+    def write_log(self, path):
+        '''One JSON object per stage and line, in the order the stages finished.'''
+        with open(path, 'w', encoding = 'utf-8') as f:
+            for i in self.records:
+                f.write(json.dumps({**i, 'start' : self.epoch + i['start']}, default = str) + '\n')
+
+    def write_chrome_trace(self, path):
+        '''Chrome trace event format: one complete ("X") event per stage, nested by time on each thread.'''
+        events = []
+        for i in self.records:
+            args = {k : i[k] for k in ['rows_in', 'rows_out', 'alloc_delta_mb', 'alloc_peak_mb'] if i.get(k) is not None}
+            args.update(i.get('args', {}))
+            events.append({'name' : i['name'], 'ph' : 'X', 'ts' : i['start'] * 1e6, 'dur' : i['seconds'] * 1e6,
+                           'pid' : i['pid'], 'tid' : i['thread'], 'args' : args})
+        with open(path, 'w', encoding = 'utf-8') as f:
+            json.dump({'traceEvents' : events, 'displayTimeUnit' : 'ms'}, f, default = str)
+
+    def write(self, path):
+        if path.endswith('.jsonl'):
+            self.write_log(path)
+        else:
+            self.write_chrome_trace(path)
+
+
+def stage(name, rows = None, **args):
+    '''
+    Context manager timing one step; rows is the number of rows going in, or the table going in, which
+    is then only counted while tracing (len() of a lazy table runs a query). rows_out (a number or a
+    table) can be set on the returned stage. extra keyword arguments (e.g. index_cols) are kept with the record.
+    '''
+    if _tracer is None:
+        return _NULL_STAGE
+    return _tracer.stage(name, rows, **args)
+
+
+def enabled():
+    '''Whether stages are being collected, to skip work done only for a record.'''
+    return _tracer is not None
+
+
+def enable(memory = False):
+    '''Start collecting stages in a new tracer and return it.'''
+    global _tracer
+    disable()
+    _tracer = Tracer(memory)
+    return _tracer
+
+
+def disable():
+    '''Stop collecting; the last tracer (if any) is returned with its records.'''
+    global _tracer
+    tracer, _tracer = _tracer, None
+    if tracer is not None:
+        tracer.stop()
+    return tracer
+
+
+@contextmanager
+def tracing(path = None, memory = False):
+    '''Trace the enclosed code and write the records to path (.jsonl log or Chrome trace) at the end.'''
+    tracer = enable(memory)
+    try:
+        yield tracer
+    finally:
+        disable()
+        if path is not None:
+            tracer.write(path)
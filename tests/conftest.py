@@ -0,0 +1,37 @@
+import os
+
+import pandas as pd
+import pytest
+
+from order_analysis.preprocessing import preprocess_orders
+from order_analysis.synthetic import generate_orders
+
+
+ORDERS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'orders.csv')
+
+
+@pytest.fixture(scope = 'session')
+def orders_path():
+    return ORDERS_PATH
+
+
+@pytest.fixture(scope = 'session')
+def raw_orders(orders_path):
+    return pd.read_csv(orders_path, encoding = 'utf-8-sig')
+
+
+@pytest.fixture(scope = 'session')
+def orders(raw_orders):
+    '''The cleaned and enriched orders.csv (do not modify).'''
+    return preprocess_orders(raw_orders)
+
+
+@pytest.fixture(scope = 'session')
+def synthetic_raw():
+    '''20,000 synthetic lines in the raw Kaggle layout, with more products than orders.csv.'''
+    return generate_orders(20_000, seed = 7)
+
+
+@pytest.fixture(scope = 'session')
+def synthetic(synthetic_raw):
+    return preprocess_orders(synthetic_raw)
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import order_analysis.report as report
+from order_analysis.batch import AGGFUNC_PICK, OVERVIEW_PICK, report_sections, run_batch
+from order_analysis.cube import OrderCube
+from order_analysis.report import chart_review, draw_and_report, sales_report
+
+
+@pytest.fixture(scope = 'module')
+def results(tmp_path_factory, orders):
+    return run_batch(orders, str(tmp_path_factory.mktemp('reports')))
+
+
+def test_overview_matches_script(results, orders):
+    #Description 3-1-1 of the Part 1 script
+    time_1, time_2 = orders['year'].max(), orders['year'].min()
+    sales_review = sales_report(orders, ['order_id'], 'year', OVERVIEW_PICK, time_1, time_2)
+    sta_1 = orders.query(f'year == {time_1}').select_dtypes('number').mean().T
+    sta_2 = orders.query(f'year == {time_2}').select_dtypes('number').mean().T
+    columns_name = [f'{i}_{j}' for i in ['revenue', 'profit', 'discount'] for j in [time_2, time_1]]
+    perfomance = sales_review.fillna(0).loc[:, columns_name].astype(int).sum()
+
+    overview = results['overall_sales_overview']
+    np.testing.assert_array_equal(overview.loc[['revenue', 'profit', 'discount']].to_numpy().ravel(), perfomance)
+    np.testing.assert_allclose(overview.loc['profit_rate'], [perfomance.iloc[2] / perfomance.iloc[0],
+                                                             perfomance.iloc[3] / perfomance.iloc[1]])
+    np.testing.assert_allclose(overview.loc['discount_rate'], [perfomance.iloc[4] / perfomance.iloc[0],
+                                                               perfomance.iloc[5] / perfomance.iloc[1]])
+    np.testing.assert_allclose(overview.loc['avg_sell_price'], [sta_2['sell_price'], sta_1['sell_price']])
+    np.testing.assert_allclose(overview.loc['avg_quantity'], [sta_2['quantity'], sta_1['quantity']])
+
+
+def test_sections_match_draw_and_report(results, orders, monkeypatch):
+    pytest.importorskip('matplotlib')
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    #draw_and_report prints data_types_transform of the charted report, keep that report instead
+    shown = []
+    monkeypatch.setattr(report, 'draw_double_bar', lambda *args: None)
+    monkeypatch.setattr(plt, 'show', lambda: None)
+    monkeypatch.setattr(report, 'data_types_transform', lambda table, *args: shown.append(table) or table)
+
+    cube = OrderCube.from_orders(orders)
+    time_1, time_2 = cube['year'].max(), cube['year'].min()
+    sections = report_sections()
+    for name, query, index_cols in sections:
+        table = cube.query(query) if query else cube
+        draw_and_report(table, index_cols, 'year', AGGFUNC_PICK, time_1, time_2)
+
+    assert len(shown) == len(sections)
+    for (name, query, index_cols), expected in zip(sections, shown):
+        table = cube.query(query) if query else cube
+        charted, _ = chart_review(results[name], table, index_cols, AGGFUNC_PICK, time_1, time_2)
+        assert list(charted.columns) == list(expected.columns), name
+        pd.testing.assert_frame_equal(charted.reset_index(drop = True).astype({i : str for i in index_cols}),
+                                      expected.reset_index(drop = True).astype({i : str for i in index_cols}),
+                                      check_exact = False, rtol = 1e-9, obj = name)
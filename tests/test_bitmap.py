@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+from order_analysis.bitmap import BitmapIndex
+
+
+QUERIES = ['category == "Furniture"',
+           'category == "Furniture" and (sub_category == "Tables" or sub_category == "Furnishings")',
+           'region in ["West", "South"] and year == 2023',
+           'ship_mode != "Standard Class" and month >= 11',
+           'state not in ["California", "New York"] or segment == "Corporate"',
+           'city in []',
+           'product_id == "no such product"',
+           #conditions on columns that are not indexed are applied with query()
+           'category == "Technology" and sell_price > 500',
+           'sell_price > 500 or region == "East"']
+
+
+@pytest.fixture(scope = 'module')
+def index(orders):
+    return BitmapIndex(orders)
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_query_matches_orders_query(index, orders, query):
+    pd.testing.assert_frame_equal(index.query(orders, query), orders.query(query))
+
+
+def test_rows_need_indexed_columns(index, orders):
+    assert index.rows('category == "Office Supplies"').tolist() == \
+        orders.index.get_indexer(orders.query('category == "Office Supplies"').index).tolist()
+    with pytest.raises(ValueError, match = 'query'):
+        index.rows('sell_price > 500')
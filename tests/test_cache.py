@@ -0,0 +1,33 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from order_analysis.benchmark import prepare
+from order_analysis.cache import read_orders, write_order_chunks, write_orders
+from order_analysis.ingest import iter_orders
+from order_analysis.preprocessing import preprocess_orders
+
+
+def test_write_orders_round_trip(tmp_path, orders):
+    path = str(tmp_path / 'orders.arrow')
+    write_orders(orders.reset_index(drop = True), path)
+    pd.testing.assert_frame_equal(read_orders(path), orders.reset_index(drop = True), check_exact = True)
+
+
+def test_chunks_match_full_frame(tmp_path, synthetic_raw):
+    raw_path = str(tmp_path / 'orders.csv')
+    synthetic_raw.to_csv(raw_path, index = False)
+    path = str(tmp_path / 'orders.arrow')
+
+    #every chunk has its own categories and order_id width, the file has those of the whole frame
+    assert write_order_chunks(iter_orders(raw_path, chunksize = 3000), path) == len(read_orders(path))
+    expected = preprocess_orders(pd.read_csv(raw_path, encoding = 'utf-8-sig')).reset_index(drop = True)
+    pd.testing.assert_frame_equal(read_orders(path), expected, check_exact = True)
+
+
+def test_prepare(tmp_path, capsys):
+    raw_path = prepare(5000, str(tmp_path), chunksize = 2000)
+    assert '3 chunks' in capsys.readouterr().out
+    expected = preprocess_orders(pd.read_csv(raw_path, encoding = 'utf-8-sig')).reset_index(drop = True)
+    pd.testing.assert_frame_equal(read_orders(raw_path.replace('.csv', '.arrow')), expected, check_exact = True)
@@ -0,0 +1,14 @@
+import pytest
+
+from order_analysis.cube import OrderCube
+from order_analysis.report import sales_report
+from test_report import CASES, assert_report_equal
+
+
+@pytest.mark.parametrize('query, index_cols, cols, time_1, time_2, aggfunc_pick', CASES)
+def test_cube_matches_orders(orders, query, index_cols, cols, time_1, time_2, aggfunc_pick):
+    cube = OrderCube.from_orders(orders)
+    table = cube if query is None else cube.query(query)
+    frame = orders if query is None else orders.query(query)
+    expected = sales_report(frame, index_cols, cols, aggfunc_pick, time_1, time_2)
+    assert_report_equal(sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2), expected)
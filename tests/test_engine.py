@@ -0,0 +1,73 @@
+import pytest
+
+from order_analysis import trace
+from order_analysis.batch import AGGFUNC_PICK
+from order_analysis.preprocessing import preprocess_orders
+from order_analysis.report import sales_report, top_movers
+from test_report import CASES, assert_report_equal
+
+duckdb = pytest.importorskip('duckdb')
+
+from order_analysis.cache import read_orders, write_orders  # noqa: E402
+from order_analysis.engine import LazyOrders, open_orders  # noqa: E402
+from order_analysis.partition import write_partitioned  # noqa: E402
+
+
+@pytest.fixture(scope = 'module')
+def sources(tmp_path_factory, raw_orders, orders):
+    root = tmp_path_factory.mktemp('engine')
+    cached, underived = str(root / 'orders.arrow'), str(root / 'underived.arrow')
+    write_orders(orders.reset_index(drop = True), cached)
+    #without the derived columns, which the engine then computes inside the aggregation
+    write_orders(preprocess_orders(raw_orders.drop(columns = ['sell_price', 'revenue', 'cost', 'profit', 'discount']),
+                                   derived = []).reset_index(drop = True), underived)
+    return {'cache' : cached, 'underived' : underived,
+            'partitioned' : write_partitioned(orders, str(root / 'dataset'))}
+
+
+def _queries(monkeypatch):
+    executed = []
+    execute = LazyOrders._execute
+
+    def record(self, sql):
+        executed.append(sql)
+        return execute(self, sql)
+
+    monkeypatch.setattr(LazyOrders, '_execute', record)
+    #the schema probe of LazyOrders.columns reads no data
+    return lambda : [i for i in executed if not i.endswith('LIMIT 0')]
+
+
+def test_report_runs_one_aggregate_query(orders, monkeypatch):
+    queries = _queries(monkeypatch)
+    table = LazyOrders(orders).query('category == "Furniture"')
+    sales_report(table, ['sub_category'], 'year', AGGFUNC_PICK, 2023, 2022)
+    assert len(queries()) == 1
+    assert 'GROUP BY' in queries()[0]
+
+
+def test_tracing_counts_lazy_tables(orders, monkeypatch):
+    queries = _queries(monkeypatch)
+    with trace.tracing() as tracer:
+        sales_report(LazyOrders(orders), ['region'], 'year', AGGFUNC_PICK, 2023, 2022)
+    pivot = [i for i in tracer.records if i['name'] == 'report.pivot'][0]
+    assert pivot['rows_in'] == len(orders)
+    assert sum('COUNT(*)' in i for i in queries()) == 1
+
+
+@pytest.mark.parametrize('source', ['cache', 'underived', 'partitioned'])
+@pytest.mark.parametrize('query, index_cols, cols, time_1, time_2, aggfunc_pick', CASES)
+def test_duckdb_matches_pandas(sources, source, query, index_cols, cols, time_1, time_2, aggfunc_pick):
+    frame, lazy = open_orders(sources[source]), open_orders(sources[source], engine = 'duckdb')
+    if query is not None:
+        frame, lazy = frame.query(query), lazy.query(query)
+    expected = sales_report(frame, index_cols, cols, aggfunc_pick, time_1, time_2)
+    #the partial sums of a partitioned dataset are merged in another order
+    assert_report_equal(sales_report(lazy, index_cols, cols, aggfunc_pick, time_1, time_2), expected,
+                        rtol = 1e-12 if source == 'partitioned' else 0)
+
+
+def test_top_movers_match_pandas(sources):
+    frame, lazy = read_orders(sources['cache']), LazyOrders(sources['cache'])
+    expected = top_movers(frame, ['city'], 'year', AGGFUNC_PICK, 2023, 2022, k = 10)
+    assert_report_equal(top_movers(lazy, ['city'], 'year', AGGFUNC_PICK, 2023, 2022, k = 10), expected, rtol = 0)
@@ -0,0 +1,48 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from order_analysis.explain import explain_delta
+
+
+DIMENSIONS = ['region', 'ship_mode', 'segment', 'category']
+
+
+def brute_force(orders, dimensions, metric, time_1, time_2, max_depth = None):
+    '''
+    Change of the metric of every slice of every dimension combination, a slice with the same lines as a
+    slice of fewer dimensions counted once.
+    '''
+    slices = {}
+    for depth in range(1, (max_depth or len(dimensions)) + 1):
+        for node in itertools.combinations(dimensions, depth):
+            for _, lines in orders.groupby(list(node), observed = True):
+                key = frozenset(lines.index)
+                if key not in slices:
+                    sums = lines.groupby('year')[metric].sum()
+                    slices[key] = sums.get(time_1, 0) - sums.get(time_2, 0)
+    return np.array(list(slices.values()))
+
+
+@pytest.mark.parametrize('largest', [False, True])
+@pytest.mark.parametrize('metric', ['revenue', 'profit'])
+def test_matches_brute_force(orders, metric, largest):
+    result = explain_delta(orders, 'year', 2023, 2022, metric, DIMENSIONS, k = 8, largest = largest)
+
+    changes = np.sort(brute_force(orders, DIMENSIONS, metric, 2023, 2022))
+    expected = changes[::-1][:8] if largest else changes[:8]
+    np.testing.assert_allclose(result[f'{metric}_diff'], expected, rtol = 1e-9)
+
+    #every reported slice is its query() string
+    for _, row in result.iterrows():
+        sums = orders.query(row['slice']).groupby('year')[metric].sum()
+        np.testing.assert_allclose([row[f'{metric}_2022'], row[f'{metric}_2023']],
+                                   [sums.get(2022, 0), sums.get(2023, 0)], rtol = 1e-9)
+
+
+def test_max_depth(orders):
+    result = explain_delta(orders, 'year', 2023, 2022, 'revenue', DIMENSIONS, k = 5, max_depth = 1)
+    assert (result[DIMENSIONS].notna().sum(axis = 1) == 1).all()
+    expected = np.sort(brute_force(orders, DIMENSIONS, 'revenue', 2023, 2022, max_depth = 1))[:5]
+    np.testing.assert_allclose(result['revenue_diff'], expected, rtol = 1e-9)
@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import order_analysis.groupreduce as groupreduce
+from order_analysis.groupreduce import group_pivot
+from order_analysis.report import PERIOD_AGGFUNC
+
+
+AGGFUNC = {i : [j] for i, j in PERIOD_AGGFUNC}
+INDEX_COLS = [['region'], ['category', 'sub_category'], ['state', 'ship_mode']]
+
+
+@pytest.fixture(scope = 'module')
+def lines(synthetic):
+    #missing metric values and missing keys, which a groupby skips
+    lines = synthetic.copy()
+    lines.loc[lines.index[::97], 'profit'] = np.nan
+    lines.loc[lines.index[::211], 'region'] = np.nan
+    return lines
+
+
+def _pivot_table(lines, index_cols, cols = 'year'):
+    return lines.pivot_table(index = index_cols, columns = cols, aggfunc = AGGFUNC, observed = True)
+
+
+@pytest.mark.parametrize('index_cols', INDEX_COLS)
+def test_numba_kernel_matches_pivot_table(lines, index_cols):
+    pytest.importorskip('numba')
+    expected = _pivot_table(lines, index_cols)
+    pd.testing.assert_frame_equal(group_pivot(lines, index_cols, 'year', AGGFUNC), expected, check_exact = True,
+                                  check_dtype = False)
+    #chunks reduced in parallel can move a sum in the last bit
+    pd.testing.assert_frame_equal(group_pivot(lines, index_cols, 'year', AGGFUNC, chunks = 4), expected,
+                                  check_dtype = False, rtol = 1e-12)
+
+
+@pytest.mark.parametrize('index_cols', INDEX_COLS)
+def test_numpy_kernel_matches_pivot_table(lines, index_cols, monkeypatch):
+    monkeypatch.setattr(groupreduce, '_kernel', lambda: None)
+    expected = _pivot_table(lines, index_cols, ['year', 'month'])
+    pd.testing.assert_frame_equal(group_pivot(lines, index_cols, ['year', 'month'], AGGFUNC, exact = False), expected,
+                                  check_dtype = False, rtol = 1e-12)
+    with pytest.raises(ImportError, match = 'numba'):
+        group_pivot(lines, index_cols, 'year', AGGFUNC)
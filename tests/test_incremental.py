@@ -0,0 +1,83 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from order_analysis.incremental import IncrementalState
+from order_analysis.ingest import read_ship_mode_counts, ship_mode_counts
+from order_analysis.preprocessing import preprocess_orders
+from order_analysis.rfm import rfm_table
+from order_analysis.rfm_history import RFMHistory
+
+
+def _chunks(orders, sizes):
+    orders = orders.sort_values('order_id', kind = 'stable')
+    bounds = np.cumsum([0] + list(sizes))
+    return [orders.iloc[i:j] for i, j in zip(bounds[:-1], bounds[1:])] + [orders.iloc[bounds[-1]:]]
+
+
+@pytest.mark.parametrize('sizes', [[1], [997, 3, 5000], [2500] * 7])
+def test_chunked_rfm_matches_full(synthetic, sizes):
+    state = IncrementalState()
+    for chunk in _chunks(synthetic, sizes):
+        state.append(chunk)
+
+    chunked = state.rfm_table().set_index('product_id')
+    full = rfm_table(synthetic).set_index('product_id')
+    #segment by segment, and every score and metric exactly
+    pd.testing.assert_series_equal(chunked['Segment'], full['Segment'])
+    pd.testing.assert_frame_equal(chunked, full, check_exact = True)
+    assert state.rows == len(synthetic)
+
+
+def test_history_snapshot_matches_rfm_table(synthetic):
+    day = synthetic['order_date'].quantile(0.6).normalize()
+    history = RFMHistory(synthetic)
+    expected = rfm_table(synthetic[synthetic['order_date'] <= day])
+    pd.testing.assert_frame_equal(history.as_of(day), expected, check_exact = True)
+
+
+def test_append_counts_ship_mode(synthetic):
+    state = IncrementalState()
+    for chunk in _chunks(synthetic, [5000, 5000]):
+        state.append(chunk)
+    expected = synthetic['ship_mode'].astype(object).value_counts()
+    pd.testing.assert_series_equal(state.ship_mode_counts.sort_index(), expected.sort_index(), check_dtype = False,
+                                   check_names = False)
+
+
+def test_append_file_skips_resent_lines(tmp_path, raw_orders):
+    path = tmp_path / 'orders.csv'
+    raw_orders.to_csv(path, index = False)
+
+    state = IncrementalState()
+    assert state.append_file(path, chunksize = 3000) == len(preprocess_orders(raw_orders))
+    counts = state.ship_mode_counts.copy()
+    pd.testing.assert_series_equal(counts.sort_index(), read_ship_mode_counts(path).sort_index())
+
+    assert state.append_file(path, chunksize = 3000) == 0
+    pd.testing.assert_series_equal(state.ship_mode_counts, counts)
+
+
+def test_non_numeric_order_id_raises(orders):
+    state = IncrementalState()
+    with pytest.raises(ValueError, match = 'order_id'):
+        state.append(orders.assign(order_id = orders['order_id'].astype(str)))
+
+
+def test_append_file_unsorted_delta(tmp_path, raw_orders, orders):
+    history, delta = tmp_path / 'history.csv', tmp_path / 'delta.csv'
+    raw_orders[raw_orders['order_id'] <= 5000].to_csv(history, index = False)
+    #the later lines in random order, so most chunks hold order ids below an earlier chunk's max
+    raw_orders[raw_orders['order_id'] > 5000].sample(frac = 1, random_state = 3).to_csv(delta, index = False)
+
+    state = IncrementalState()
+    state.append_file(history, chunksize = 2000)
+    state.append_file(delta, chunksize = 1000)
+    assert state.rows == len(orders)
+    assert state.last_order_id == raw_orders['order_id'].max()
+    pd.testing.assert_series_equal(state.ship_mode_counts.sort_index(), ship_mode_counts(raw_orders).sort_index(),
+                                   check_dtype = False, check_names = False)
+    #chunks carry their own category sets, so compare on plain keys
+    table, expected = state.rfm_table(), rfm_table(orders)
+    pd.testing.assert_frame_equal(table.assign(product_id = table['product_id'].astype(str)),
+                                  expected.assign(product_id = expected['product_id'].astype(str)), check_exact = True)
@@ -0,0 +1,60 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import order_analysis.ingest as ingest
+from order_analysis.ingest import ingest_orders, iter_orders
+from order_analysis.rfm import rfm_base, rfm_scores
+from order_analysis.topk import stream_top_movers
+
+
+@pytest.fixture(scope = 'module')
+def synthetic_path(tmp_path_factory, synthetic_raw):
+    path = tmp_path_factory.mktemp('ingest') / 'orders.csv'
+    synthetic_raw.to_csv(path, index = False)
+    return path
+
+
+def _read_count(monkeypatch):
+    #number of times the file is opened for reading
+    calls = []
+    read_csv = pd.read_csv
+
+    def counted(*args, **kwargs):
+        calls.append(args[0])
+        return read_csv(*args, **kwargs)
+
+    monkeypatch.setattr(ingest.pd, 'read_csv', counted)
+    return calls
+
+
+def _by_key(frame):
+    #chunks carry their own category sets, so compare on plain keys
+    return frame.set_axis(frame.index.astype(str))
+
+
+def test_chunks_match_full_file(synthetic_path, synthetic):
+    chunks = pd.concat(iter_orders(synthetic_path, chunksize = 3000))
+    assert (chunks['ship_mode'].astype(object) == synthetic['ship_mode'].astype(object)).all()
+
+
+@pytest.mark.parametrize('chunksize', [1000, 7777])
+def test_ingest_rfm_matches_full(synthetic_path, synthetic, chunksize):
+    cube, base = ingest_orders(synthetic_path, chunksize = chunksize)
+    full = rfm_base(synthetic)
+    pd.testing.assert_frame_equal(_by_key(base), _by_key(full), check_exact = True)
+    pd.testing.assert_frame_equal(_by_key(rfm_scores(base)), _by_key(rfm_scores(full)), check_exact = True)
+
+
+def test_stream_top_movers(synthetic_path, synthetic, monkeypatch):
+    calls = _read_count(monkeypatch)
+    table = stream_top_movers(synthetic_path, ['sub_category'], 'year', 2023, 2022, k = 5, chunksize = 3000)
+    #the ship_mode pass, the sketch pass and the exact pass
+    assert len(calls) == 3
+
+    revenue = synthetic.pivot_table(index = 'sub_category', columns = 'year', values = 'revenue', aggfunc = 'sum',
+                                    observed = True)
+    diff = (revenue[2023] - revenue[2022]).sort_values(kind = 'stable').head(5)
+    assert table['sub_category'].tolist() == diff.index.tolist()
+    np.testing.assert_allclose(table['revenue_diff'], diff.to_numpy(), rtol = 1e-9)
+
@@ -0,0 +1,81 @@
+import importlib.util
+import os
+
+import pandas as pd
+import pytest
+
+from order_analysis.batch import AGGFUNC_PICK
+from order_analysis.cache import load_orders, write_orders
+from order_analysis.engine import LazyOrders
+from order_analysis.memo import ReportCache, fingerprint
+from order_analysis.report import sales_report
+
+
+needs_duckdb = pytest.mark.skipif(importlib.util.find_spec('duckdb') is None, reason = 'duckdb is not installed')
+
+
+def test_frame_reports_come_from_memory(orders):
+    cache = ReportCache(orders)
+    report = cache.sales_report(['region'], AGGFUNC_PICK, query = 'category == "Furniture"')
+    again = cache.sales_report(['region'], AGGFUNC_PICK, query = "category=='Furniture'")
+    pd.testing.assert_frame_equal(again, report)
+    assert cache.cache.hits == 1 and cache.cache.misses == 2
+    pd.testing.assert_frame_equal(report, sales_report(orders.query('category == "Furniture"'), ['region'], 'year',
+                                                       AGGFUNC_PICK, 2023, 2022))
+
+
+def test_fingerprint_of_slices(orders):
+    assert fingerprint(orders) == fingerprint(orders.copy())
+    assert fingerprint(orders) != fingerprint(orders.query('year == 2023'))
+
+
+@pytest.fixture
+def loaded(tmp_path, orders_path):
+    return load_orders(orders_path, cache_dir = str(tmp_path / 'cache'))
+
+
+def test_loaded_slices_are_hashed(loaded):
+    #attrs travel with slices and copies, only the returned frame keeps the cache key
+    a, b = loaded.iloc[:4000], loaded.iloc[4000:8000]
+    assert fingerprint(a) != fingerprint(b)
+    doubled = loaded.assign(revenue = loaded['revenue'] * 2)
+    assert fingerprint(doubled) != fingerprint(loaded)
+    assert fingerprint(loaded.copy()) == fingerprint(loaded.reset_index(drop = True))
+
+    cache = ReportCache(a)
+    cache.sales_report(['region'], AGGFUNC_PICK)
+    cache.reset(b)
+    pd.testing.assert_frame_equal(cache.sales_report(['region'], AGGFUNC_PICK),
+                                  sales_report(b, ['region'], 'year', AGGFUNC_PICK, 2023, 2022))
+
+
+@pytest.fixture
+def path(tmp_path, orders):
+    path = str(tmp_path / 'orders.arrow')
+    write_orders(orders.reset_index(drop = True), path)
+    return path
+
+
+@needs_duckdb
+def test_lazy_fingerprint(path, orders):
+    table = LazyOrders(path)
+    assert fingerprint(table) == fingerprint(LazyOrders(path))
+    assert fingerprint(table) != fingerprint(table.query('year == 2023'))
+    assert fingerprint(LazyOrders(orders)) == fingerprint(LazyOrders(orders.copy()))
+
+
+@needs_duckdb
+def test_rewritten_file_drops_entries(path, orders):
+    cache = ReportCache(LazyOrders(path))
+    report = cache.sales_report(['region'], AGGFUNC_PICK, query = 'category == "Furniture"')
+    pd.testing.assert_frame_equal(cache.sales_report(['region'], AGGFUNC_PICK, query = 'category == "Furniture"'), report)
+    assert cache.cache.hits == 1
+
+    #the same path with other lines and a later modification time
+    modified = os.stat(path).st_mtime_ns
+    write_orders(orders[orders['region'] != 'West'].reset_index(drop = True), path)
+    os.utime(path, ns = (modified + 10 ** 9, modified + 10 ** 9))
+
+    report = cache.sales_report(['region'], AGGFUNC_PICK, query = 'category == "Furniture"')
+    assert 'West' not in report['region'].tolist()
+    assert cache.cache.hits == 1 and cache.cache.misses == 4 and len(cache.cache) == 2
@@ -0,0 +1,55 @@
+import pandas as pd
+import pytest
+
+pytest.importorskip('pyarrow')
+
+from order_analysis import trace
+from order_analysis.partition import read_partitioned, write_partitioned
+
+
+QUERIES = [None,
+           'category == "Furniture"',
+           'category == "Furniture" and month in [1, 2]',
+           'segment != "Consumer" or sell_price > 500',
+           'ship_mode not in ["Standard Class"]',
+           'city in []',
+           'city not in []',
+           #comparisons pyarrow cannot type are left to query()
+           'year == "2023"',
+           'region == 5',
+           'region == 5 or category == "Technology"']
+
+
+@pytest.fixture(scope = 'module')
+def dataset(tmp_path_factory, orders):
+    return write_partitioned(orders, str(tmp_path_factory.mktemp('partition') / 'orders'), by_category = True)
+
+
+def _plain(frame):
+    #the read order follows the partitions and categoricals keep only the categories read
+    frame = frame.astype({i : object for i in frame.columns if isinstance(frame[i].dtype, pd.CategoricalDtype)})
+    return frame.sort_values(list(frame.columns), kind = 'stable').reset_index(drop = True)
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_read_matches_query(dataset, orders, query):
+    expected = orders if query is None else orders.query(query)
+    table = read_partitioned(dataset, query)
+    assert list(table.columns) == list(orders.columns)
+    pd.testing.assert_frame_equal(_plain(table), _plain(expected), check_dtype = False)
+
+
+@pytest.mark.parametrize('query', QUERIES)
+def test_read_periods_matches_query(dataset, orders, query):
+    expected = orders[orders['year'] == 2023]
+    expected = expected if query is None else expected.query(query)
+    table = read_partitioned(dataset, query, 'year', [2023], columns = ['year', 'city', 'revenue'])
+    assert list(table.columns) == ['city', 'year', 'revenue']
+    pd.testing.assert_frame_equal(_plain(table), _plain(expected[['city', 'year', 'revenue']]), check_dtype = False)
+
+
+def test_files_counted_while_tracing(dataset):
+    with trace.tracing() as tracer:
+        read_partitioned(dataset, 'category == "Furniture"', 'year', [2023])
+    record, = [i for i in tracer.records if i['name'] == 'partition.read']
+    assert record['args']['files'] == 12
@@ -0,0 +1,133 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from order_analysis.batch import AGGFUNC_PICK
+from order_analysis.report import data_types_transform, kpi_list, period_report, sales_report
+
+
+PICK_ALL = ['revenue', 'revenue_share', 'profit', 'profit_rate', 'discount', 'discount_rate', 'avg_quantity',
+            'avg_sell_price']
+
+CASES = [(None, ['region'], 'year', 2023, 2022, PICK_ALL),
+         (None, ['segment', 'category'], 'year', 2023, 2022, AGGFUNC_PICK),
+         ('category == "Furniture"', ['sub_category'], 'year', 2023, 2022, AGGFUNC_PICK),
+         ('year == 2023', ['category', 'ship_mode'], 'month', 12, 11, PICK_ALL),
+         (None, ['month'], 'year', 2023, 2022, AGGFUNC_PICK)]
+
+
+def baseline_sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2):
+    '''sales_report of the Part 1 script (Description 2-3), as published.'''
+    aggfunc = {'revenue' : ['sum'],
+               'profit' : ['sum'],
+               'cost' : ['sum'],
+               'discount' : ['sum'],
+               'quantity' : ['mean'],
+               'list_price' : ['mean'],
+               'cost_price' : ['mean'],
+               'sell_price' : ['mean']}
+
+    table = table.pivot_table(index = index_cols, columns = cols, aggfunc = aggfunc, observed = True)
+
+    table_columns_percentage = list(set([(f'{i}_{j}').replace('_sum', '').replace('mean', 'avg')
+                                         for i, j, k in table.columns.to_flat_index()]))
+    table_columns_diff = ['revenue', 'profit_rate']
+    table.columns = ([(f'{i}_{j}_{k}').replace('_sum', '').replace('mean', 'avg')
+                      for i, j, k in table.columns.to_flat_index()])
+
+    for i in [time_1, time_2]:
+        table[f'revenue_share_{i}'] = np.where(table[f'revenue_{i}'] != 0,
+                                               (table[f'revenue_{i}'] / table[f'revenue_{i}'].sum()), 0)
+        table[f'profit_rate_{i}'] = np.where(table[f'revenue_{i}'] != 0,
+                                             (table[f'profit_{i}'] / table[f'revenue_{i}']), 0)
+        table[f'discount_rate_{i}'] = np.where(table[f'revenue_{i}'] != 0,
+                                               (table[f'discount_{i}'] / table[f'revenue_{i}']), 0)
+
+    for i in table_columns_percentage + ['revenue_share', 'profit_rate', 'discount_rate']:
+        if cols == 'year':
+            table[f'{i}_yoy'] = np.where(table[f'{i}_{time_2}'] != 0,
+                                         (table[f'{i}_{time_1}'] - table[f'{i}_{time_2}']) / table[f'{i}_{time_2}'], 0)
+        elif cols == 'month':
+            table[f'{i}_mom'] = np.where(table[f'{i}_{time_2}'] != 0,
+                                         (table[f'{i}_{time_1}'] - table[f'{i}_{time_2}']) / table[f'{i}_{time_2}'], 0)
+
+    for i in table_columns_diff:
+        table[f'{i}_diff'] = table[f'{i}_{time_1}'] - table[f'{i}_{time_2}']
+
+    for i in table.columns:
+        if 'avg' in i:
+            table.rename(columns = {i : f'avg_{i.replace("_avg", "")}'}, inplace = True)
+
+    table_columns_name = []
+    for i in aggfunc_pick:
+        for j in [f'_{time_2}', f'_{time_1}', '_diff', '_yoy', '_mom']:
+            if i + j in table.columns:
+                table_columns_name.append(i + j)
+
+    sort = []
+    for i in aggfunc_pick:
+        for j in [f'_{time_1}', '_diff']:
+            if i + j in table.columns:
+                sort.append(i + j)
+
+    return table.loc[:, table_columns_name].reset_index().sort_values(by = sort, ascending = False)
+
+
+def assert_report_equal(report, expected, rtol = 1e-9):
+    '''Same columns, rows in the same order and the same numbers (group keys compared as plain values).'''
+    assert list(report.columns) == list(expected.columns)
+    report, expected = report.reset_index(drop = True), expected.reset_index(drop = True)
+    for i in expected.columns:
+        if pd.api.types.is_numeric_dtype(expected[i]) and not pd.api.types.is_bool_dtype(expected[i]):
+            np.testing.assert_allclose(report[i].to_numpy(dtype = float), expected[i].to_numpy(dtype = float),
+                                       rtol = rtol, atol = 1e-12, err_msg = i)
+        else:
+            assert report[i].astype(str).tolist() == expected[i].astype(str).tolist(), i
+
+
+def _slice(orders, query):
+    return orders if query is None else orders.query(query)
+
+
+@pytest.mark.parametrize('query, index_cols, cols, time_1, time_2, aggfunc_pick', CASES)
+def test_sales_report_matches_baseline(orders, query, index_cols, cols, time_1, time_2, aggfunc_pick):
+    table = _slice(orders, query)
+    expected = baseline_sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+    report = sales_report(table, index_cols, cols, aggfunc_pick, time_1, time_2)
+    assert_report_equal(report, expected)
+
+    #the Star/Review lists and the formatted report follow from the same numbers
+    for lists in zip(kpi_list(report, cols), kpi_list(expected, cols)):
+        assert_report_equal(*lists)
+
+
+def test_data_types_transform(orders):
+    report = sales_report(orders, ['region'], 'year', PICK_ALL, 2023, 2022)
+    expected = baseline_sales_report(orders, ['region'], 'year', PICK_ALL, 2023, 2022)
+    assert_report_equal(data_types_transform(report, 2023, 2022), data_types_transform(expected, 2023, 2022))
+
+
+def _revenue(table, cols):
+    return table.groupby(['region'] + cols, observed = True)['revenue'].sum()
+
+
+@pytest.mark.parametrize('cols, lag, missing', [(['month'], 1, 6),
+                                                (['year', 'month'], 1, (2023, 6)),
+                                                (['year', 'month'], 12, (2022, 3))])
+def test_period_report_skips_missing_periods(orders, cols, lag, missing):
+    table = orders if cols != ['month'] else orders[orders['year'] == 2023]
+    key = missing if isinstance(missing, tuple) else (missing,)
+    table = table[(table[cols] != key).any(axis = 1)]
+    report = period_report(table, ['region'], cols if len(cols) > 1 else cols[0], lag = lag)
+
+    #every comparison is against the period lag calendar periods earlier, NaN when it has no orders
+    revenue = _revenue(table, cols)
+    suffix = 'yoy' if lag == 12 else 'mom'
+    for row in report.itertuples(index = False):
+        period = tuple(getattr(row, i) for i in cols)
+        ordinal = period[-1] - 1 + (period[0] * 12 if len(cols) > 1 else 0) - lag
+        previous = (ordinal // 12, ordinal % 12 + 1) if len(cols) > 1 else (ordinal + 1,)
+        expected = revenue.get((row.region,) + previous, np.nan)
+        np.testing.assert_allclose(row.revenue_diff, row.revenue - expected, rtol = 1e-12)
+        if previous == key:
+            assert np.isnan(getattr(row, f'revenue_{suffix}'))
@@ -0,0 +1,130 @@
+import itertools
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from order_analysis.rfm import RFM_KEYS, SEGMENTS, rfm_base, rfm_scores, rfm_segment, rfm_table, rfm_tables
+
+
+#the DAX measure of Part2. Product RFM model_DAX.txt, written out row by row
+
+
+def _percentilex_inc(values, p):
+    #rank (n - 1) * p of the sorted values, interpolated between its neighbours
+    values = sorted(values)
+    rank = (len(values) - 1) * p
+    low = int(np.floor(rank))
+    high = min(low + 1, len(values) - 1)
+    return values[low] + (rank - low) * (values[high] - values[low])
+
+
+def _dax_score(value, values, higher_is_better):
+    #SWITCH(TRUE(), [x] >= P80, 5, [x] >= P60, 4, ...) or [x] <= P20, 5, ... for recency
+    if higher_is_better:
+        for p, score in [(0.8, 5), (0.6, 4), (0.4, 3), (0.2, 2)]:
+            if value >= _percentilex_inc(values, p):
+                return score
+    else:
+        for p, score in [(0.2, 5), (0.4, 4), (0.6, 3), (0.8, 2)]:
+            if value <= _percentilex_inc(values, p):
+                return score
+    return 1
+
+
+def _dax_segment(r, f, m):
+    if f'{r}{f}{m}' == '555':
+        return '1.Star'
+    if r >= 4 and f >= 4 and m >= 4:
+        return '2.Hot Seller'
+    if r >= 4 and f <= 3 and m >= 4:
+        return '3.Potential'
+    if r <= 2 and f >= 4 and m >= 4:
+        return '4.Revival'
+    if r >= 4 and f <= 2 and m <= 3:
+        return '5.New'
+    if r <= 2 and f <= 2 and m <= 2:
+        return '6.Disposal'
+    if 2 <= r <= 4 and 2 <= f <= 4 and 2 <= m <= 4:
+        return '7.Regular'
+    return '8.Others'
+
+
+def _dax_scores(recency, frequency, monetary):
+    rows = []
+    for r, f, m in zip(recency, frequency, monetary):
+        scores = (_dax_score(r, recency, False), _dax_score(f, frequency, True), _dax_score(m, monetary, True))
+        rows.append(scores + (_dax_segment(*scores),))
+    return pd.DataFrame(rows, columns = ['RecencyScore', 'FrequencyScore', 'MonetaryScore', 'Segment'])
+
+
+def _base(recency, frequency, monetary):
+    last = pd.Timestamp('2023-12-31')
+    return pd.DataFrame({'last_order_date' : last - pd.to_timedelta(recency, unit = 'D'),
+                         'frequency' : frequency,
+                         'monetary' : monetary},
+                        index = pd.Index([f'P{i}' for i in range(len(recency))], name = 'product_id'))
+
+
+def _check_scores(table):
+    expected = _dax_scores(table['recency'].tolist(), table['frequency'].tolist(), table['monetary'].tolist())
+    for i in expected.columns:
+        np.testing.assert_array_equal(table[i].to_numpy(), expected[i].to_numpy(), err_msg = i)
+
+
+@pytest.mark.parametrize('recency, frequency, monetary', [
+    #(n - 1) * p is whole for n = 6 and 11: the cut points are values of the table, ties sit on them
+    ([0, 0, 3, 3, 3, 9], [1, 1, 1, 2, 2, 5], [10.0, 10.0, 20.0, 20.0, 30.0, 30.0]),
+    ([5, 1, 1, 2, 2, 2, 7, 7, 9, 9, 9],
+     [1, 2, 2, 2, 3, 3, 3, 4, 4, 5, 5],
+     [1.5, 2.5, 2.5, 2.5, 4.0, 4.0, 4.0, 4.0, 8.0, 9.0, 9.0]),
+    #interpolated cut points between ties
+    ([3, 3, 3, 4, 8, 8, 8, 9, 10], [2, 2, 2, 2, 2, 3, 3, 3, 7], [0.1, 0.2, 0.2, 0.2, 0.3, 0.3, 0.7, 0.7, 0.7]),
+    #every value tied
+    ([4, 4, 4, 4], [2, 2, 2, 2], [5.0, 5.0, 5.0, 5.0]),
+    ([12], [1], [99.0])])
+def test_cut_point_ties_match_dax(recency, frequency, monetary):
+    table = rfm_scores(_base(recency, frequency, monetary))
+    #recency counts from the latest order, MAX(orders[order_date])
+    np.testing.assert_array_equal(table['recency'], np.subtract(recency, min(recency)))
+    _check_scores(table)
+    assert (table['RFM_Score'] == table['RecencyScore'].astype(str) + table['FrequencyScore'].astype(str) +
+            table['MonetaryScore'].astype(str)).all()
+
+
+def test_segments_match_dax_switch():
+    triples = np.array(list(itertools.product(range(1, 6), repeat = 3)))
+    expected = [_dax_segment(*i) for i in triples]
+    assert rfm_segment(*triples.T).tolist() == expected
+    assert set(expected) == set(SEGMENTS)
+
+
+def test_rfm_table_matches_dax(orders):
+    table = rfm_table(orders)
+
+    #the DAX base table: SUMMARIZE by product, MAX(order_date), COUNT(order_id), SUM(revenue)
+    groups = orders.groupby('product_id', observed = True)
+    last_orderdate = orders['order_date'].max()
+    base = pd.DataFrame({'recency' : (last_orderdate - groups['order_date'].max()).dt.days.abs(),
+                         'frequency' : groups['order_id'].count(),
+                         'monetary' : groups['revenue'].sum()})
+    assert table['product_id'].astype(str).tolist() == base.index.astype(str).tolist()
+    np.testing.assert_array_equal(table['recency'], base['recency'])
+    np.testing.assert_array_equal(table['frequency'], base['frequency'])
+    np.testing.assert_allclose(table['monetary'], base['monetary'], rtol = 1e-12)
+
+    _check_scores(table)
+
+
+def test_rfm_tables_match_rfm_table(synthetic):
+    tables = rfm_tables(synthetic)
+    assert list(tables) == list(RFM_KEYS)
+    for name, key in RFM_KEYS.items():
+        pd.testing.assert_frame_equal(tables[name], rfm_table(synthetic, key), check_exact = True)
+
+
+def test_missing_keys_are_dropped(orders):
+    lines = orders.assign(product_id = orders['product_id'].astype(object))
+    lines.loc[lines.index[:50], 'product_id'] = None
+    base = rfm_base(lines)
+    assert base['frequency'].sum() == lines['product_id'].notna().sum()
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+
+from order_analysis.rfm import percentile_inc, rfm_base, rfm_scores
+from order_analysis.rfm_sketch import RFMSketch
+
+
+def _partitions(base, n):
+    #products split by position, so no product is in two partitions
+    return [base.iloc[i::n] for i in range(n)]
+
+
+def test_small_sketch_is_exact(orders):
+    base = rfm_base(orders)
+    sketch = RFMSketch(k = 10_000)
+    for part in _partitions(base, 3):
+        sketch.update(part)
+    cuts = sketch.cuts()
+
+    exact = rfm_scores(base)
+    for metric in ['recency', 'frequency', 'monetary']:
+        np.testing.assert_allclose(cuts[metric], percentile_inc(exact[metric]), rtol = 1e-12)
+    pd.testing.assert_frame_equal(rfm_scores(base, sketch.last_orderdate, cuts), exact)
+
+
+def test_missing_dates_are_not_sketched(orders):
+    base = rfm_base(orders)
+    missing = base.copy()
+    missing.iloc[::7, missing.columns.get_loc('last_order_date')] = pd.NaT
+
+    sketch = RFMSketch(k = 10_000).update(missing)
+    dated = missing.dropna(subset = ['last_order_date'])
+    recency = (dated['last_order_date'].max() - dated['last_order_date']).dt.days
+    np.testing.assert_allclose(sketch.cuts()['recency'], percentile_inc(recency), rtol = 1e-12)
+    assert sketch.sketches['last_order_day'].n == len(dated)
+    assert sketch.last_orderdate == dated['last_order_date'].max()
@@ -0,0 +1,8 @@
+from order_analysis.preprocessing import SHIP_MODE_OUTLIERS
+
+
+def test_dirty_ship_mode(synthetic_raw, synthetic):
+    ship_mode = synthetic_raw['Ship Mode']
+    assert ship_mode.isna().any() and ship_mode.isin(SHIP_MODE_OUTLIERS).any()
+    assert not (ship_mode == 'nan').any()
+    assert synthetic['ship_mode'].notna().all()
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from order_analysis.batch import AGGFUNC_PICK
+from order_analysis.report import sales_report, top_movers
+from order_analysis.topk import top_k
+from test_report import assert_report_equal
+
+
+VALUES = np.array([3.0, np.nan, 1.0, 3.0, -2.0, 7.0, 1.0, np.nan, 3.0, 0.5])
+
+
+@pytest.mark.parametrize('largest', [True, False])
+@pytest.mark.parametrize('k', [-3, 0, 1, 2, 4, 5, 8, 10, 25])
+def test_matches_sort_head(k, largest):
+    expected = pd.Series(VALUES).sort_values(ascending = not largest, kind = 'stable').head(max(k, 0)).index
+    positions = top_k(VALUES, k, largest)
+    assert positions.dtype == np.intp
+    assert positions.tolist() == expected.tolist()
+
+
+def test_empty_values():
+    assert top_k([], 3).tolist() == []
+    assert top_k([], 0).tolist() == []
+
+
+@pytest.mark.parametrize('largest', [False, True])
+def test_top_movers_match_full_report(orders, largest):
+    report = top_movers(orders, ['product_id'], 'year', AGGFUNC_PICK, 2023, 2022, k = 10, largest = largest)
+    full = sales_report(orders, ['product_id'], 'year', AGGFUNC_PICK, 2023, 2022)
+    expected = full.sort_values('revenue_diff', ascending = not largest, kind = 'stable').head(10)
+    assert sorted(report['product_id'].astype(str)) == sorted(expected['product_id'].astype(str))
+    expected = full[full['product_id'].isin(report['product_id'])]
+    assert_report_equal(report.sort_values('product_id').reset_index(drop = True),
+                        expected.sort_values('product_id').reset_index(drop = True))
@@ -0,0 +1,33 @@
+import threading
+
+from order_analysis import trace
+
+
+def test_disabled_stage_does_not_count_rows():
+    class Table:
+        def __len__(self):
+            raise AssertionError('len() taken while tracing is off')
+
+    with trace.stage('step', Table()) as step:
+        step.rows_out = Table()
+
+
+def test_stages_nest_per_thread():
+    barrier = threading.Barrier(2)
+
+    def work(name):
+        with trace.stage(f'{name}.outer'):
+            barrier.wait()
+            with trace.stage(f'{name}.inner'):
+                barrier.wait()
+
+    with trace.tracing(memory = True) as tracer:
+        threads = [threading.Thread(target = work, args = (i,)) for i in ['a', 'b']]
+        for i in threads:
+            i.start()
+        for i in threads:
+            i.join()
+
+    parents = {i['name'] : i['parent'] for i in tracer.records}
+    assert parents == {'a.outer' : None, 'a.inner' : 'a.outer', 'b.outer' : None, 'b.inner' : 'b.outer'}
+    assert all('alloc_peak_mb' in i for i in tracer.records)